@@ -110,7 +110,7 @@ elif form['command'].value == "run":
      print e
 
   doc = splice.splice()
-  splice.apply(doc.toxml('utf-8'))
+  splice.apply(doc)
 
 elif form['command'].value == "refresh":
 
@@ -119,7 +119,7 @@ elif form['command'].value == "refresh":
   from planet import splice
 
   doc = splice.splice()
-  splice.apply(doc.toxml('utf-8'))
+  splice.apply(doc)
 
   print "<p>Successfully refreshed</p>"
 
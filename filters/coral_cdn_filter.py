@@ -5,14 +5,17 @@ Network <http://www.coralcdn.org/>.
 
 import re, sys, urlparse, xml.dom.minidom
 
-entry = xml.dom.minidom.parse(sys.stdin).documentElement
+def filter_tree(doc, options):
+    """ remap the images in a parsed entry """
+    for node in doc.documentElement.getElementsByTagName('img'):
+        if node.hasAttribute('src'):
+            component = list(urlparse.urlparse(node.getAttribute('src')))
+            if component[0] == 'http':
+                component[1] = re.sub(r':(\d+)$', r'.\1', component[1])
+                component[1] += '.nyud.net:8080'
+                node.setAttribute('src', urlparse.urlunparse(component))
+    return doc
 
-for node in entry.getElementsByTagName('img'):
-    if node.hasAttribute('src'):
-        component = list(urlparse.urlparse(node.getAttribute('src')))
-        if component[0] == 'http':
-            component[1] = re.sub(r':(\d+)$', r'.\1', component[1])
-            component[1] += '.nyud.net:8080'
-            node.setAttribute('src', urlparse.urlunparse(component))
-
-print entry.toxml('utf-8')
+if __name__ == '__main__':
+    doc = filter_tree(xml.dom.minidom.parse(sys.stdin), {})
+    print doc.documentElement.toxml('utf-8')
@@ -20,17 +20,13 @@ from xml.dom import Node, minidom
 atomNS = 'http://www.w3.org/2005/Atom'
 planetNS = 'http://planet.intertwingly.net/'
 
-args = dict(zip([name.lstrip('-') for name in sys.argv[1::2]], sys.argv[2::2]))
-
-wrapper = textwrap.TextWrapper(width=int(args.get('width','500')))
-omit = args.get('omit', '').split()
-target = args.get('target', 'planet:excerpt')
-
 class copy:
     """ recursively copy a source to a target, up to a given width """
 
-    def __init__(self, dom, source, target):
+    def __init__(self, dom, source, target, wrapper, omit):
         self.dom = dom
+        self.wrapper = wrapper
+        self.omit = omit
         self.full = False
         self.text = []
         self.textlen = 0
@@ -49,7 +45,7 @@ class copy:
         """ copy source element to the target """
 
         # check the omit list
-        if source.nodeName in omit:
+        if source.nodeName in self.omit:
             if source.nodeName == 'img':
                return self.elideImage(source, target)
             return self.copyChildren(source, target)
@@ -79,31 +75,42 @@ class copy:
         """ copy text to the target, until the point where it would wrap """
         if not source.isspace() and source.strip():
             self.text.append(source.strip())
-        lines = wrapper.wrap(' '.join(self.text))
+        lines = self.wrapper.wrap(' '.join(self.text))
         if len(lines) == 1:
             target.appendChild(self.dom.createTextNode(source))
             self.textlen = len(lines[0])
         elif lines:
             excerpt = source[:len(lines[0])-self.textlen] + u' \u2026'
-            target.appendChild(dom.createTextNode(excerpt))
+            target.appendChild(self.dom.createTextNode(excerpt))
             self.full = True
 
-# select summary or content element
-dom = minidom.parse(sys.stdin)
-source = dom.getElementsByTagNameNS(atomNS, 'summary')
-if not source:
-    source = dom.getElementsByTagNameNS(atomNS, 'content')
-
-# if present, recursively copy it to a planet:excerpt element
-if source:
-    if target.startswith('planet:'):
-        dom.documentElement.setAttribute('xmlns:planet', planetNS)
-    if target.startswith('atom:'): target = target.split(':',1)[1]
-    excerpt = dom.createElementNS(planetNS, target)
-    source[0].parentNode.appendChild(excerpt)
-    copy(dom, source[0], excerpt)
-    if source[0].nodeName == excerpt.nodeName:
-        source[0].parentNode.removeChild(source[0])
-
-# print out results
-print dom.toxml('utf-8')
+def filter_tree(dom, options):
+    """ add an excerpt to a parsed entry """
+    wrapper = textwrap.TextWrapper(width=int(options.get('width','500')))
+    omit = options.get('omit', '').split()
+    target = options.get('target', 'planet:excerpt')
+
+    # select summary or content element
+    source = dom.getElementsByTagNameNS(atomNS, 'summary')
+    if not source:
+        source = dom.getElementsByTagNameNS(atomNS, 'content')
+
+    # if present, recursively copy it to a planet:excerpt element
+    if source:
+        if target.startswith('planet:'):
+            dom.documentElement.setAttribute('xmlns:planet', planetNS)
+        if target.startswith('atom:'): target = target.split(':',1)[1]
+        excerpt = dom.createElementNS(planetNS, target)
+        source[0].parentNode.appendChild(excerpt)
+        copy(dom, source[0], excerpt, wrapper, omit)
+        if source[0].nodeName == excerpt.nodeName:
+            source[0].parentNode.removeChild(source[0])
+
+    return dom
+
+if __name__ == '__main__':
+    args = dict(zip([name.lstrip('-') for name in sys.argv[1::2]],
+        sys.argv[2::2]))
+
+    # print out results
+    print filter_tree(minidom.parse(sys.stdin), args).toxml('utf-8')
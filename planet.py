@@ -71,9 +71,11 @@ if __name__ == "__main__":
             print e
 
     from planet import splice
-    doc = splice.splice()
-
-    if debug_splice:
+    if not debug_splice:
+        # stream the spliced document from the cache to the templates
+        doc = splice.stream()
+    else:
+        doc = splice.splice()
         from planet import logger
         logger.info('writing debug.atom')
         debug=open('debug.atom','w')
@@ -86,11 +88,11 @@ if __name__ == "__main__":
             debug.write(doc.toprettyxml(indent='  ', encoding='utf-8'))
         debug.close
 
-    splice.apply(doc.toxml('utf-8'))
+    changed = splice.apply(doc)
 
     if config.pubsubhubbub_hub() and not no_publish:
         from planet import publish
-        publish.publish(config)
+        publish.publish(config, changed)
 
     if expunge:
         from planet import expunge
@@ -3,7 +3,7 @@ xmlns = 'http://planet.intertwingly.net/'
 logger = None
 loggerParms = None
 
-import os, sys, re
+import os, sys, re, time
 import config
 config.__init__()
 
@@ -32,6 +32,20 @@ def getLogger(level, format):
     loggerParms = (level,format)
     return logger
 
+# formatted dates, by format and time
+formatted_dates = {}
+
+def strftime(format, value):
+    """ time.strftime, remembering the results; the same handful of dates
+        are typically formatted many times over, in several formats """
+    key = (format, tuple(value))
+    try:
+        return formatted_dates[key]
+    except KeyError:
+        if len(formatted_dates) > 10000: formatted_dates.clear()
+        formatted = formatted_dates[key] = time.strftime(format, value)
+        return formatted
+
 sys.path.insert(1, os.path.join(os.path.dirname(__file__),'vendor'))
 
 # Configure feed parser
@@ -0,0 +1,294 @@
+"""
+Archive pages, rendered from every entry in the cache.
+
+Splice only includes the newest entries, so older entries drop out of the
+output.  When the archive option is set, a page is also rendered for each
+day, month and/or subscribed feed, containing every cached entry for that
+period or feed, by applying the archive_templates within a subdirectory of
+the output directory, such as archive/2006/01/index.html or
+archive/feeds/example.com,feed/index.html.
+
+The date and source of each cached entry are recorded within the cache, so
+that only entries which are new or modified since the previous run are
+read, and a digest of the names, modification times and sizes of the
+entries on each page is recorded alongside, so that only the pages whose
+entries have changed are rendered again.  Pages left without any entries
+are removed.
+
+Usage:
+  from planet import archive
+  archive.update(doc, output)
+"""
+
+import os, stat, time
+from xml.dom import minidom
+from xml.parsers import expat
+import planet
+from planet import config, memo, shell
+from planet.spider import filename
+
+atomNS = 'http://www.w3.org/2005/Atom'
+
+def entry_info(path):
+    """ the updated date of a cached entry, and the ids of its source """
+    doc = minidom.parse(path)
+    try:
+        updated = None
+        ids = []
+        for node in doc.documentElement.childNodes:
+            if node.nodeType != node.ELEMENT_NODE: continue
+            if node.namespaceURI != atomNS: continue
+            if node.localName == 'updated':
+                updated = text(node)
+            elif node.localName == 'source':
+                for child in node.childNodes:
+                    if child.nodeType != child.ELEMENT_NODE: continue
+                    if (child.namespaceURI, child.localName) in \
+                        [(atomNS, 'id'), (planet.xmlns, 'id')]:
+                        if text(child) not in ids: ids.append(text(child))
+        return updated, ids
+    finally:
+        doc.unlink()
+
+def text(node):
+    """ the text content of an element, as UTF-8 """
+    return ''.join([child.nodeValue for child in node.childNodes
+        if child.nodeType == child.TEXT_NODE]).strip().encode('utf-8')
+
+class _Prefix(Exception): pass
+
+def prefix(doc):
+    """ the spliced planet.model.Model doc, parsed by minidom, up to but not
+        including its first entry; the stream of pieces is only read that
+        far, so that the entries need not be held in memory """
+    if hasattr(doc.doc, 'toxml'): return doc.doc
+    if doc.memo.has_key('dom'): return doc.memo['dom']
+
+    depth, index = [0], [None]
+    def start(name, attrs):
+        depth[0] += 1
+        if depth[0] == 2 and name == atomNS + ' entry':
+            index[0] = parser.CurrentByteIndex
+            raise _Prefix
+    def end(name):
+        depth[0] -= 1
+
+    parser = expat.ParserCreate(None, ' ')
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    pieces = []
+    stream = iter(doc.stream())
+    try:
+        try:
+            for piece in stream:
+                pieces.append(piece)
+                parser.Parse(piece)
+            parser.Parse('', True)
+            data = ''.join(pieces)
+        except _Prefix:
+            data = ''.join(pieces)[:index[0]] + '</feed>'
+    finally:
+        if hasattr(stream, 'close'): stream.close()
+    return minidom.parseString(data)
+
+def header(doc):
+    """ a copy of a spliced planet.model.Model without any of its entries,
+        and the ids of its subscriptions """
+    dom = prefix(doc)
+    feed = dom.documentElement
+    copy = dom.implementation.createDocument(feed.namespaceURI,
+        feed.tagName, None)
+    for name, value in feed.attributes.items():
+        copy.documentElement.setAttribute(name, value)
+
+    sub_ids = []
+    for node in feed.childNodes:
+        if node.nodeType == node.ELEMENT_NODE:
+            if (node.namespaceURI, node.localName) == (atomNS, 'entry'):
+                continue
+            if (node.namespaceURI, node.localName) == (planet.xmlns,'source'):
+                for child in node.getElementsByTagNameNS(atomNS, 'id'):
+                    sub_ids.append(text(child))
+        copy.documentElement.appendChild(copy.importNode(node, True))
+    return copy, sub_ids
+
+class Archive:
+    """ the cached entries, and the archive pages last rendered from them """
+
+    def __init__(self, directory):
+        self.entries_path = os.path.join(directory, 'archive_entries')
+        self.pages_path = os.path.join(directory, 'archive_pages')
+        self.entries = {}
+        self.pages = {}
+        self.load()
+
+    def load(self):
+        """ read the entries and pages recorded by a previous run, if any """
+        for path, parse in [(self.entries_path, self.parse_entry),
+                            (self.pages_path, self.parse_page)]:
+            try:
+                file = open(path)
+            except IOError:
+                continue
+            try:
+                for line in file:
+                    try:
+                        parse(line.rstrip('\n'))
+                    except ValueError:
+                        pass
+            finally:
+                file.close()
+
+    def parse_entry(self, line):
+        mtime, size, updated, name, ids = (line + ' ').split(' ', 4)
+        if updated == '-': updated = None
+        self.entries[name] = (float(mtime), int(size), updated, ids.split())
+
+    def parse_page(self, line):
+        digest, path = line.split(' ', 1)
+        self.pages[path] = digest
+
+    def scan(self, cache):
+        """ bring the entries up to date with the cache directory, reading
+            only those which are new or have been modified """
+        log = planet.logger
+        entries = {}
+        for name in os.listdir(cache):
+            path = os.path.join(cache, name)
+            try:
+                status = os.stat(path)
+            except OSError:
+                continue
+            if stat.S_ISDIR(status.st_mode): continue
+
+            entry = self.entries.get(name)
+            if not entry or entry[:2] != (status.st_mtime, status.st_size):
+                try:
+                    updated, ids = entry_info(path)
+                except Exception, e:
+                    log.error("Error parsing %s: %s", path, e)
+                    updated, ids = None, []
+                entry = (status.st_mtime, status.st_size, updated, ids)
+            entries[name] = entry
+        self.entries = entries
+
+    def group(self, kinds, sub_ids):
+        """ the entries on each page, by the path of the page, newest first """
+        pages = {}
+        for name, (mtime, size, updated, ids) in self.entries.items():
+            for id in ids:
+                if id in sub_ids: break
+            else:
+                continue
+
+            if not updated:
+                updated = time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                    time.gmtime(mtime))
+            paths = []
+            if 'day' in kinds:
+                paths.append('/'.join([updated[:4],updated[5:7],updated[8:10]]))
+            if 'month' in kinds:
+                paths.append('/'.join([updated[:4], updated[5:7]]))
+            if 'feed' in kinds:
+                paths.append('feeds/' + filename('', id))
+            for path in paths:
+                pages.setdefault(path, []).append((updated, name, mtime, size))
+
+        for entries in pages.values():
+            entries.sort()
+            entries.reverse()
+        return pages
+
+    def save(self):
+        """ record the entries and pages for use by the next run """
+        dir = os.path.dirname(self.entries_path)
+        if dir and not os.path.exists(dir): os.makedirs(dir)
+
+        from planet.manifest import replace
+        for path, lines in [
+            (self.entries_path, ['%r %d %s %s %s\n' % (mtime, size,
+                updated or '-', name, ' '.join(ids))
+                for name, (mtime, size, updated, ids) in
+                self.entries.items()]),
+            (self.pages_path, ['%s %s\n' % (digest, path)
+                for path, digest in self.pages.items()])]:
+            lines.sort()
+            temp = '%s.tmp%d' % (path, os.getpid())
+            file = open(temp, 'w')
+            try:
+                file.writelines(lines)
+            finally:
+                file.close()
+            replace(temp, path)
+
+def templates(template_files):
+    """ a digest of the names and modification times of the templates """
+    stamps = []
+    for template_file in template_files:
+        resolved = shell.resolve(template_file)
+        if resolved:
+            stamps.append('%s %r' % (template_file,
+                os.stat(resolved[0]).st_mtime))
+    return memo.digest(*stamps)
+
+def remove(output, root, path):
+    """ remove the files written to the directory path, relative to root
+        within the output directory, and any directories left empty;
+        output is a planet.manifest.Manifest """
+    for name in output.entries.keys():
+        if os.path.dirname(name) == os.path.join(root, path):
+            output.remove(name)
+
+    root = os.path.join(config.output_dir(), root)
+    path = os.path.join(root, path)
+    while path != root and os.path.isdir(path) and not os.listdir(path):
+        os.rmdir(path)
+        path = os.path.dirname(path)
+
+def update(doc, output):
+    """ render the archive pages, for the spliced planet.model.Model doc,
+        whose entries have changed, and remove pages which no longer have
+        any entries; output is a planet.manifest.Manifest """
+    from planet.model import Model
+    from planet.splice import render
+    log = planet.logger
+    cache = config.cache_directory()
+    directory = config.archive_directory()
+
+    archive = Archive(config.cache_output_directory())
+    archive.scan(cache)
+    page, sub_ids = header(doc)
+    template_files = config.archive_templates() or config.template_files()
+    stamp = templates(template_files)
+    pages = archive.group(config.archive(), sub_ids)
+
+    for path, entries in pages.items():
+        digest = memo.digest(stamp, *['%s %r %d' % (name, mtime, size)
+            for updated, name, mtime, size in entries])
+        if archive.pages.get(path) == digest: continue
+
+        log.info("Rendering archive page %s", path)
+        copy = page.cloneNode(True)
+        for updated, name, mtime, size in entries:
+            entry = minidom.parse(os.path.join(cache, name))
+            copy.documentElement.appendChild(entry.documentElement)
+
+        model = Model(copy)
+        try:
+            for template_file in template_files:
+                render(template_file, model, output,
+                    os.path.join(directory, path))
+            archive.pages[path] = digest
+        except Exception, e:
+            log.error("Error rendering archive page %s: %s", path, e)
+            if archive.pages.has_key(path): del archive.pages[path]
+        model.close()
+
+    # remove pages which no longer have entries
+    for path in archive.pages.keys():
+        if pages.has_key(path): continue
+        log.info("Removing archive page %s", path)
+        remove(output, directory, path)
+        del archive.pages[path]
+
+    archive.save()
@@ -113,15 +113,29 @@ def __init__():
     define_planet('pubsubhubbub_hub', '')
     define_planet_list('pubsubhubbub_feeds', 'atom.xml rss10.xml rss20.xml')
     define_planet_bool('post_to_twitter')
+    define_planet_bool('filter_cache')
+    define_planet_bool('sanitize_cache')
+    define_planet_bool('precompress')
+    define_planet_bool('search_index')
+    define_planet('etag_manifest', '')
+    define_planet('archive_directory', 'archive')
+    define_planet('subscription_directory', 'subscriptions')
+    define_planet('search_directory', 'search')
 
     define_planet_int('new_feed_items', 0) 
     define_planet_int('feed_timeout', 20)
     define_planet_int('cache_keep_entries', 10)
+    define_planet_int('filter_cache_size', 10240)
+    define_planet_int('sanitize_cache_size', 10240)
+    define_planet_int('template_processes', 0)
 
     define_planet_list('template_files')
     define_planet_list('bill_of_materials')
     define_planet_list('template_directories', '.')
     define_planet_list('filter_directories')
+    define_planet_list('archive')
+    define_planet_list('archive_templates')
+    define_planet_list('subscription_templates')
 
     # template options
     define_tmpl_int('days_per_page', 0)
@@ -153,7 +167,8 @@ def load(config_file):
     parser.read(config_file)
 
     import config, planet
-    from planet import opml, foaf, csv_config
+    from planet import opml, foaf, csv_config, shell
+    shell.reset()
     log = planet.logger
     if not log:
         log = planet.getLogger(config.log_level(),config.log_format())
@@ -352,6 +367,34 @@ def cache_blacklist_directory():
     else:
         return os.path.join(cache_directory(), 'blacklist')
 
+def filter_cache_directory():
+    if parser.has_option('Planet', 'filter_cache_directory'):
+        return os.path.join(cache_directory(),
+            parser.get('Planet', 'filter_cache_directory'))
+    else:
+        return os.path.join(cache_directory(), 'filters')
+
+def sanitize_cache_directory():
+    if parser.has_option('Planet', 'sanitize_cache_directory'):
+        return os.path.join(cache_directory(),
+            parser.get('Planet', 'sanitize_cache_directory'))
+    else:
+        return os.path.join(cache_directory(), 'sanitized')
+
+def cache_output_directory():
+    if parser.has_option('Planet', 'cache_output_directory'):
+        return os.path.join(cache_directory(),
+            parser.get('Planet', 'cache_output_directory'))
+    else:
+        return os.path.join(cache_directory(), 'output')
+
+def template_cache_directory():
+    if parser.has_option('Planet', 'template_cache_directory'):
+        return os.path.join(cache_directory(),
+            parser.get('Planet', 'template_cache_directory'))
+    else:
+        return os.path.join(cache_directory(), 'templates')
+
 def cache_lists_directory():
     if parser.has_option('Planet', 'cache_lists_directory'):
         return parser.get('Planet', 'cache_lists_directory')
@@ -378,7 +421,8 @@ def feedtype():
 def subscriptions():
     """ list the feed subscriptions """
     return __builtins__['filter'](lambda feed: feed != 'Planet' and 
-        feed not in template_files()+filters()+reading_lists(),
+        feed not in template_files()+archive_templates()+
+            subscription_templates()+filters()+reading_lists(),
         parser.sections())
 
 def reading_lists():
@@ -2,6 +2,7 @@
 import glob, os, planet, config, feedparser
 from xml.dom import minidom
 from spider import filename
+from planet import idindex
 
 def expungeCache():
     """ Expunge old entries from a cache of entries """
@@ -25,6 +26,9 @@ def expungeCache():
     dir.sort()
     dir.reverse()
 
+    # the feeds whose entries are removed
+    expunged = set()
+
     for mtime,file in dir:
 
         try:
@@ -60,8 +64,12 @@ def expungeCache():
                     file, ids[0].childNodes[0].nodeValue)
             # remove old entry
             os.unlink(file)
+            expunged.add(ids[0].childNodes[0].nodeValue)
 
         except:
             log.error("Error parsing %s", file)
 
+    # so that the pages of those feeds are rendered again
+    idindex.touch(expunged)
+
 # end of expungeCache()
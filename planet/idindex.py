@@ -1,5 +1,5 @@
 from glob import glob
-import os, sys
+import os, sys, __builtin__
 
 if __name__ == '__main__':
     rootdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -20,6 +20,40 @@ def open():
         from planet import logger as log
         log.error(str(e))
 
+def touch(ids):
+    """ record the ids of feeds whose cached entries have changed """
+    cache = config.cache_directory()
+    index=os.path.join(cache,'index')
+    if not ids or not os.path.exists(index): return
+    file = __builtin__.open(os.path.join(index, 'touched'), 'a')
+    try:
+        for id in ids:
+            if type(id) == unicode: id = id.encode('utf-8')
+            file.write(id + '\n')
+    finally:
+        file.close()
+
+def touched():
+    """ the ids of the feeds recorded by touch since the last reset, or
+        None if there is no index """
+    cache = config.cache_directory()
+    index=os.path.join(cache,'index')
+    if not os.path.exists(index): return None
+    try:
+        file = __builtin__.open(os.path.join(index, 'touched'))
+    except IOError:
+        return set()
+    try:
+        return set([line.rstrip('\n') for line in file if line.strip()])
+    finally:
+        file.close()
+
+def reset():
+    """ forget the feeds recorded by touch """
+    cache = config.cache_directory()
+    touched = os.path.join(cache, 'index', 'touched')
+    if os.path.exists(touched): os.unlink(touched)
+
 def destroy():
     from planet import logger as log
     cache = config.cache_directory()
@@ -27,6 +61,7 @@ def destroy():
     if not os.path.exists(index): return None
     idindex = filename(index, 'id')
     if os.path.exists(idindex): os.unlink(idindex)
+    reset()
     os.removedirs(index)
     log.info(idindex + " deleted")
 
@@ -0,0 +1,228 @@
+"""
+The parts of the DOM used by planet.reconstitute, backed by lxml.
+
+When lxml is available, reconstitute builds each entry as an lxml tree,
+which is more compact, and faster to build and to walk, than an
+xml.dom.minidom one.  The tree is serialized to exactly the bytes minidom
+would produce, so the cache is the same whichever is used.
+
+Only the calls reconstitute makes are provided: a Document creates
+elements and text nodes, and elements are given attributes and children.
+Nodes from other DOMs, such as the parsed and sanitized content produced
+by html5lib, may be appended to an element, and are copied into the tree.
+
+Namespace declarations are made by the elements, rather than by setting
+xmlns attributes; a copied node's prefixes are resolved in the same way as
+they would be were it serialized by minidom.
+"""
+
+import re
+from xml.dom import Node
+from lxml import etree
+
+xmlNS = 'http://www.w3.org/XML/1998/namespace'
+
+# the prefixes declared by every document, for use by elements which have
+# yet to be appended to one
+namespaces = {'xml': xmlNS}
+illegal_xml_chars = re.compile(u"[\x00-\x08\x0B\x0C\x0E-\x1F\ufffe\uffff]")
+
+def clean(value):
+    """ a unicode string, without the characters XML does not allow """
+    if isinstance(value, str):
+        try:
+            value = value.decode('utf-8')
+        except:
+            value = value.decode('iso-8859-1')
+    return illegal_xml_chars.sub(u'\ufffd', value)
+
+def split(name):
+    """ the prefix, if any, and local part of a qualified name """
+    if name.find(':') < 0: return None, name
+    return tuple(name.split(':', 1))
+
+def append_text(parent, data):
+    """ append text to an element, after any children it already has """
+    if len(parent):
+        parent[-1].tail = (parent[-1].tail or u'') + clean(data)
+    else:
+        parent.text = (parent.text or u'') + clean(data)
+
+def append_copy(parent, node):
+    """ append a copy of an xml.dom node to an element, without recursion,
+        as arbitrarily nested html survives the sanitizer """
+    stack = [(parent, iter([node]))]
+    while stack:
+        parent, children = stack[-1]
+        for child in children:
+            if child.nodeType == Node.ELEMENT_NODE:
+                stack.append((copy_element(parent, child),
+                    iter(child.childNodes)))
+                break
+            elif child.nodeType in (Node.TEXT_NODE, Node.CDATA_SECTION_NODE):
+                append_text(parent, child.data)
+            elif child.nodeType == Node.COMMENT_NODE:
+                try:
+                    parent.append(etree.Comment(clean(child.data)))
+                except ValueError:
+                    pass
+        else:
+            stack.pop()
+
+def copy_element(parent, node):
+    """ append a copy of an xml.dom element, without its children """
+    attributes = node.attributes.items()
+
+    nsmap = {}
+    for name, value in attributes:
+        if name == 'xmlns':
+            nsmap[None] = value
+        elif name.startswith('xmlns:'):
+            nsmap[name[6:]] = value
+    scope = parent.nsmap
+    scope.update(nsmap)
+    scope['xml'] = xmlNS
+
+    prefix, local = split(node.tagName)
+    namespace = scope.get(prefix, scope.get(None))
+    if namespace: local = '{%s}%s' % (namespace, local)
+    element = etree.SubElement(parent, local, nsmap=nsmap)
+
+    for name, value in attributes:
+        if name == 'xmlns' or name.startswith('xmlns:'): continue
+        prefix, local = split(name)
+        if prefix:
+            if not scope.get(prefix): continue
+            local = '{%s}%s' % (scope[prefix], local)
+        element.set(local, clean(value))
+
+    return element
+
+def escape(data):
+    """ escape text or an attribute value, as minidom does """
+    return data.replace('&', '&amp;').replace('<', '&lt;'). \
+        replace('"', '&quot;').replace('>', '&gt;')
+
+def serialize(root):
+    """ the pieces of an element, serialized exactly as minidom would: with
+        the attributes, including namespace declarations, of each element
+        sorted by name, and quotes in text escaped """
+    scopes = [{}]
+    tags = []
+    for event, element in etree.iterwalk(root, events=('start', 'end')):
+        if element.tag is etree.Comment:
+            if event == 'start':
+                yield u'<!--%s-->' % element.text
+                if element.tail: yield escape(element.tail)
+            continue
+
+        if event == 'end':
+            scopes.pop()
+            tag = tags.pop()
+            if element.text is not None or len(element):
+                yield u'</%s>' % tag
+            if element.tail: yield escape(element.tail)
+            continue
+
+        # namespaces declared by this element
+        nsmap = element.nsmap
+        attributes = [(prefix and 'xmlns:' + prefix or 'xmlns', uri)
+            for prefix, uri in nsmap.items()
+            if scopes[-1].get(prefix) != uri]
+        scopes.append(nsmap)
+
+        for key, value in element.items():
+            attributes.append((name(key, nsmap, True), value))
+        attributes.sort()
+
+        tag = name(element.tag, nsmap)
+        tags.append(tag)
+        yield u'<' + tag + u''.join([u' %s="%s"' % (key, escape(value))
+            for key, value in attributes])
+        if element.text is not None or len(element):
+            yield u'>'
+            if element.text: yield escape(element.text)
+        else:
+            yield u'/>'
+
+def name(key, nsmap, attribute=False):
+    """ the qualified name of an element or attribute """
+    if not key.startswith('{'): return key
+    uri, local = key[1:].split('}', 1)
+    if uri == xmlNS: return 'xml:' + local
+    if not attribute and nsmap.get(None) == uri: return local
+    for prefix, value in nsmap.items():
+        if value == uri and prefix: return prefix + ':' + local
+    return local
+
+class Element(etree.ElementBase):
+    """ an element, with the DOM methods used by reconstitute """
+
+    @property
+    def ownerDocument(self):
+        return Document(self.getroottree().getroot())
+
+    def setAttribute(self, name, value):
+        if name == 'xmlns' or name.startswith('xmlns:'): return
+        prefix, local = split(name)
+        if prefix:
+            namespace = self.nsmap.get(prefix) or namespaces.get(prefix)
+            if namespace: local = '{%s}%s' % (namespace, local)
+        self.set(local, clean(value))
+
+    def appendChild(self, child):
+        if isinstance(child, etree._Element):
+            self.append(child)
+        else:
+            append_copy(self, child)
+        return child
+
+class Text:
+    """ a text node, which becomes the text or tail it is appended as """
+    nodeType = Node.TEXT_NODE
+
+    def __init__(self, data):
+        self.data = data
+
+parser = etree.XMLParser()
+parser.set_element_class_lookup(etree.ElementDefaultClassLookup(Element))
+
+class Document:
+    """ a document, with the DOM methods used by reconstitute """
+
+    def __init__(self, documentElement):
+        self.documentElement = documentElement
+
+    def createElementNS(self, namespace, name):
+        prefix, local = split(name)
+        if not namespace: return parser.makeelement(local)
+        return parser.makeelement('{%s}%s' % (namespace, local),
+            nsmap={prefix: namespace})
+
+    def createTextNode(self, data):
+        return Text(data)
+
+    def importNode(self, node, deep):
+        # nodes are copied when they are appended
+        return node
+
+    def toxml(self, encoding=None):
+        root = self.documentElement
+        etree.cleanup_namespaces(root, top_nsmap=root.nsmap)
+        xml = u''.join(serialize(root))
+        if not encoding: return u'<?xml version="1.0" ?>' + xml
+        return ('<?xml version="1.0" encoding="%s"?>' % encoding +
+            xml).encode(encoding)
+
+    def writexml(self, writer, indent="", addindent="", newl=""):
+        writer.write(self.toxml())
+
+    def unlink(self):
+        pass
+
+def document(namespace, name, nsmap):
+    """ a document, containing an empty element """
+    for prefix, uri in nsmap.items():
+        if prefix: namespaces[prefix] = uri
+    return Document(parser.makeelement('{%s}%s' % (namespace, name),
+        nsmap=nsmap))
@@ -0,0 +1,236 @@
+"""
+Write generated files only when their content changes.
+
+A manifest, kept within the cache directory, records the hash, size and
+modification time of every file written to the output directory.  Content
+identical to that written by a previous run is not written again, so the
+file keeps its modification time; anything else is written to a temporary
+file which is then renamed into place, so readers never see a partially
+written file.
+
+Optionally, each file may also be accompanied by precompressed gzip (and,
+if the brotli module is installed, brotli) siblings, which are regenerated
+only when the content changes, and by a list of strong ETags for every file,
+for the benefit of web servers which serve the output directory.
+
+Usage:
+  from planet import manifest
+  output = manifest.Manifest('output', 'cache/output/manifest')
+  output.write('index.html', data)
+  output.save()
+  print output.changed()
+"""
+
+import os
+from StringIO import StringIO
+
+try:
+  from hashlib import md5
+except:
+  from md5 import new as md5
+
+def compress_gzip(data):
+    """ compress data with gzip, omitting the name and time stamp so that
+        the result depends only on the data """
+    import gzip
+    buffer = StringIO()
+    file = gzip.GzipFile('', 'wb', 9, buffer, 0)
+    file.write(data)
+    file.close()
+    return buffer.getvalue()
+
+# the extensions of every kind of precompressed sibling
+extensions = ['.gz', '.br']
+
+def compressors():
+    """ list (extension, function) for each available compression """
+    result = [('.gz', compress_gzip)]
+    try:
+        import brotli
+        result.append(('.br', brotli.compress))
+    except ImportError:
+        pass
+    return result
+
+def replace(temp, path):
+    """ rename temp to path, replacing path atomically where possible """
+    try:
+        os.rename(temp, path)
+    except OSError:
+        # Windows will not rename over an existing file
+        os.unlink(path)
+        os.rename(temp, path)
+
+class Manifest:
+    """ the files in an output directory, as last written """
+
+    def __init__(self, directory, path, precompress=False):
+        self.directory = directory
+        self.path = path
+        self.entries = {}
+        self.updates = {}
+        self.compressors = precompress and compressors() or []
+        self.load()
+
+    def load(self):
+        """ read the manifest written by a previous run, if any """
+        try:
+            file = open(self.path)
+        except IOError:
+            return
+        try:
+            for line in file:
+                try:
+                    hash, size, mtime, name = line.rstrip('\n').split(' ', 3)
+                    self.entries[name] = (hash, int(size), float(mtime))
+                except ValueError:
+                    pass
+        finally:
+            file.close()
+
+    def current(self, name):
+        """ determine if the named file has not been modified since it was
+            last recorded """
+        entry = self.entries.get(name)
+        if not entry: return False
+        try:
+            stat = os.stat(os.path.join(self.directory, name))
+        except OSError:
+            return False
+        return (stat.st_size, stat.st_mtime) == entry[1:]
+
+    def unchanged(self, name, hash, size):
+        """ determine if the named file is known to hold content with the
+            given hash, and has not been modified since it was written """
+        entry = self.entries.get(name)
+        if not entry or entry[:2] != (hash, size): return False
+        return self.current(name)
+
+    def write(self, name, data):
+        """ write data to the named file, unless it already holds exactly
+            that; returns true if the file was written """
+        hash = md5(data).hexdigest()
+        changed = not self.unchanged(name, hash, len(data))
+        if changed: self.store(name, data, hash)
+        self.compress(name, lambda: data, changed)
+        return changed
+
+    def track(self, name):
+        """ record a file placed in the directory by other means, such as a
+            copy; returns true if its content has changed """
+        path = os.path.join(self.directory, name)
+        def read():
+            file = open(path, 'rb')
+            try:
+                return file.read()
+            finally:
+                file.close()
+
+        if self.current(name):
+            changed = False
+        else:
+            data = read()
+            read = lambda: data
+            hash = md5(data).hexdigest()
+            entry = self.entries.get(name)
+            changed = not entry or entry[0] != hash
+            stat = os.stat(path)
+            self.record(name, (hash, stat.st_size, stat.st_mtime))
+        self.compress(name, read, changed)
+        return changed
+
+    def compress(self, name, read, changed):
+        """ produce precompressed siblings of a file, if enabled; they are
+            only regenerated if the file changed, or they are missing.  Those
+            written when a compression was enabled, and which it no longer
+            is, are removed, as they would otherwise go out of date """
+        enabled = dict(self.compressors)
+        for extension in extensions:
+            if enabled.has_key(extension):
+                if changed or not self.current(name + extension):
+                    data = enabled[extension](read())
+                    self.store(name + extension, data, md5(data).hexdigest())
+            elif self.entries.has_key(name + extension):
+                self.discard(name + extension)
+
+    def store(self, name, data, hash):
+        """ write data to the named file, atomically, and record it """
+        path = os.path.join(self.directory, name)
+        dir = os.path.dirname(path)
+        if dir and not os.path.exists(dir): os.makedirs(dir)
+
+        temp = '%s.tmp%d' % (path, os.getpid())
+        file = open(temp, 'wb')
+        try:
+            file.write(data)
+        finally:
+            file.close()
+        replace(temp, path)
+
+        stat = os.stat(path)
+        self.record(name, (hash, stat.st_size, stat.st_mtime))
+
+    def remove(self, name):
+        """ remove the named file, and any precompressed siblings """
+        for file in [name] + [name + extension for extension in extensions]:
+            self.discard(file)
+
+    def discard(self, name):
+        """ remove the named file, if present, and forget it """
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path): os.unlink(path)
+        if self.entries.has_key(name): self.record(name, None)
+
+    def etags(self, exclude=[]):
+        """ a strong ETag for each file, in JSON, keyed by name """
+        import json
+        return json.dumps(dict([(name, '"%s"' % entry[0])
+            for name, entry in self.entries.items() if name not in exclude]),
+            indent=0, sort_keys=True)
+
+    def write_etags(self, name):
+        """ write the list of ETags, for every file but the list itself, to
+            the named file """
+        data = self.etags([name] + [name + extension
+            for extension in extensions])
+        hash = md5(data).hexdigest()
+        if not self.unchanged(name, hash, len(data)):
+            self.store(name, data, hash)
+
+    def record(self, name, entry):
+        """ note the new state of a file; None means it has been removed """
+        if entry:
+            self.entries[name] = entry
+        elif self.entries.has_key(name):
+            del self.entries[name]
+        self.updates[name] = entry
+
+    def update(self, updates):
+        """ merge in the updates made by another Manifest instance, such as
+            one used by a child process """
+        for name, entry in updates.items():
+            self.record(name, entry)
+
+    def changed(self):
+        """ names of the files written since this manifest was loaded """
+        names = [name for name, entry in self.updates.items() if entry]
+        names.sort()
+        return names
+
+    def save(self):
+        """ write the manifest for use by the next run """
+        if not self.updates: return
+        dir = os.path.dirname(self.path)
+        if dir and not os.path.exists(dir): os.makedirs(dir)
+
+        names = self.entries.keys()
+        names.sort()
+        temp = '%s.tmp%d' % (self.path, os.getpid())
+        file = open(temp, 'w')
+        try:
+            for name in names:
+                hash, size, mtime = self.entries[name]
+                file.write('%s %d %r %s\n' % (hash, size, mtime, name))
+        finally:
+            file.close()
+        replace(temp, self.path)
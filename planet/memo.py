@@ -0,0 +1,126 @@
+"""
+Persistent, size bounded memoization of expensive results.
+
+Each result is stored as a separate file, named by a digest of everything
+which determines its value, in a directory which is typically located
+within the cache directory; results are therefore shared across runs.
+Files are touched when used, and the least recently used ones are removed
+once the total size of the directory exceeds a limit.
+
+Usage:
+  from planet import memo
+  store = memo.Memo('cache/filters', 1024*1024)
+
+  key = memo.digest(input, name, options)
+  result = store.get(key)
+  if result is None:
+      result = compute(input)
+      store.put(key, result)
+"""
+
+import os
+from planet.manifest import replace
+
+try:
+  from hashlib import md5
+except:
+  from md5 import new as md5
+
+def digest(*parts):
+    """ compute a key from a list of (byte or unicode) strings """
+    hash = md5()
+    for part in parts:
+        if isinstance(part, unicode): part = part.encode('utf-8')
+        hash.update('%d:%s' % (len(part), part))
+    return hash.hexdigest()
+
+class Memo:
+    """ a directory of results, evicted in least recently used order """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.size = None
+
+    def path(self, key):
+        """ file name used to store a given key """
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """ return the stored result for key, or None if not present """
+        path = self.path(key)
+        try:
+            file = open(path, 'rb')
+            try:
+                data = file.read()
+            finally:
+                file.close()
+        except IOError:
+            return None
+
+        # mark as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        return data
+
+    def put(self, key, data):
+        """ store a result, evicting older results if necessary """
+        path = self.path(key)
+        dir = os.path.dirname(path)
+        if not os.path.exists(dir): os.makedirs(dir)
+
+        # write to a temporary file and rename, so readers never see a
+        # partial result
+        temp = '%s.tmp%d' % (path, os.getpid())
+        file = open(temp, 'wb')
+        try:
+            file.write(data)
+        finally:
+            file.close()
+        try:
+            replaced = os.stat(path).st_size
+        except OSError:
+            replaced = 0
+        replace(temp, path)
+
+        if self.size is None: self.size = sum([size for mtime,size,path
+            in self.files()])
+        else:
+            self.size += len(data) - replaced
+        if self.size > self.max_size: self.prune()
+
+    def files(self):
+        """ list (mtime, size, path) for every stored result """
+        result = []
+        if not os.path.exists(self.directory): return result
+        for dir in os.listdir(self.directory):
+            dir = os.path.join(self.directory, dir)
+            if not os.path.isdir(dir): continue
+            for file in os.listdir(dir):
+                # skip results still being written, by this or another process
+                if '.tmp' in file: continue
+                path = os.path.join(dir, file)
+                try:
+                    stat = os.stat(path)
+                    result.append((stat.st_mtime, stat.st_size, path))
+                except OSError:
+                    pass
+        return result
+
+    def prune(self):
+        """ remove least recently used results until under three quarters
+            of the maximum size, so that pruning is not needed on every put """
+        files = self.files()
+        files.sort()
+        size = sum([size for mtime,size,path in files])
+        for mtime, file_size, path in files:
+            if size <= self.max_size * 3 / 4: break
+            try:
+                os.unlink(path)
+                size -= file_size
+            except OSError:
+                pass
+        self.size = size
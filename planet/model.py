@@ -0,0 +1,150 @@
+"""
+A spliced planet, as shared by every template applied to it.
+
+Each template engine needs a different view of the same document: the
+serialized XML, a feedparser parse of it, the parsed subscription sources.
+A Model computes each view the first time it is asked for, and hands the
+same result to every subsequent template, so that a planet with several
+templates parses its document only once.  A model built from the minidom
+document produced by splicing is only serialized if some engine needs it
+as a string, and a model built from the stream produced by
+planet.splice.stream is only held in memory once some engine needs it as a
+string.  While the stream is first read it is spooled to a temporary file,
+from which any later reader is streamed in turn.
+"""
+
+import new, os, tempfile
+from StringIO import StringIO
+
+class Model:
+    """ a spliced document, and memoized views of it """
+
+    def __init__(self, doc):
+        """ doc may be the serialized document, the minidom document
+            produced by planet.splice.splice, or an iterable of pieces of
+            the serialized document, such as planet.splice.stream """
+        self.doc = doc
+        self.memo = {}
+        self.cleanup = []
+
+    def memoize(self, key, function, *args):
+        """ return the result of calling function, computing it only once
+            per model for any given key """
+        if not self.memo.has_key(key):
+            self.memo[key] = function(*args)
+        return self.memo[key]
+
+    def on_close(self, function, *args):
+        """ arrange for function to be called when the model is closed """
+        self.cleanup.append((function, args))
+
+    def close(self):
+        """ release any resources held by memoized views """
+        while self.cleanup:
+            function, args = self.cleanup.pop()
+            function(*args)
+        self.memo.clear()
+
+    def __str__(self):
+        """ the document, serialized as UTF-8 """
+        if isinstance(self.doc, unicode): return self.doc.encode('utf-8')
+        if isinstance(self.doc, str): return self.doc
+        if hasattr(self.doc, 'toxml'):
+            return self.memoize('xml', self.doc.toxml, 'utf-8')
+        if not self.memo.has_key('xml'):
+            if not self.memo.has_key('spool'):
+                for piece in self.stream(): pass
+            spool = self.memo['spool']
+            spool.seek(0)
+            self.memo['xml'] = spool.read()
+        return self.memo['xml']
+
+    def stream(self):
+        """ the document, serialized as UTF-8, as an iterable of pieces
+
+        A stream is only read once: the first caller consumes it piece by
+        piece, as the pieces are spooled to a temporary file, and anyone who
+        asks later is given pieces read back from that file.
+        """
+        if isinstance(self.doc, basestring) or hasattr(self.doc, 'toxml') \
+            or self.memo.has_key('xml'):
+            return [str(self)]
+        if self.memo.has_key('spool'):
+            return self.unspool(self.memo['spool'])
+        if self.memo.has_key('reading'):
+            raise RuntimeError('the stream is already being read')
+        self.memo['reading'] = True
+        return self.consume(iter(self.doc))
+
+    def consume(self, stream):
+        """ yield each piece of a stream, spooling them as it goes """
+        from planet import config
+        directory = config.cache_output_directory()
+        if not os.path.isdir(directory): directory = None
+        spool = tempfile.TemporaryFile(dir=directory)
+        try:
+            for piece in stream:
+                spool.write(piece)
+                yield piece
+        finally:
+            # the remainder is still needed if the caller stops early
+            for piece in stream: spool.write(piece)
+            self.memo['spool'] = spool
+            self.on_close(spool.close)
+            del self.memo['reading']
+
+    def unspool(self, spool, size=65536):
+        """ yield the pieces of a spooled stream """
+        offset = 0
+        while True:
+            spool.seek(offset)
+            piece = spool.read(size)
+            if not piece: break
+            offset = offset + len(piece)
+            yield piece
+
+    def dom(self):
+        """ the document, as parsed by minidom """
+        if hasattr(self.doc, 'toxml'): return self.doc
+        from xml.dom import minidom
+        return self.memoize('dom', minidom.parseString, str(self))
+
+    def parse(self):
+        """ the document as parsed by feedparser, with planet:source
+            elements collected into feed.sources """
+        return self.memoize('parse', parse, StringIO(str(self)))
+
+    def subscriptions(self):
+        """ a list of (subscription, feedparser data) for every configured
+            subscription, read from the sources cache """
+        return self.memoize('subscriptions', subscriptions)
+
+def _end_planet_source(self):
+    self._end_source()
+    context = self._getContext()
+    if not context.has_key('sources'): context['sources'] = []
+    context.sources.append(context.source)
+    del context['source']
+
+def parse(source):
+    """ call feedparser, treating planet:source elements as sources """
+
+    # wire in support for planet:source, call feedparser, unplug planet:source
+    from planet import feedparser
+    mixin=feedparser._FeedParserMixin
+    mixin._start_planet_source = mixin._start_source
+    mixin._end_planet_source = \
+        new.instancemethod(_end_planet_source, None, mixin)
+    try:
+        return feedparser.parse(source)
+    finally:
+        del mixin._start_planet_source
+        del mixin._end_planet_source
+
+def subscriptions():
+    """ parse the cached source document for each subscription """
+    from planet import config, feedparser
+    from planet.spider import filename
+    sources = config.cache_sources_directory()
+    return [(sub, feedparser.parse(filename(sources,sub)))
+        for sub in config.subscriptions()]
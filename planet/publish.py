@@ -3,7 +3,9 @@ import urlparse
 import planet
 import pubsubhubbub_publisher as PuSH
 
-def publish(config):
+def publish(config, changed=None):
+    """ notify the hub of the feeds in the output directory; if a list of
+        changed output files is given, only those feeds are published """
     log = planet.logger
     hub = config.pubsubhubbub_hub()
     link = config.link()
@@ -13,6 +15,7 @@ def publish(config):
     if hub and link:
         for root, dirs, files in os.walk(config.output_dir()):
             for file in files:
+                 if changed is not None and file not in changed: continue
                  if file in config.pubsubhubbub_feeds():
                      feeds.append(urlparse.urljoin(link, file))
 
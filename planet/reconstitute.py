@@ -25,9 +25,32 @@ try:
 except:
   from md5 import new as md5
 
+# entries are built with lxml, if it is available, and otherwise minidom
+try:
+  import lxmldom
+  builder = 'lxml'
+except ImportError:
+  lxmldom = None
+  builder = 'minidom'
+
 illegal_xml_chars = re.compile("[\x01-\x08\x0B\x0C\x0E-\x1F]", re.UNICODE)
 
-def createTextElement(parent, name, value):
+atomNS = 'http://www.w3.org/2005/Atom'
+namespaces = {
+    'planet': planet.xmlns,
+    'geo': 'http://www.w3.org/2003/01/geo/wgs84_pos#',
+    'dc': 'http://purl.org/dc/elements/1.1/',
+}
+
+def createElement(xdoc, name, namespace=None):
+    """ create an element in the Atom namespace, or that of its prefix """
+    if name.find(':')<0:
+        return xdoc.createElementNS(atomNS, name)
+    else:
+        return xdoc.createElementNS(namespace or
+            namespaces.get(name.split(':')[0]), name)
+
+def createTextElement(parent, name, value, namespace=None):
     """ utility function to create a child element with the specified text"""
     if not value: return
     if isinstance(value,str):
@@ -37,7 +60,7 @@ def createTextElement(parent, name, value):
             value=value.decode('iso-8859-1')
     value = illegal_xml_chars.sub(invalidate, value)
     xdoc = parent.ownerDocument
-    xelement = xdoc.createElement(name)
+    xelement = createElement(xdoc, name, namespace)
     xelement.appendChild(xdoc.createTextNode(value))
     parent.appendChild(xelement)
     return xelement
@@ -85,7 +108,7 @@ def id(xentry, entry):
     else:
         return
 
-    if xentry: createTextElement(xentry, 'id', entry_id)
+    if xentry is not None: createTextElement(xentry, 'id', entry_id)
     return entry_id
 
 def links(xentry, entry):
@@ -97,7 +120,7 @@ def links(xentry, entry):
     xdoc = xentry.ownerDocument
     for link in entry['links']:
         if not 'href' in link.keys(): continue
-        xlink = xdoc.createElement('link')
+        xlink = createElement(xdoc, 'link')
         xlink.setAttribute('href', link.get('href'))
         if link.has_key('type'):
             xlink.setAttribute('type', link.get('type'))
@@ -112,13 +135,13 @@ def links(xentry, entry):
 def date(xentry, name, parsed):
     """ insert a date-formated element into the entry """
     if not parsed: return
-    formatted = time.strftime("%Y-%m-%dT%H:%M:%SZ", parsed)
+    formatted = planet.strftime("%Y-%m-%dT%H:%M:%SZ", parsed)
     xdate = createTextElement(xentry, name, formatted)
-    formatted = time.strftime(config.date_format(), parsed)
+    formatted = planet.strftime(config.date_format(), parsed)
     xdate.setAttribute('planet:format', formatted.decode('utf-8'))
 
 def category(xentry, tag):
-    xtag = xentry.ownerDocument.createElement('category')
+    xtag = createElement(xentry.ownerDocument, 'category')
     if not tag.has_key('term') or not tag.term: return
     xtag.setAttribute('term', tag.get('term'))
     if tag.has_key('scheme') and tag.scheme:
@@ -131,18 +154,41 @@ def author(xentry, name, detail):
     """ insert an author-like element into the entry """
     if not detail: return
     xdoc = xentry.ownerDocument
-    xauthor = xdoc.createElement(name)
+    xauthor = createElement(xdoc, name)
 
     if detail.get('name', None):
         createTextElement(xauthor, 'name', detail.get('name'))
     else:
-        xauthor.appendChild(xdoc.createElement('name'))
+        xauthor.appendChild(createElement(xdoc, 'name'))
 
     createTextElement(xauthor, 'email', detail.get('email', None))
     createTextElement(xauthor, 'uri', detail.get('href', None))
         
     xentry.appendChild(xauthor)
 
+def division(xcontent, div, detail):
+    """ the text of a parsed div, if that is all it contains, or otherwise
+        the div itself, as xhtml """
+    xdoc = xcontent.ownerDocument
+    try:
+        div.normalize()
+        if len(div.childNodes) == 1 and \
+            div.firstChild.nodeType == Node.TEXT_NODE:
+            data = div.firstChild
+            if illegal_xml_chars.search(data.data):
+                data = xdoc.createTextNode(
+                    illegal_xml_chars.sub(invalidate, data.data))
+            return data
+        else:
+            xcontent.setAttribute('type', 'xhtml')
+            return div
+    except:
+        # in extremely nested cases, the Python runtime decides
+        # that normalize() must be in an infinite loop; mark
+        # the content as escaped html and proceed on...
+        xcontent.setAttribute('type', 'html')
+        return xdoc.createTextNode(detail.value.decode('utf-8'))
+
 def content(xentry, name, detail, bozo):
     """ insert a content-like element into the entry """
     if not detail or not detail.value: return
@@ -150,49 +196,49 @@ def content(xentry, name, detail, bozo):
     data = None
     xdiv = '<div xmlns="http://www.w3.org/1999/xhtml">%s</div>'
     xdoc = xentry.ownerDocument
-    xcontent = xdoc.createElement(name)
+    xcontent = createElement(xdoc, name)
 
     if isinstance(detail.value,unicode):
         detail.value=detail.value.encode('utf-8')
 
-    if not detail.has_key('type') or detail.type.lower().find('html')<0:
-        detail['value'] = escape(detail.value)
-        detail['type'] = 'text/html'
-
-    if detail.type.find('xhtml')>=0 and not bozo:
+    if detail.get('fragment') and detail.type.lower().find('html')>=0:
+        # already parsed and sanitized by planet.scrub, so used as it is
         try:
-            data = minidom.parseString(xdiv % detail.value).documentElement
-            xcontent.setAttribute('type', 'xhtml')
-        except:
-            bozo=1
-
-    if detail.type.find('xhtml')<0 or bozo:
-        parser = html5parser.HTMLParser(tree=dom.TreeBuilder)
-        html = parser.parse(xdiv % detail.value, encoding="utf-8")
-        for body in html.documentElement.childNodes:
-            if body.nodeType != Node.ELEMENT_NODE: continue
-            if body.nodeName != 'body': continue
-            for div in body.childNodes:
-                if div.nodeType != Node.ELEMENT_NODE: continue
-                if div.nodeName != 'div': continue
-                try:
-                    div.normalize()
-                    if len(div.childNodes) == 1 and \
-                        div.firstChild.nodeType == Node.TEXT_NODE:
-                        data = div.firstChild
-                        if illegal_xml_chars.search(data.data):
-                            data = xdoc.createTextNode(
-                                illegal_xml_chars.sub(invalidate, data.data))
-                    else:
-                        data = div
-                        xcontent.setAttribute('type', 'xhtml')
+            div = xdoc.importNode(detail.fragment, True)
+        except RuntimeError:
+            # too deeply nested to copy; treat as escaped html
+            xcontent.setAttribute('type', 'html')
+            data = xdoc.createTextNode(detail.value.decode('utf-8'))
+        else:
+            if detail.type.find('xhtml')>=0 and not bozo:
+                data = div
+                xcontent.setAttribute('type', 'xhtml')
+            else:
+                data = division(xcontent, div, detail)
+
+    else:
+        if not detail.has_key('type') or detail.type.lower().find('html')<0:
+            detail['value'] = escape(detail.value)
+            detail['type'] = 'text/html'
+
+        if detail.type.find('xhtml')>=0 and not bozo:
+            try:
+                data = minidom.parseString(xdiv % detail.value).documentElement
+                xcontent.setAttribute('type', 'xhtml')
+            except:
+                bozo=1
+
+        if detail.type.find('xhtml')<0 or bozo:
+            parser = html5parser.HTMLParser(tree=dom.TreeBuilder)
+            html = parser.parse(xdiv % detail.value, encoding="utf-8")
+            for body in html.documentElement.childNodes:
+                if body.nodeType != Node.ELEMENT_NODE: continue
+                if body.nodeName != 'body': continue
+                for div in body.childNodes:
+                    if div.nodeType != Node.ELEMENT_NODE: continue
+                    if div.nodeName != 'div': continue
+                    data = division(xcontent, div, detail)
                     break
-                except:
-                    # in extremely nested cases, the Python runtime decides
-                    # that normalize() must be in an infinite loop; mark
-                    # the content as escaped html and proceed on...
-                    xcontent.setAttribute('type', 'html')
-                    data = xdoc.createTextNode(detail.value.decode('utf-8'))
 
     if data: xcontent.appendChild(data)
 
@@ -253,9 +299,17 @@ def source(xsource, source, bozo, format):
         if key.startswith('planet_'):
             createTextElement(xsource, key.replace('_',':',1), value)
 
+def document():
+    """ create an empty entry document, using the selected builder """
+    if builder == 'lxml':
+        return lxmldom.document(atomNS, 'entry',
+            {None: atomNS, 'planet': planet.xmlns})
+    else:
+        return minidom.parseString('<entry xmlns="%s"/>\n' % atomNS)
+
 def reconstitute(feed, entry):
     """ create an entry document from a parsed feed """
-    xdoc=minidom.parseString('<entry xmlns="http://www.w3.org/2005/Atom"/>\n')
+    xdoc=document()
     xentry=xdoc.documentElement
     xentry.setAttribute('xmlns:planet',planet.xmlns)
 
@@ -269,7 +323,7 @@ def reconstitute(feed, entry):
 
     bozo = feed.bozo
     if not entry.has_key('title') or not entry.title:
-        xentry.appendChild(xdoc.createElement('title'))
+        xentry.appendChild(createElement(xdoc, 'title'))
 
     content(xentry, 'title', entry.get('title_detail',None), bozo)
     content(xentry, 'summary', entry.get('summary_detail',None), bozo)
@@ -292,7 +346,7 @@ def reconstitute(feed, entry):
         if entry.has_key('%s_%s' % (ns,name.lower())) and \
             feed.namespaces.has_key(ns):
             xoriglink = createTextElement(xentry, '%s:%s' % (ns,name),
-                entry['%s_%s' % (ns,name.lower())])
+                entry['%s_%s' % (ns,name.lower())], feed.namespaces[ns])
             xoriglink.setAttribute('xmlns:%s' % ns, feed.namespaces[ns])
 
     # geo location
@@ -353,7 +407,7 @@ def reconstitute(feed, entry):
        src_author['name'] = feed.feed['planet_name']
 
     # source
-    xsource = xdoc.createElement('source')
+    xsource = createElement(xdoc, 'source')
     source(xsource, src, bozo, feed.version)
     xentry.appendChild(xsource)
 
@@ -4,13 +4,133 @@ Process a set of configuration defined sanitations on a given feed.
 
 # Standard library modules
 import time
+from xml.dom import minidom
+from xml.parsers.expat import ExpatError
 # Planet modules
 import planet, config, shell
-from planet import feedparser
+from planet import feedparser, memo
+from html5lib import html5parser, treebuilders, treewalkers, serializer
+from html5lib.filters import _base, sanitizer
 
 type_map = {'text': 'text/plain', 'html': 'text/html',
     'xhtml': 'application/xhtml+xml'}
 
+xhtmlNS = 'http://www.w3.org/1999/xhtml'
+
+sanitize_caches = {}
+
+class Resolver(_base.Filter):
+    """ resolve the relative URIs in a stream of tokens against a base """
+    relative_uris = feedparser._RelativeURIResolver.relative_uris
+
+    def __init__(self, source, base):
+        _base.Filter.__init__(self, source)
+        self.base = base
+
+    def __iter__(self):
+        for token in _base.Filter.__iter__(self):
+            if token['type'] in ('StartTag', 'EmptyTag'):
+                token['data'] = [(name, (token['name'], name) in
+                    self.relative_uris and
+                    feedparser._urljoin(self.base, value.strip()) or value)
+                    for name, value in token['data']]
+            yield token
+
+def build(tokens):
+    """ build a div, in a document of its own, from a stream of tokens """
+    doc = minidom.Document()
+    div = doc.createElementNS(xhtmlNS, 'div')
+    div.setAttribute('xmlns', xhtmlNS)
+    doc.appendChild(div)
+
+    # every node is new, so minidom's checks on appendChild can be skipped
+    append = minidom._append_child
+    parent = div
+    for token in tokens:
+        if token['type'] in ('StartTag', 'EmptyTag'):
+            element = doc.createElementNS(token.get('namespace'),
+                token['name'])
+            for name, value in token['data']:
+                element.setAttribute(name, value)
+            append(parent, element)
+            if token['type'] == 'StartTag': parent = element
+        elif token['type'] == 'EndTag':
+            if parent is not div: parent = parent.parentNode
+        elif token['type'] in ('Characters', 'SpaceCharacters'):
+            append(parent, doc.createTextNode(token['data']))
+    return div
+
+# everything which determines how a fragment is sanitized, other than the
+# fragment itself, its type and its base
+sanitizer_config = memo.digest(*[repr(getattr(sanitizer.Filter, name))
+    for name in ['allowed_elements', 'allowed_attributes', 'attr_val_is_uri',
+        'svg_attr_val_allows_ref', 'svg_allow_local_href',
+        'allowed_css_properties', 'allowed_css_keywords',
+        'allowed_svg_properties', 'allowed_protocols']] +
+    [repr(Resolver.relative_uris)])
+
+def sanitize_cache():
+    """ the persistent store of sanitized fragments, if enabled """
+    if not config.sanitize_cache(): return None
+    directory = config.sanitize_cache_directory()
+    if not sanitize_caches.has_key(directory):
+        sanitize_caches[directory] = memo.Memo(directory,
+            config.sanitize_cache_size()*1024)
+    return sanitize_caches[directory]
+
+def restore(node, result):
+    """ set the type, value and fragment of a node from a cached result,
+        returning False if the result can not be used """
+    type, value = result.split('\n', 1)
+    try:
+        div = minidom.parseString('<div xmlns="%s">%s</div>' %
+            (xhtmlNS, value)).documentElement
+    except ExpatError:
+        return False
+    node['type'] = type.decode('utf-8')
+    node['value'] = value
+    node['fragment'] = div
+    return True
+
+def sanitize(node, base=None, cache=None):
+    """ parse the value of an html or xhtml text construct once, resolving
+        relative URIs against base, if given, and sanitizing it as the tree
+        is built.  The resulting div is kept as the fragment of the node,
+        for planet.reconstitute to use as it is.
+
+    If a planet.memo.Memo is given, results are looked up there by a digest
+    of the value, type and base; a fragment seen before is then rebuilt from
+    its sanitized markup by expat, rather than sanitized again.
+    """
+    key = None
+    if cache:
+        key = memo.digest(node['value'], node['type'], base or '',
+            sanitizer_config)
+        result = cache.get(key)
+        if result is not None and restore(node, result): return
+
+    doc = None
+    if 'xhtml' in node['type']:
+        try:
+            doc = minidom.parseString(node['value'])
+        except:
+            node['type']='text/html'
+
+    if not doc:
+        p=html5parser.HTMLParser(tree=treebuilders.getTreeBuilder('dom'))
+        doc = p.parseFragment(node['value'], encoding='utf-8')
+
+    tokens = treewalkers.getTreeWalker('dom')(doc)
+    if base: tokens = Resolver(tokens, base)
+    tokens = list(sanitizer.Filter(tokens))
+    node['fragment'] = build(tokens)
+
+    xhtml = serializer.XHTMLSerializer(inject_meta_charset = False)
+    node['value'] = ''.join([str(token)
+        for token in xhtml.serialize(tokens, encoding='utf-8')])
+
+    if key: cache.put(key, node['type'].encode('utf-8') + '\n' + node['value'])
+
 def scrub(feed_uri, data):
 
     # some data is not trustworthy
@@ -95,6 +215,7 @@ def scrub(feed_uri, data):
           or entry['updated_parsed'] <= now)]
 
     scrub_xmlbase = config.xml_base(feed_uri)
+    cache = sanitize_cache()
 
     # resolve relative URIs and sanitize
     for entry in data.entries + [data.feed]:
@@ -125,27 +246,5 @@ def scrub(feed_uri, data):
                         node['base'] = feedparser._urljoin(
                             node['base'], scrub_xmlbase)
 
-                node['value'] = feedparser._resolveRelativeURIs(
-                    node.value, node.base, 'utf-8', node.type)
-
-            # Run this through HTML5's sanitizer
-            doc = None
-            if 'xhtml' in node['type']:
-              try:
-                from xml.dom import minidom
-                doc = minidom.parseString(node['value'])
-              except:
-                node['type']='text/html'
-
-            if not doc:
-              from html5lib import html5parser, treebuilders
-              p=html5parser.HTMLParser(tree=treebuilders.getTreeBuilder('dom'))
-              doc = p.parseFragment(node['value'], encoding='utf-8')
-
-            from html5lib import treewalkers, serializer
-            from html5lib.filters import sanitizer
-            walker = sanitizer.Filter(treewalkers.getTreeWalker('dom')(doc))
-            xhtml = serializer.XHTMLSerializer(inject_meta_charset = False)
-            tree = xhtml.serialize(walker, encoding='utf-8')
-
-            node['value'] = ''.join([str(token) for token in tree])
+            # resolve relative URIs and run this through HTML5's sanitizer
+            sanitize(node, node.get('base'), cache)
@@ -0,0 +1,313 @@
+"""
+A static full-text search index, built from the entries in the cache.
+
+When search_index is set, the words of the title, summary and content of
+every cached entry are indexed, and written within a subdirectory of the
+output directory as static files which a client side script, such as
+themes/common/search.js, can query without any server support:
+
+  documents.json  a list of the title, link and updated date of each
+                  entry, by document number; null marks an unused number
+  ab.json         the postings of every word beginning with "ab": a map of
+                  each word to the numbers of the documents containing it,
+                  in ascending order, each written as the difference from
+                  the one before in base 36, separated by commas.  Words not
+                  beginning with two ASCII letters or digits are in _.json
+
+The modification time, document number and shards of each indexed entry are
+recorded within the cache, so that each run only reads the entries which
+have been added or modified since the previous one, and only reads and
+rewrites the shards containing their words, or those of entries which have
+been expunged.
+
+Usage:
+  from planet import search
+  search.update(output)
+"""
+
+import os, re, stat, json
+from xml.dom import minidom
+import planet
+from planet import config
+from planet.manifest import replace
+
+atomNS = 'http://www.w3.org/2005/Atom'
+# words are separated by whitespace and ASCII punctuation, exactly as
+# themes/common/search.js separates the words of a query
+separators = u'\t\n\x0b\x0c\r !-/:-@\\[-`{-~' + \
+    u'\xa0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000\ufeff'
+word_re = re.compile(u'[^%s]+' % separators)
+tag_re = re.compile(r'<[^>]*>')
+shard_re = re.compile(r'^[a-z0-9]{2}$')
+digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+# changed whenever words are found differently, so that indexes recorded by
+# earlier versions are rebuilt
+index_version = '2'
+
+def words(text):
+    """ the distinct, lower cased, words of a unicode string """
+    return set([word.lower() for word in word_re.findall(text)
+        if 1 < len(word) <= 32])
+
+def shard(word):
+    """ the name of the shard containing a word """
+    if shard_re.match(word[:2]): return word[:2]
+    return '_'
+
+def text(node):
+    """ the text of an Atom text construct, without markup """
+    def content(node):
+        if node.nodeType == node.TEXT_NODE: return [node.nodeValue]
+        return sum([content(child) for child in node.childNodes], [])
+    value = ' '.join(content(node))
+    if node.getAttribute('type') == 'html': value = tag_re.sub(' ', value)
+    return ' '.join(value.split())
+
+def entry_info(path):
+    """ the title, link, updated date and words of a cached entry """
+    doc = minidom.parse(path)
+    try:
+        title = link = updated = ''
+        found = set()
+        for node in doc.documentElement.childNodes:
+            if node.nodeType != node.ELEMENT_NODE: continue
+            if node.namespaceURI != atomNS: continue
+            if node.localName in ['title', 'summary', 'content']:
+                found.update(words(text(node)))
+                if node.localName == 'title': title = text(node)
+            elif node.localName == 'link':
+                if node.getAttribute('rel') in ['', 'alternate'] and not link:
+                    link = node.getAttribute('href')
+            elif node.localName == 'updated':
+                updated = text(node)
+        return [title, link, updated], found
+    finally:
+        doc.unlink()
+
+def encode(numbers):
+    """ a sorted list of document numbers, as a string of base 36 deltas """
+    result = []
+    last = 0
+    for number in numbers:
+        delta = number - last
+        last = number
+        value = ''
+        while True:
+            delta, digit = divmod(delta, 36)
+            value = digits[digit] + value
+            if not delta: break
+        result.append(value)
+    return ','.join(result)
+
+def decode(postings):
+    """ the list of document numbers encoded by encode """
+    numbers = []
+    last = 0
+    for value in postings.split(','):
+        last = last + int(value, 36)
+        numbers.append(last)
+    return numbers
+
+class Index:
+    """ the indexed entries and their documents, along with the shards of
+        postings loaded so far, as recorded within the cache """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.entries = {}
+        self.documents = []
+        self.shards = {}
+        self.changed = set()
+        self.modified = False
+        self.free = None
+        self.load()
+
+    def load(self):
+        """ read the entries and documents recorded by a previous run """
+        try:
+            version = self.read('version')
+        except IOError:
+            version = None
+        if version != index_version:
+            self.discard()
+            return
+
+        try:
+            file = open(os.path.join(self.directory, 'entries'))
+        except IOError:
+            self.modified = True
+            return
+        try:
+            for line in file:
+                try:
+                    mtime, number, name, shards = \
+                        (line.rstrip('\n') + ' ').split(' ', 3)
+                    self.entries[name] = \
+                        (float(mtime), int(number), shards.split())
+                except ValueError:
+                    pass
+        finally:
+            file.close()
+
+        try:
+            self.documents = json.loads(self.read('documents.json'))
+        except (IOError, ValueError):
+            self.entries = {}
+            self.modified = True
+
+    def discard(self):
+        """ forget an index recorded by an earlier version; its shards are
+            removed from the output when the index is next saved """
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith('.json') and name != 'documents.json':
+                    self.changed.add(name[:-5])
+                os.unlink(os.path.join(self.directory, name))
+        self.modified = True
+
+    def read(self, name):
+        """ read a file from the directory """
+        file = open(os.path.join(self.directory, name))
+        try:
+            return file.read()
+        finally:
+            file.close()
+
+    def write(self, name, data):
+        """ write a file, atomically, to the directory """
+        path = os.path.join(self.directory, name)
+        temp = '%s.tmp%d' % (path, os.getpid())
+        file = open(temp, 'wb')
+        try:
+            file.write(data)
+        finally:
+            file.close()
+        replace(temp, path)
+
+    def shard(self, name):
+        """ the postings of a shard, as a map of word to a set of document
+            numbers, read from the cache the first time it is asked for """
+        if not self.shards.has_key(name):
+            try:
+                postings = json.loads(self.read(name + '.json'))
+            except (IOError, ValueError):
+                postings = {}
+            self.shards[name] = dict([(word, set(decode(value)))
+                for word, value in postings.items()])
+        return self.shards[name]
+
+    def remove(self, name):
+        """ remove an entry from the index """
+        mtime, number, shards = self.entries.pop(name)
+        for shard in shards:
+            postings = self.shard(shard)
+            for word, numbers in postings.items():
+                if number in numbers:
+                    numbers.remove(number)
+                    if not numbers: del postings[word]
+            self.changed.add(shard)
+        self.documents[number] = None
+        if self.free != None: self.free.append(number)
+        self.modified = True
+
+    def add(self, name, mtime, document, found):
+        """ add an entry, with its document and words, to the index """
+        if self.free == None:
+            self.free = [number for number in range(len(self.documents))
+                if self.documents[number] is None]
+            self.free.reverse()
+        if self.free:
+            number = self.free.pop()
+            self.documents[number] = document
+        else:
+            number = len(self.documents)
+            self.documents.append(document)
+
+        shards = set()
+        for word in found:
+            shards.add(shard(word))
+            self.shard(shard(word)).setdefault(word, set()).add(number)
+        self.changed.update(shards)
+        self.entries[name] = (mtime, number, sorted(shards))
+        self.modified = True
+
+    def scan(self, cache):
+        """ bring the index up to date with the cache directory, reading
+            only the entries which are new or have been modified """
+        log = planet.logger
+        present = {}
+        for name in os.listdir(cache):
+            try:
+                status = os.stat(os.path.join(cache, name))
+            except OSError:
+                continue
+            if not stat.S_ISDIR(status.st_mode):
+                present[name] = status.st_mtime
+
+        added = []
+        for name, mtime in present.items():
+            entry = self.entries.get(name)
+            if entry and entry[0] == mtime: continue
+            try:
+                added.append((name, mtime) +
+                    entry_info(os.path.join(cache, name)))
+            except Exception, e:
+                log.error("Error parsing %s: %s", name, e)
+                added.append((name, mtime, ['', '', ''], set()))
+
+        # remove expunged and modified entries before adding any, so that
+        # the document numbers they free may be reused
+        for name in self.entries.keys():
+            if name not in present or self.entries[name][0] != present[name]:
+                self.remove(name)
+        for name, mtime, document, found in added:
+            self.add(name, mtime, document, found)
+
+        while self.documents and self.documents[-1] is None:
+            self.documents.pop()
+        return len(added)
+
+    def postings(self, name):
+        """ the postings of a shard, encoded """
+        postings = self.shard(name)
+        return json.dumps(dict([(word, encode(sorted(numbers)))
+            for word, numbers in postings.items()]),
+            separators=(',', ':'), sort_keys=True)
+
+    def save(self, output, directory):
+        """ record the index for use by the next run, and write its changed
+            shards, and documents, to output, a planet.manifest.Manifest """
+        if not os.path.exists(self.directory): os.makedirs(self.directory)
+
+        for name in self.changed:
+            if self.shard(name):
+                data = self.postings(name)
+                self.write(name + '.json', data)
+                output.write(os.path.join(directory, name + '.json'), data)
+            else:
+                path = os.path.join(self.directory, name + '.json')
+                if os.path.exists(path): os.unlink(path)
+                output.remove(os.path.join(directory, name + '.json'))
+
+        if not self.modified: return
+        data = json.dumps(self.documents, separators=(',', ':'))
+        self.write('documents.json', data)
+        output.write(os.path.join(directory, 'documents.json'), data)
+
+        lines = ['%r %d %s %s\n' % (mtime, number, name, ' '.join(shards))
+            for name, (mtime, number, shards) in self.entries.items()]
+        lines.sort()
+        self.write('entries', ''.join(lines))
+        self.write('version', index_version)
+
+def update(output):
+    """ bring the search index up to date with the cache; output is a
+        planet.manifest.Manifest """
+    log = planet.logger
+    index = Index(os.path.join(config.cache_output_directory(), 'search'))
+    count = index.scan(config.cache_directory())
+    if index.modified:
+        log.info("Indexed %d entries, updating %d shards", count,
+            len(index.changed))
+    index.save(output, config.search_directory())
@@ -3,9 +3,37 @@ import os
 import sys
 
 logged_modes = []
+filter_caches = {}
+resolved_cache = {}
 
-def run(template_file, doc, mode='template'):
-    """ select a template module based on file extension and execute it """
+def serialize(doc):
+    """ serialize a parsed document the same way the spider caches entries """
+    return doc.toxml().encode('utf-8')
+
+def reset():
+    """ forget previously resolved templates and filters """
+    resolved_cache.clear()
+
+def resolve(template_file, mode='template'):
+    """ locate a template or filter and load the module which processes it
+
+    Returns a tuple of the resolved file name, the shell module, and the
+    options to be passed to it; or None if either can not be found.  Results
+    are remembered until the configuration is next loaded, so the search
+    path is only scanned once per template or filter.
+    """
+    resolved = resolved_cache.get((template_file, mode))
+    if not resolved:
+        resolved = locate(template_file, mode)
+        if not resolved: return
+        resolved_cache[(template_file, mode)] = resolved
+
+    # shell modules are free to modify the options they are passed
+    template_resolved, module, options = resolved
+    return template_resolved, module, options.copy()
+
+def locate(template_file, mode='template'):
+    """ search for a template or filter, and import its shell module """
     log = planet.logger
 
     if mode == 'template':
@@ -52,16 +80,148 @@ def run(template_file, doc, mode='template'):
         return log.error("Skipping %s '%s' after failing to load '%s': %s", 
             mode, template_resolved, module_name, inst)
 
-    # Execute the shell module
     options = planet.config.template_options(template_file)
     if module_name == 'plugin': options['__file__'] = template_file
     options.update(extra_options)
-    log.debug("Processing %s %s using %s", mode,
-        os.path.realpath(template_resolved), module_name)
+
+    return template_resolved, module, options
+
+def run(template_file, doc, mode='template', tree=False, output_dir=None):
+    """ select a template module based on file extension and execute it
+
+    In filter mode, doc may be either a string or a parsed minidom document.
+    Filters which provide an in-process tree function are handed the parsed
+    document directly; all others receive the serialized bytes.  Unless tree
+    is true, the result is always returned as a string.
+
+    In template mode, doc may be either a string or a planet.model.Model,
+    which is shared by every template applied to the same spliced document;
+    engines which declare accepts_stream are instead handed its stream.
+    The output is written to a file named after the template, in output_dir
+    if given, and otherwise in the configured output directory.
+    """
+    resolved = resolve(template_file, mode)
+    if not resolved: return
+    template_resolved, module, options = resolved
+
+    # Execute the shell module
+    planet.logger.debug("Processing %s %s using %s", mode, template_resolved,
+        module.__name__.lstrip('_'))
     if mode == 'filter':
+        tree_filter = getattr(module, 'tree_filter', None)
+        tree_filter = tree_filter and tree_filter(template_resolved)
+        if tree_filter:
+            return run_tree(tree_filter, doc, options, tree)
+        if not isinstance(doc, basestring): doc = serialize(doc)
         return module.run(template_resolved, doc, None, options)
     else:
-        output_dir = planet.config.output_dir()
+        # engines which do not declare otherwise are given the document as
+        # a string, rather than as a shared planet.model.Model or a stream
+        if getattr(module, 'accepts_stream', False) and \
+            hasattr(doc, 'stream'): doc = doc.stream()
+        elif not getattr(module, 'accepts_model', False) and \
+            not isinstance(doc, basestring): doc = str(doc)
+
+        base = os.path.splitext(os.path.basename(template_resolved))[0]
+        output_dir = output_dir or planet.config.output_dir()
         output_file = os.path.join(output_dir, base)
         module.run(template_resolved, doc, output_file, options)
         return output_file
+
+def prepare(template_file, doc):
+    """ compute, in advance, the views of a planet.model.Model which the
+        engine for a template will need """
+    resolved = resolve(template_file)
+    if not resolved: return
+    template_resolved, module, options = resolved
+    if not getattr(module, 'accepts_model', False):
+        str(doc)
+    elif hasattr(module, 'prepare'):
+        module.prepare(template_resolved, doc)
+
+def run_tree(tree_filter, doc, options, tree=False):
+    """ apply an in-process filter to a parsed document """
+    try:
+        from xml.dom import minidom
+        if not isinstance(doc, basestring) and \
+            not isinstance(doc, minidom.Document):
+            # tree filters are written against minidom, so an entry built
+            # by some other DOM is serialized and parsed again
+            doc = serialize(doc)
+        if isinstance(doc, basestring):
+            doc = minidom.parseString(doc)
+        doc = tree_filter(doc, options)
+    except Exception, e:
+        import traceback
+        type, value, tb = sys.exc_info()
+        planet.logger.error(''.join(
+            traceback.format_exception_only(type,value) +
+            traceback.format_tb(tb)))
+        return ''
+
+    if not doc: return ''
+    if tree: return doc
+    return serialize(doc)
+
+def filter_cache():
+    """ the persistent store of filter results, if enabled """
+    if not planet.config.filter_cache(): return None
+    directory = planet.config.filter_cache_directory()
+    if not filter_caches.has_key(directory):
+        from planet import memo
+        filter_caches[directory] = memo.Memo(directory,
+            planet.config.filter_cache_size()*1024)
+    return filter_caches[directory]
+
+def filter_key(key, filter):
+    """ key for the result of applying a filter to the document with the
+        given key: the filter's name, file, modification time, and options
+        all contribute, so editing or reconfiguring a filter invalidates
+        its cached results """
+    resolved = resolve(filter, mode="filter")
+    if not resolved: return None
+    template_resolved, module, options = resolved
+    options = options.items()
+    options.sort()
+    from planet import memo
+    return memo.digest(key, filter, template_resolved,
+        repr(os.stat(template_resolved).st_mtime), repr(options))
+
+def run_filters(filters, doc):
+    """ pipe a document through a list of filters
+
+    The document is only serialized when it crosses from a tree filter to a
+    byte-oriented filter, and once more at the end of the chain; consecutive
+    tree filters share a single parsed document.
+
+    If the filter cache is enabled, the result of each filter is saved,
+    keyed by the input to the chain and the filters applied so far.  An
+    unchanged entry is then passed through an unchanged chain by lookup.
+    """
+    cache = filters and filter_cache()
+    key = None
+    if cache:
+        if not isinstance(doc, basestring): doc = serialize(doc)
+        from planet import memo
+        key = memo.digest(doc)
+
+    for filter in filters:
+        if key: key = filter_key(key, filter)
+        if key:
+            output = cache.get(key)
+            if output is not None:
+                planet.logger.debug("Using cached %s result", filter)
+                doc = output
+                if not doc: return ''
+                continue
+
+        doc = run(filter, doc, mode="filter", tree=True)
+        if key and doc is not None:
+            if isinstance(doc, basestring):
+                cache.put(key, doc)
+            else:
+                cache.put(key, serialize(doc))
+        if not doc: return ''
+
+    if not isinstance(doc, basestring): doc = serialize(doc)
+    return doc
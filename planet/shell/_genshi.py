@@ -1,10 +1,13 @@
+import os
 from StringIO import StringIO
 from xml.sax.saxutils import escape
 
 from genshi.input import HTMLParser, XMLParser
-from genshi.template import Context, MarkupTemplate
+from genshi.template import Context, MarkupTemplate, TemplateLoader
+
+# the parsed feeds are taken from a shared planet.model.Model
+accepts_model = True
 
-subscriptions = []
 feed_types = [
     'application/atom+xml',
     'application/rss+xml',
@@ -21,7 +24,7 @@ def norm(value):
     except:
         return value.decode('iso-8859-1')
 
-def find_config(config, feed):
+def find_config(config, feed, subscriptions):
     # match based on self link
     for link in feed.links:
         if link.has_key('rel') and link.rel=='self':
@@ -53,84 +56,124 @@ class XHTMLParser(object):
         if predepth: return object
         return self.next()
 
+class TextStream(object):
+    """ the markup of a _detail textConstruct, parsed only when (and each
+        time) a template iterates over it """
+    def __init__(self, text, bozo):
+        self.text = text
+        self.bozo = bozo
+    def __iter__(self):
+        text = self.text
+        if text.type == 'text/plain':
+            return iter(HTMLParser(StringIO(escape(text.value))))
+        elif text.type == 'text/html' or self.bozo != 'false':
+            return iter(HTMLParser(StringIO(text.value)))
+        else:
+            return iter(XHTMLParser(text.value))
+
 def streamify(text,bozo):
     """ add a .stream to a _detail textConstruct """
-    if text.type == 'text/plain':
-        text.stream = HTMLParser(StringIO(escape(text.value)))
-    elif text.type == 'text/html' or bozo != 'false':
-        text.stream = HTMLParser(StringIO(text.value))
-    else:
-        text.stream = XHTMLParser(text.value)
+    text.stream = TextStream(text, bozo)
+
+# template loaders, by template directory
+loaders = {}
+
+def load(script):
+    """ load a Genshi template, retaining its compiled form until the
+        template is modified """
+    directory = os.path.dirname(os.path.abspath(script))
+    if not loaders.has_key(directory):
+        loaders[directory] = TemplateLoader([directory], auto_reload=True,
+            variable_lookup='lenient')
+    return loaders[directory].load(os.path.basename(script),
+        cls=MarkupTemplate)
+
+def annotate(doc):
+    """ add the subscription configuration, new_feed and new_date fields, and
+        text streams used by templates to a copy of the parse of a
+        planet.model.Model; the parse itself is shared with other engines,
+        so is left as it is """
+    import planet
+    from planet import config, feedparser
+    FeedParserDict = feedparser.FeedParserDict
+
+    # gather a list of subscriptions, feeds
+    subscriptions = []
+    feeds = []
+    for sub, data in doc.subscriptions():
+        feed = FeedParserDict(data.feed)
+        feed.config = norm(dict(config.parser.items(sub)))
+        if feed.has_key('link'):
+            feeds.append((feed.config.get('name',''),feed))
+        subscriptions.append(norm(sub))
+    feeds.sort()
+
+    # annotate each entry
+    new_date_format = config.new_date_format()
+    vars = FeedParserDict(doc.parse())
+    vars.feeds = [value for name,value in feeds]
+    vars.entries = [FeedParserDict(entry) for entry in vars.entries]
+    last_feed = None
+    last_date = None
+    for entry in vars.entries:
+         entry.source = FeedParserDict(entry.source)
+         entry.source.config = find_config(config, entry.source, subscriptions)
+
+         # add new_feed and new_date fields
+         entry.new_feed = entry.source.id
+         entry.new_date = date = None
+         if entry.has_key('published_parsed'): date=entry.published_parsed
+         if entry.has_key('updated_parsed'): date=entry.updated_parsed
+         if date: entry.new_date = planet.strftime(new_date_format, date)
+
+         # remove new_feed and new_date fields if not "new"
+         if entry.new_date == last_date:
+             entry.new_date = None
+             if entry.new_feed == last_feed:
+                 entry.new_feed = None
+             else:
+                 last_feed = entry.new_feed
+         elif entry.new_date:
+             last_date = entry.new_date
+             last_feed = None
+
+         # add streams for all text constructs
+         for key in entry.keys():
+             if key.endswith("_detail") and entry[key].has_key('type') and \
+                 entry[key].has_key('value'):
+                 entry[key] = FeedParserDict(entry[key])
+                 streamify(entry[key],entry.source.planet_bozo)
+         if entry.has_key('content'):
+             entry.content = [FeedParserDict(content)
+                 for content in entry.content]
+             for content in entry.content:
+                 streamify(content,entry.source.planet_bozo)
+ 
+    # add cumulative feed information to the Genshi context
+    vars.feed = FeedParserDict(vars.feed)
+    vars.feed.config = dict(config.parser.items('Planet',True))
+    return vars
+
+def prepare(script, doc):
+    """ load the template, and annotate a planet.model.Model for it """
+    load(script)
+    doc.memoize('genshi', annotate, doc)
 
 def run(script, doc, output_file=None, options={}):
     """ process an Genshi template """
 
     context = Context(**options)
-
-    tmpl_fileobj = open(script)
-    tmpl = MarkupTemplate(tmpl_fileobj, script, lookup="lenient")
-    tmpl_fileobj.close()
+    tmpl = load(script)
 
     if not output_file: 
         # filter
         context.push({'input':XMLParser(StringIO(doc))})
     else:
-        # template
-        import time
-        from planet import config,feedparser
-        from planet.spider import filename
-
-        # gather a list of subscriptions, feeds
-        global subscriptions
-        feeds = []
-        sources = config.cache_sources_directory()
-        for sub in config.subscriptions():
-            data=feedparser.parse(filename(sources,sub))
-            data.feed.config = norm(dict(config.parser.items(sub)))
-            if data.feed.has_key('link'):
-                feeds.append((data.feed.config.get('name',''),data.feed))
-            subscriptions.append(norm(sub))
-        feeds.sort()
-
-        # annotate each entry
-        new_date_format = config.new_date_format()
-        vars = feedparser.parse(StringIO(doc))
-        vars.feeds = [value for name,value in feeds]
-        last_feed = None
-        last_date = None
-        for entry in vars.entries:
-             entry.source.config = find_config(config, entry.source)
-
-             # add new_feed and new_date fields
-             entry.new_feed = entry.source.id
-             entry.new_date = date = None
-             if entry.has_key('published_parsed'): date=entry.published_parsed
-             if entry.has_key('updated_parsed'): date=entry.updated_parsed
-             if date: entry.new_date = time.strftime(new_date_format, date)
-
-             # remove new_feed and new_date fields if not "new"
-             if entry.new_date == last_date:
-                 entry.new_date = None
-                 if entry.new_feed == last_feed:
-                     entry.new_feed = None
-                 else:
-                     last_feed = entry.new_feed
-             elif entry.new_date:
-                 last_date = entry.new_date
-                 last_feed = None
-
-             # add streams for all text constructs
-             for key in entry.keys():
-                 if key.endswith("_detail") and entry[key].has_key('type') and \
-                     entry[key].has_key('value'):
-                     streamify(entry[key],entry.source.planet_bozo)
-             if entry.has_key('content'):
-                 for content in entry.content:
-                     streamify(content,entry.source.planet_bozo)
-     
-        # add cumulative feed information to the Genshi context
-        vars.feed.config = dict(config.parser.items('Planet',True))
-        context.push(vars)
+        # template; the annotations are shared by every Genshi template
+        # applied to the same model
+        from planet import model
+        if not isinstance(doc, model.Model): doc = model.Model(doc)
+        context.push(doc.memoize('genshi', annotate, doc))
 
     # apply template
     output=tmpl.generate(context).render('xml')
@@ -5,35 +5,76 @@ import datetime
 import tmpl
 from planet import config
 
+# the template information is computed from a shared planet.model.Model
+accepts_model = True
+
+# the current date is a datetime, so Django template authors can use the
+# "date" filter on it
 def DjangoPlanetDate(value):
     return datetime.datetime(*value[:6])
 
-# remap PlanetDate to be a datetime, so Django template authors can use 
-# the "date" filter on these values
-tmpl.PlanetDate = DjangoPlanetDate
+def template_info(doc, names=None):
+    """ the htmltmpl template information, with the current date converted
+        for Django """
+    return tmpl.template_info(doc, names, DjangoPlanetDate)
 
-def run(script, doc, output_file=None, options={}):
-    """process a Django template file"""
+def prepare(script, doc):
+    """ compute the template information for a planet.model.Model """
+    template_info(doc)
+
+# Django template engines, by template directory, each with a cached loader
+engines = {}
 
-    # this is needed to use the Django template system as standalone
-    # I need to re-import the settings at every call because I have to 
-    # set the TEMPLATE_DIRS variable programmatically
+# modification times of the templates loaded, by file name
+loaded = {}
+
+def configure():
+    """ configure Django for standalone use, once per process """
     from django.conf import settings
-    settings._wrapped=None
+    if settings.configured: return
+    settings.configure(DEBUG=True, TEMPLATE_DEBUG=True)
     try:
-        settings.configure(
-            DEBUG=True, TEMPLATE_DEBUG=True, 
-            TEMPLATE_DIRS=(os.path.dirname(script),)
-            )
-    except EnvironmentError:
+        import django
+        django.setup()
+    except AttributeError:
         pass
+
+def get_template(script):
+    """ load a template, reusing the compiled form of it (and of any template
+        it extends or includes) unless it has since been modified """
+    configure()
+    directory = os.path.dirname(script)
+    try:
+        from django.template import Engine
+    except ImportError:
+        # before Django 1.8 the template directories can only be configured
+        # globally, and templates are recompiled each time they are loaded
+        from django.conf import settings
+        from django.template import loader
+        settings.TEMPLATE_DIRS = (directory,)
+        return loader.get_template(script)
+
+    mtime = os.stat(script).st_mtime
+    if loaded.get(script, mtime) != mtime and engines.has_key(directory):
+        del engines[directory]
+    loaded[script] = mtime
+
+    if not engines.has_key(directory):
+        engines[directory] = Engine(dirs=[directory], debug=True, loaders=[
+            ('django.template.loaders.cached.Loader',
+                ['django.template.loaders.filesystem.Loader'])])
+    return engines[directory].get_template(script)
+
+def run(script, doc, output_file=None, options={}):
+    """process a Django template file"""
+
     from django.template import Context
-    from django.template.loader import get_template
 
     # set up the Django context by using the default htmltmpl 
-    # datatype converters
+    # datatype converters; the information may be shared with other
+    # templates, so the context is given a copy
     context = Context()
-    context.update(tmpl.template_info(doc))
+    context.update(dict(template_info(doc)))
     context['Config'] = config.planet_options()
     t = get_template(script)
 
@@ -0,0 +1,190 @@
+"""
+JSON Feed output, serialized directly from the spliced planet.
+
+A template named, for example, feed.json.jsonfeed produces feed.json, a
+JSON Feed 1.1 document (https://jsonfeed.org/version/1.1) containing every
+entry of the spliced planet.  The template itself may be empty, or may
+contain a JSON object whose members are added to, or replace, those of the
+generated feed; for example a description or an icon.  Each item carries
+the subscription it came from in a _planet extension object.
+
+Items are encoded once per planet.model.Model, and shared by every JSON
+template applied to it; each document is written out an item at a time.
+
+Template options:
+  page_size  split the items into pages of this many items.  The first page
+             is written to the output file, and the rest alongside it as
+             feed-2.json, feed-3.json and so on, each linked to the next by
+             its next_url.
+  indent     indent each level of the output, items included, by this many
+             spaces, rather than writing it as compactly as possible.
+"""
+
+import os, urlparse
+import json
+import planet
+from planet import config, model
+import tmpl
+
+# the items are computed from a shared planet.model.Model
+accepts_model = True
+
+version = 'https://jsonfeed.org/version/1.1'
+
+def date(value):
+    """ an RFC 3339 date, from a time tuple """
+    if value: return planet.strftime('%Y-%m-%dT%H:%M:%SZ', value)
+
+def link(data, rel='alternate'):
+    """ the href of the first link with the given relation """
+    for link in data.get('links', []):
+        if link.get('rel') == rel and link.get('href'): return link.href
+
+def plain(detail):
+    """ the value of a feedparser text construct, as plain text """
+    if detail.get('type') == 'text/plain': return detail.value
+    return tmpl.stripHtml(detail.value).result
+
+def author(detail):
+    """ a JSON Feed author object, from a feedparser author_detail """
+    author = {}
+    if detail.get('name'): author['name'] = detail.name
+    if detail.get('href'): author['url'] = detail.href
+    return author
+
+def source(data):
+    """ the _planet extension object describing an entry's source """
+    result = {}
+    for key, value in [('id', data.get('id')),
+                       ('name', data.get('planet_name')),
+                       ('title', data.get('title_detail') and
+                            plain(data.title_detail)),
+                       ('url', link(data)),
+                       ('feed_url', link(data, 'self'))]:
+        if value: result[key] = value
+    return result
+
+def item(entry):
+    """ a JSON Feed item, from a feedparser entry """
+    item = {'id': entry.get('id') or link(entry) or ''}
+    if link(entry): item['url'] = link(entry)
+    if entry.get('title_detail'): item['title'] = plain(entry.title_detail)
+
+    content = entry.get('content') and entry.content[0] or \
+        entry.get('summary_detail')
+    if content:
+        if content.get('type') == 'text/plain':
+            item['content_text'] = content.value
+        else:
+            item['content_html'] = content.value
+    if entry.get('content') and entry.get('summary_detail'):
+        item['summary'] = plain(entry.summary_detail)
+
+    published = entry.get('published_parsed') or entry.get('updated_parsed')
+    if published: item['date_published'] = date(published)
+    if entry.get('updated_parsed'):
+        item['date_modified'] = date(entry.updated_parsed)
+
+    if entry.get('author_detail') and author(entry.author_detail):
+        item['authors'] = [author(entry.author_detail)]
+    elif entry.get('source', {}).get('author_detail'):
+        if author(entry.source.author_detail):
+            item['authors'] = [author(entry.source.author_detail)]
+
+    tags = [tag.term for tag in entry.get('tags', []) if tag.get('term')]
+    if tags: item['tags'] = tags
+
+    if entry.get('source'): item['_planet'] = source(entry.source)
+    return item
+
+def utf8(value):
+    """ encode unicode as UTF-8 """
+    if isinstance(value, unicode): return value.encode('utf-8')
+    return value
+
+def encoder(indent=None):
+    """ a JSON encoder, which is as compact as possible unless indented """
+    if indent: return json.JSONEncoder(ensure_ascii=False, indent=indent)
+    return json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+def encode_items(data, indent):
+    """ the items of a feedparser parse of a spliced planet, encoded, and
+        when indented, indented to their depth within the items array """
+    encode = encoder(indent).encode
+    if not indent: return [utf8(encode(item(entry))) for entry in data.entries]
+    pad = '\n' + ' ' * 2 * indent
+    return [pad[1:] + utf8(encode(item(entry))).replace('\n', pad)
+        for entry in data.entries]
+
+def items(doc, indent=None):
+    """ the encoded items of a planet.model.Model """
+    return doc.memoize(('jsonfeed', indent), encode_items, doc.parse(), indent)
+
+def prepare(script, doc):
+    """ encode the items of a planet.model.Model """
+    items(doc)
+
+def header(script, output_file):
+    """ the members of the feed, other than its items """
+    feed = {'version': version, 'title': config.name()}
+    if config.link(): feed['home_page_url'] = config.link()
+    if output_file:
+        feed['feed_url'] = urlparse.urljoin(config.link(),
+            os.path.basename(output_file))
+    if config.owner_name():
+        feed['authors'] = [{'name': config.owner_name()}]
+
+    template = open(script).read()
+    if template.strip(): feed.update(json.loads(template))
+    return feed
+
+def write(out, feed, items, indent=None):
+    """ write a feed to a file, one encoded item at a time """
+    feed_encoder = encoder(indent)
+    feed = utf8(feed_encoder.encode(feed))
+    comma, colon = feed_encoder.item_separator, feed_encoder.key_separator
+    if indent:
+        pad = ' ' * indent
+        start = '%s\n%s"items"%s[' % (comma, pad, colon)
+        separator, end = comma + '\n', '\n%s]\n}' % pad
+        if items: start = start + '\n'
+        else: end = ']\n}'
+    else:
+        start, separator, end = '%s"items"%s[' % (comma, colon), comma, ']}'
+    out.write(feed[:feed.rindex('}')].rstrip() + start)
+    for i in range(len(items)):
+        if i: out.write(separator)
+        out.write(items[i])
+    out.write(end)
+
+def run(script, doc, output_file=None, options={}):
+    """ write a planet, as JSON Feed """
+    if not isinstance(doc, model.Model): doc = model.Model(doc)
+    indent = int(options.get('indent', 0)) or None
+    page_size = int(options.get('page_size', 0))
+
+    feed = header(script, output_file)
+    encoded = items(doc, indent)
+    if not output_file:
+        from StringIO import StringIO
+        out = StringIO()
+        write(out, feed, encoded[:page_size or len(encoded)], indent)
+        return out.getvalue()
+
+    # split into pages, named after the output file
+    base, ext = os.path.splitext(output_file)
+    pages = [encoded[i:i+page_size]
+        for i in range(0, len(encoded), page_size or len(encoded) or 1)]
+    names = [output_file] + ['%s-%d%s' % (base, i+1, ext)
+        for i in range(1, len(pages))]
+
+    for i in range(max(len(pages), 1)):
+        page = feed.copy()
+        if i+1 < len(pages):
+            page['next_url'] = urlparse.urljoin(config.link(),
+                os.path.basename(names[i+1]))
+        out = open(names[i], 'w')
+        try:
+            write(out, page, pages and pages[i] or [], indent)
+        finally:
+            out.close()
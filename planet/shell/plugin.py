@@ -1,64 +1,126 @@
-import os, sys, imp
+"""
+Run a Python plugin in-process.
+
+Each plugin is compiled once, and executed in a fresh namespace on every
+call.  References to sys within the plugin are bound to a stand-in which
+provides private stdin, stdout, stderr and argv for that call only; the
+real sys module is left untouched so plugins may run concurrently.
+"""
+
+import os, sys, ast
 from StringIO import StringIO
 
+# script -> (mtime, code)
+compiled = {}
+
+class PluginSys:
+    """ the sys module, as seen by a single call to a plugin """
+    def __init__(self, stdin, stdout, stderr, argv):
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+        self.argv = argv
+
+    def __getattr__(self, name):
+        return getattr(sys, name)
+
+class RedirectSys(ast.NodeTransformer):
+    """ rewrite imports of sys and bare print statements to use __sys__ """
+
+    def stand_in(self, attr=None):
+        node = ast.Name('__sys__', ast.Load())
+        if attr: node = ast.Attribute(node, attr, ast.Load())
+        return node
+
+    def bind(self, name, value, node):
+        return ast.copy_location(
+            ast.Assign([ast.Name(name, ast.Store())], value), node)
+
+    def visit_Import(self, node):
+        result = []
+        others = []
+        for alias in node.names:
+            if alias.name == 'sys':
+                result.append(self.bind(alias.asname or 'sys',
+                    self.stand_in(), node))
+            else:
+                others.append(alias)
+        if others:
+            node.names = others
+            result.insert(0, node)
+        return result
+
+    def visit_ImportFrom(self, node):
+        if node.module != 'sys' or node.level: return node
+        if [alias for alias in node.names if alias.name == '*']: return node
+        return [self.bind(alias.asname or alias.name,
+            self.stand_in(alias.name), node) for alias in node.names]
+
+    def visit_Print(self, node):
+        if node.dest is None:
+            node.dest = ast.copy_location(self.stand_in('stdout'), node)
+        return node
+
+def load(script):
+    """ return the code object for a plugin, compiling it if changed """
+    mtime = os.stat(script).st_mtime
+    if compiled.get(script, (None,))[0] != mtime:
+        handle = open(script, 'rb')
+        try:
+            tree = ast.parse(handle.read(), script)
+        finally:
+            handle.close()
+        tree = ast.fix_missing_locations(RedirectSys().visit(tree))
+        compiled[script] = (mtime, compile(tree, script, 'exec'))
+    return compiled[script][1]
+
 def run(script, doc, output_file=None, options={}):
-    """ process an Python script using imp """
-    save_sys = (sys.stdin, sys.stdout, sys.stderr, sys.argv)
+    """ process an Python script in-process """
+    import planet
     plugin_stdout = StringIO()
     plugin_stderr = StringIO()
 
+    # determine __file__ value
+    options = options.copy()
+    if options.has_key("__file__"):
+        plugin_file = options["__file__"]
+        del options["__file__"]
+    else:
+        plugin_file = script
+
+    # set up a private stdin, stdout, stderr and argv
+    options = sum([['--'+key, value] for key,value in options.items()], [])
+    plugin_sys = PluginSys(StringIO(doc), plugin_stdout, plugin_stderr,
+        [plugin_file] + options)
+    namespace = {'__name__': '__main__', '__file__': plugin_file,
+        '__sys__': plugin_sys}
+
+    # execute script
+    cwd = os.getcwd()
     try:
-        # redirect stdin
-        sys.stdin = StringIO(doc)
-
-        # redirect stdout
-        if output_file:
-            sys.stdout = open(output_file, 'w')
-        else:
-            sys.stdout = plugin_stdout
-
-        # redirect stderr
-        sys.stderr = plugin_stderr
-
-        # determine __file__ value
-        if options.has_key("__file__"):
-            plugin_file = options["__file__"]
-            del options["__file__"]
-        else:
-            plugin_file = script
-
-        # set sys.argv
-        options = sum([['--'+key, value] for key,value in options.items()], [])
-        sys.argv = [plugin_file] + options
-
-        # import script
-        handle = open(script, 'r')
-        cwd = os.getcwd()
         try:
             try:
-                try:
-                    description=('.plugin', 'rb', imp.PY_SOURCE)
-                    imp.load_module('__main__',handle,plugin_file,description)
-                except SystemExit,e:
-                    if e.code: log.error('%s exit rc=%d',(plugin_file,e.code))
-            except Exception, e:
-                import traceback
-                type, value, tb = sys.exc_info()
-                plugin_stderr.write(''.join(
-                   traceback.format_exception_only(type,value) +
-                   traceback.format_tb(tb)))
-        finally:
-            handle.close()
-            if cwd != os.getcwd(): os.chdir(cwd)
-
+                exec load(script) in namespace
+            except SystemExit,e:
+                if e.code:
+                    planet.logger.error('%s exit rc=%s', plugin_file, e.code)
+        except Exception, e:
+            import traceback
+            type, value, tb = sys.exc_info()
+            plugin_stderr.write(''.join(
+               traceback.format_exception_only(type,value) +
+               traceback.format_tb(tb)))
     finally:
-        # restore system state
-        sys.stdin, sys.stdout, sys.stderr, sys.argv = save_sys
+        if cwd != os.getcwd(): os.chdir(cwd)
 
     # log anything sent to stderr
     if plugin_stderr.getvalue():
-        import planet
         planet.logger.error(plugin_stderr.getvalue())
 
     # return stdout
-    return plugin_stdout.getvalue()
+    if output_file:
+        output = open(output_file, 'w')
+        output.write(plugin_stdout.getvalue())
+        output.close()
+    else:
+        return plugin_stdout.getvalue()
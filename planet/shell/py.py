@@ -1,8 +1,35 @@
 from subprocess import Popen, PIPE
-import sys 
+import sys, os, re, imp
+
+# python filters which define a top level filter_tree function are run in
+# process on a parsed document; the source is scanned rather than imported
+# so that stdin based scripts are never executed by accident
+tree_re = re.compile(r'^def filter_tree\s*\(', re.M)
+tree_filters = {}
+
+def tree_filter(script):
+    """ return the filter_tree function of a python filter, if present """
+    mtime = os.stat(script).st_mtime
+    if tree_filters.get(script, (None,))[0] != mtime:
+        module = None
+        source = open(script).read()
+        if tree_re.search(source):
+            name = os.path.splitext(os.path.basename(script))[0]
+            module = imp.new_module('planet_filter_' + re.sub(r'\W','_',name))
+            module.__file__ = script
+            exec compile(source, script, 'exec') in module.__dict__
+
+        # retain the module itself, as its globals are cleared once released
+        tree_filters[script] = (mtime, module)
+
+    return getattr(tree_filters[script][1], 'filter_tree', None)
+
+# templates are fed the spliced document a piece at a time
+accepts_stream = True
 
 def run(script, doc, output_file=None, options={}):
-    """ process an Python script """
+    """ process an Python script; doc is either a string, or, for templates,
+        an iterable of pieces of the document """
 
     if output_file:
         out = open(output_file, 'w')
@@ -11,10 +38,27 @@ def run(script, doc, output_file=None, options={}):
 
     options = sum([['--'+key, value] for key,value in options.items()], [])
 
-    proc = Popen([sys.executable, script] + options,
-        stdin=PIPE, stdout=out, stderr=PIPE)
-
-    stdout, stderr = proc.communicate(doc)
+    if isinstance(doc, basestring):
+        proc = Popen([sys.executable, script] + options,
+            stdin=PIPE, stdout=out, stderr=PIPE)
+        stdout, stderr = proc.communicate(doc)
+    else:
+        # errors are collected in a file, so that the script never blocks
+        # writing them while it is being fed
+        import tempfile
+        errors = tempfile.TemporaryFile()
+        proc = Popen([sys.executable, script] + options,
+            stdin=PIPE, stdout=out, stderr=errors)
+        try:
+            for piece in doc: proc.stdin.write(piece)
+        except IOError:
+            pass
+        proc.stdin.close()
+        stdout = proc.stdout and proc.stdout.read()
+        proc.wait()
+        errors.seek(0)
+        stderr = errors.read()
+        errors.close()
     if stderr:
         import planet
         planet.logger.error(stderr)
@@ -1,7 +1,356 @@
+"""
+Process a sed script.
+
+The subset of sed used by typical filters (s///, d, line number, $ and
+regular expression addresses, ranges and negation) is interpreted
+in-process: each script is compiled once, translating its POSIX basic
+regular expressions into Python ones.  Scripts using anything else are
+passed to an external sed.
+"""
+
+import os, re
 from subprocess import Popen, PIPE
 
+class Unsupported(Exception):
+    """ the script uses sed features which are not interpreted in-process """
+    pass
+
+# POSIX character classes with a direct Python equivalent
+char_classes = {
+    'alpha': 'a-zA-Z', 'digit': '0-9', 'alnum': 'a-zA-Z0-9',
+    'upper': 'A-Z', 'lower': 'a-z', 'xdigit': '0-9a-fA-F',
+    'space': ' \\t\\n\\r\\f\\v', 'blank': ' \\t',
+}
+
+# escapes with the same meaning in GNU sed and Python regular expressions
+same_escapes = {'w': r'\w', 'W': r'\W', 's': r'\s', 'S': r'\S',
+    'b': r'\b', 'B': r'\B', '<': r'\b', '>': r'\b', '`': r'\A', "'": r'\Z',
+    'n': '\n', 't': '\t', '+': '+', '?': '?', '(': '(', ')': ')',
+    '{': '{', '}': '}'}
+
+def bracket(regex, i):
+    """ translate a bracket expression starting at regex[i] (the '[') """
+    result = '['
+    i += 1
+    if regex[i:i+1] == '^':
+        result += '^'
+        i += 1
+    if regex[i:i+1] == ']':
+        result += '\\]'
+        i += 1
+    while i < len(regex) and regex[i] != ']':
+        c = regex[i]
+        if regex.startswith('[:', i):
+            end = regex.find(':]', i)
+            if end < 0 or regex[i+2:end] not in char_classes:
+                raise Unsupported('character class')
+            result += char_classes[regex[i+2:end]]
+            i = end + 2
+            continue
+        elif regex.startswith('[.', i) or regex.startswith('[=', i):
+            raise Unsupported('collating element')
+        elif c == '\\' and regex[i+1:i+2] in ['n', 't', '\\']:
+            result += {'n': '\\n', 't': '\\t', '\\': '\\\\'}[regex[i+1]]
+            i += 2
+            continue
+        elif c in '\\[':
+            result += '\\' + c
+        else:
+            result += c
+        i += 1
+    if i >= len(regex): raise Unsupported('unterminated bracket')
+    return result + ']', i + 1
+
+def translate(regex):
+    """ translate a POSIX basic regular expression into a Python one """
+    result = ''
+    i = 0
+    while i < len(regex):
+        c = regex[i]
+        start = i == 0 or regex[:i].endswith('\\(') or \
+            (i == 1 and regex[0] == '^')
+        if c == '\\':
+            i += 1
+            if i >= len(regex): raise Unsupported('trailing backslash')
+            c = regex[i]
+            if c in same_escapes:
+                result += same_escapes[c]
+            elif c.isdigit() and c != '0':
+                result += '\\' + c
+            elif c == '|' or c.isalnum():
+                raise Unsupported('escape \\' + c)
+            else:
+                result += re.escape(c)
+        elif c == '[':
+            part, i = bracket(regex, i)
+            result += part
+            continue
+        elif c == '*':
+            result += start and '\\*' or '*'
+        elif c == '^':
+            result += start and '^' or '\\^'
+        elif c == '$':
+            end = i == len(regex)-1 or regex.startswith('\\)', i+1)
+            result += end and '$' or '\\$'
+        elif c == '.':
+            result += c
+        else:
+            result += re.escape(c)
+        i += 1
+    return result
+
+def split(script, i, delim):
+    """ return the text up to the next unescaped delimiter, and the index
+        following that delimiter; escaped delimiters are unescaped """
+    result = ''
+    while i < len(script):
+        c = script[i]
+        if c == '\n':
+            break
+        elif c == '\\' and script[i+1:i+2] == delim:
+            result += delim
+            i += 2
+        elif c == '\\' and i+1 < len(script):
+            result += script[i:i+2]
+            i += 2
+        elif c == delim:
+            return result, i + 1
+        else:
+            result += c
+            i += 1
+    raise Unsupported('unterminated %s' % delim)
+
+def replacement(text):
+    """ translate the replacement part of s/// into a list of literal
+        strings and group numbers """
+    parts = []
+    literal = ''
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c == '&':
+            parts += [literal, 0]
+            literal = ''
+        elif c == '\\' and i+1 < len(text):
+            i += 1
+            c = text[i]
+            if c.isdigit():
+                parts += [literal, int(c)]
+                literal = ''
+            elif c == 'n':
+                literal += '\n'
+            elif c == 't':
+                literal += '\t'
+            elif c.isalpha():
+                raise Unsupported('replacement escape \\' + c)
+            else:
+                literal += c
+        else:
+            literal += c
+        i += 1
+    return parts + [literal]
+
+class Address:
+    """ a line number, the last line ($), or a regular expression """
+    def __init__(self, line=None, last=False, regex=None):
+        self.line = line
+        self.last = last
+        self.regex = regex
+
+    def matches(self, text, lineno, last):
+        if self.line is not None: return lineno == self.line
+        if self.last: return last
+        return self.regex.search(text) is not None
+
+def address(script, i, delim_re):
+    """ parse an address starting at script[i], returning it and the index
+        following it """
+    match = re.compile(r'\d+').match(script, i)
+    if match:
+        return Address(line=int(match.group())), match.end()
+    if script[i:i+1] == '$':
+        return Address(last=True), i + 1
+    if script[i:i+1] in ['/', '\\']:
+        if script[i] == '\\':
+            i += 1
+            if i >= len(script): raise Unsupported('address')
+        delim = script[i]
+        if delim in delim_re: raise Unsupported('address delimiter')
+        regex, i = split(script, i+1, delim)
+        if not regex: raise Unsupported('empty regular expression')
+        flags = 0
+        if script[i:i+1] == 'I':
+            flags = re.I
+            i += 1
+        return Address(regex=re.compile(translate(regex), flags)), i
+    return None, i
+
+class Command:
+    """ a single, optionally addressed, sed command """
+    def __init__(self, name, addr1=None, addr2=None, negate=False):
+        self.name = name
+        self.addr1 = addr1
+        self.addr2 = addr2
+        self.negate = negate
+        self.active = False
+
+    def selects(self, text, lineno, last):
+        """ determine whether this command applies to the current line """
+        if not self.addr1:
+            match = True
+        elif not self.addr2:
+            match = self.addr1.matches(text, lineno, last)
+        elif self.active:
+            match = True
+            if self.addr2.line is not None:
+                self.active = lineno < self.addr2.line
+            else:
+                self.active = not self.addr2.matches(text, lineno, last)
+        elif self.addr1.matches(text, lineno, last):
+            match = True
+            if self.addr2.line is not None:
+                self.active = lineno < self.addr2.line
+            else:
+                self.active = not (self.addr2.last and last)
+        else:
+            match = False
+        return match != self.negate
+
+    def substitute(self, text):
+        """ apply an s command to the pattern space """
+        matches = [0]
+        def replace(match):
+            matches[0] += 1
+            if matches[0] < self.occurrence: return match.group(0)
+            if matches[0] > self.occurrence and not self.all:
+                return match.group(0)
+            result = []
+            for part in self.replacement:
+                if isinstance(part, int):
+                    result.append(match.group(part) or '')
+                else:
+                    result.append(part)
+            return ''.join(result)
+
+        if self.all or self.occurrence > 1:
+            return self.regex.sub(replace, text)
+        else:
+            return self.regex.sub(replace, text, 1)
+
+def compile_script(script):
+    """ compile the text of a sed script into a list of commands """
+    commands = []
+    delim_re = '.*[^$\n\\'
+    i = 0
+    while i < len(script):
+        c = script[i]
+        if c in ' \t\n;':
+            i += 1
+            continue
+        if c == '#':
+            if i == 0 and script.startswith('#n\n'):
+                raise Unsupported('#n')
+            i = script.find('\n', i)
+            if i < 0: break
+            continue
+
+        # addresses
+        addr1, i = address(script, i, delim_re)
+        addr2 = None
+        if addr1 and script[i:i+1] == ',':
+            addr2, i = address(script, i+1, delim_re)
+            if not addr2: raise Unsupported('address')
+        while script[i:i+1] in [' ', '\t']: i += 1
+        negate = script[i:i+1] == '!'
+        if negate: i += 1
+        while script[i:i+1] in [' ', '\t']: i += 1
+
+        name = script[i:i+1]
+        command = Command(name, addr1, addr2, negate)
+        if name == 'd':
+            i += 1
+        elif name == 's' and i+1 < len(script):
+            delim = script[i+1]
+            if delim in delim_re: raise Unsupported('s delimiter')
+            regex, i = split(script, i+2, delim)
+            text, i = split(script, i, delim)
+            if not regex: raise Unsupported('empty regular expression')
+            command.replacement = replacement(text)
+            command.all = False
+            command.occurrence = 1
+            flags = 0
+            match = re.compile(r'[gI0-9]*').match(script, i)
+            for flag in re.findall(r'g|I|\d+', match.group()):
+                if flag == 'g': command.all = True
+                elif flag == 'I': flags = re.I
+                else: command.occurrence = int(flag)
+            i = match.end()
+            command.regex = re.compile(translate(regex), flags)
+        else:
+            raise Unsupported('command %s' % name)
+
+        # only whitespace, a comment, or a separator may follow
+        while script[i:i+1] in [' ', '\t']: i += 1
+        if script[i:i+1] not in ['', '\n', ';', '#']:
+            raise Unsupported('trailing %s' % script[i])
+        commands.append(command)
+
+    return commands
+
+def execute(commands, doc):
+    """ apply compiled commands to a document """
+    lines = doc.split('\n')
+    newline = lines[-1] == ''
+    if newline: lines.pop()
+
+    for command in commands: command.active = False
+
+    output = []
+    for index, text in enumerate(lines):
+        last = index == len(lines)-1
+        for command in commands:
+            if not command.selects(text, index+1, last): continue
+            if command.name == 'd': break
+            text = command.substitute(text)
+        else:
+            output.append(text)
+            if newline or not last: output.append('\n')
+
+    return ''.join(output)
+
+# script -> (mtime, commands or None if unsupported)
+compiled = {}
+
+def load(script):
+    """ return the compiled commands for a script, or None if the script
+        must be run by an external sed """
+    mtime = os.stat(script).st_mtime
+    if compiled.get(script, (None,))[0] != mtime:
+        handle = open(script)
+        try:
+            try:
+                commands = compile_script(handle.read())
+            except (Unsupported, re.error), e:
+                import planet
+                planet.logger.debug('Using external sed for %s: %s',
+                    script, e)
+                commands = None
+        finally:
+            handle.close()
+        compiled[script] = (mtime, commands)
+    return compiled[script][1]
+
 def run(script, doc, output_file=None, options={}):
-    """ process an Python script """
+    """ process a sed script """
+
+    commands = load(script)
+    if commands is not None:
+        output = execute(commands, doc)
+        if not output_file: return output
+        out = open(output_file, 'w')
+        out.write(output)
+        out.close()
+        return
 
     if output_file:
         out = open(output_file, 'w')
@@ -1,8 +1,12 @@
 from xml.sax.saxutils import escape
-import sgmllib, time, os, sys, new, urlparse, re
-from planet import config, feedparser
+import sgmllib, time, os, sys, urlparse, re, cPickle
+import planet
+from planet import config, feedparser, model
 import htmltmpl
 
+# the template information is computed from a shared planet.model.Model
+accepts_model = True
+
 voids=feedparser._BaseHTMLProcessor.elements_no_end_tag
 empty=re.compile(r"<((%s)[^>]*)></\2>" % '|'.join(voids))
 
@@ -56,16 +60,16 @@ def Plain(value):
     return str(stripHtml(value))
 
 def PlanetDate(value):
-    return time.strftime(config.date_format(), value)
+    return planet.strftime(config.date_format(), value)
 
 def NewDate(value):
-    return time.strftime(config.new_date_format(), value)
+    return planet.strftime(config.new_date_format(), value)
 
 def Rfc822(value):
-    return time.strftime("%a, %d %b %Y %H:%M:%S +0000", value)
+    return planet.strftime("%a, %d %b %Y %H:%M:%S +0000", value)
 
 def Rfc3399(value):
-    return time.strftime("%Y-%m-%dT%H:%M:%S+00:00", value)
+    return planet.strftime("%Y-%m-%dT%H:%M:%S+00:00", value)
 
 # Map from FeedParser path to Planet tmpl names
 Base = [
@@ -126,42 +130,76 @@ Items = [
 for rule in Base:
     Items.append(['channel_'+rule[0], rule[1], 'source'] + rule[2:])
 
-def tmpl_mapper(source, rules):
-    "Apply specified rules to the source, and return a template dictionary"
-    output = {}
+# rules, indexed by the distinct source paths they follow
+indexed_rules = {}
+
+def index_rules(rules):
+    """ the distinct paths followed by a list of rules, and for each rule
+        its name, its mapping function and the index of its path """
+    entry = indexed_rules.get(id(rules))
+    if entry and entry[0] is rules: return entry[1:]
 
+    paths = []
+    indexed = []
     for rule in rules:
-        node = source
-        for path in rule[2:]:
-            if isinstance(path, str) and path in node:
-                if path == 'value':
-                    if node.get('type','')=='text/plain':
-                        node['value'] = escape(node['value'])
-                        node['type'] = 'text/html'
-                    elif node.get('type','')=='application/xhtml+xml':
-                        node['value'] = empty.sub(r"<\1 />", node['value'])
-                node = node[path]
-            elif isinstance(path, int):
-                node = node[path]
-            elif isinstance(path, dict):
-                for test in node:
-                    for key, value in path.items():
-                        if test.get(key,None) != value: break
-                    else:
-                        node = test
-                        break
+        if rule[2:] not in paths: paths.append(rule[2:])
+        indexed.append((rule[0], rule[1], paths.index(rule[2:])))
+    indexed_rules[id(rules)] = (rules, paths, indexed)
+    return paths, indexed
+
+def follow(source, path):
+    "Follow a path into the source, returning None if it is not present"
+    node = source
+    for step in path:
+        if isinstance(step, str) and step in node:
+            if step == 'value':
+                # the source is shared with other templates, so is left as is
+                if node.get('type','')=='text/plain':
+                    node = escape(node['value'])
+                elif node.get('type','')=='application/xhtml+xml':
+                    node = empty.sub(r"<\1 />", node['value'])
+                else:
+                    node = node['value']
+            else:
+                node = node[step]
+        elif isinstance(step, int):
+            node = node[step]
+        elif isinstance(step, dict):
+            for test in node:
+                for key, value in step.items():
+                    if test.get(key,None) != value: break
                 else:
+                    node = test
                     break
             else:
-                break
+                return None
         else:
-            if node: output[rule[0]] = rule[1](node)
+            return None
+    return node
+
+def wanted(names, name):
+    "Determine if a variable is among the names; None stands for every name"
+    return names is None or name in names
+
+def tmpl_mapper(source, rules, names=None):
+    """Apply specified rules to the source, and return a template dictionary;
+    if a set of names is given, only rules producing those names are applied"""
+    output = {}
+
+    # follow each distinct path once, no matter how many rules share it
+    paths, indexed = index_rules(rules)
+    nodes = {}
+    for name, function, path in indexed:
+        if not wanted(names, name): continue
+        if not nodes.has_key(path): nodes[path] = follow(source, paths[path])
+        if nodes[path]: output[name] = function(nodes[path])
         
     # copy over all planet namespaced elements from parent source
     for name,value in source.items():
         if name.startswith('planet_'):
             output[name[7:]] = String(value)
-        if not output.get('name') and source.has_key('title_detail'):
+        if not output.get('name') and wanted(names, 'name') and \
+            source.has_key('title_detail'):
             output['name'] = Plain(source.title_detail.value)
 
     # copy over all planet namespaced elements from child source element
@@ -170,89 +208,404 @@ def tmpl_mapper(source, rules):
             if name.startswith('planet_'):
                 output['channel_' + name[7:]] = String(value)
             if not output.get('channel_name') and \
+                wanted(names, 'channel_name') and \
                 source.source.has_key('title_detail'):
                 output['channel_name'] = Plain(source.source.title_detail.value)
 
     return output
 
-def _end_planet_source(self):
-    self._end_source()
-    context = self._getContext()
-    if not context.has_key('sources'): context['sources'] = []
-    context.sources.append(context.source)
-    del context['source']
-
-def template_info(source):
-    """ get template information from a feedparser output """
-
-    # wire in support for planet:source, call feedparser, unplug planet:source
-    mixin=feedparser._FeedParserMixin
-    mixin._start_planet_source = mixin._start_source
-    mixin._end_planet_source = \
-        new.instancemethod(_end_planet_source, None, mixin)
-    data=feedparser.parse(source)
-    del mixin._start_planet_source
-    del mixin._end_planet_source
-
-    # apply rules to convert feed parser output to htmltmpl input
-    output = {'Channels': [], 'Items': []}
-    output.update(tmpl_mapper(data.feed, Base))
-    sources = []
-    for feed in data.feed.get('sources',[]):
-        source = tmpl_mapper(feed, Base)
-        sources.append([source.get('name'), source])
-    sources.sort()
-    output['Channels'] = [source for name,source in sources]
-    for entry in data.entries:
-        output['Items'].append(tmpl_mapper(entry, Items))
-
-    # synthesize isPermaLink attribute
-    for item in output['Items']:
-        if item.get('id') == item.get('link'):
-            item['guid_isPermaLink']='true'
+def template_info(source, names=None, planet_date=PlanetDate):
+    """ get template information from a feedparser output
+
+    If a list of names is given, only those template variables (and loops)
+    are guaranteed to be mapped, sparing the cost of the remainder.  The
+    current date is converted with planet_date.
+
+    The source may also be a planet.model.Model, in which case the result is
+    shared with every other htmltmpl template applied to the same model, and
+    each variable is mapped at most once.
+    """
+    if isinstance(source, model.Model):
+        # django converts the date differently, so its results are kept
+        # separately
+        info = source.memoize(('template_info', planet_date),
+            TemplateInfo, source.parse(), planet_date)
+    else:
+        info = TemplateInfo(model.parse(source), planet_date)
+    return info.map(names)
+
+def template_names(template):
+    """ the names of the variables and loops used by a compiled template """
+    tokens = template.tokens()
+    names = set()
+    for i in range(len(tokens)):
+        if tokens[i] in ('<TMPL_VAR', '<TMPL_IF', '<TMPL_UNLESS', '<TMPL_LOOP'):
+            names.add(tokens[i + htmltmpl.PARAM_NAME])
+    return names
+
+def prepare(script, doc):
+    """ compute the template information for a planet.model.Model """
+    manager = TemplateManager(config.template_cache_directory())
+    template_info(doc, template_names(manager.prepare(script)))
+
+class TemplateInfo:
+    """ htmltmpl input for a parsed feed, mapped on demand: variables are
+        only mapped once some template asks for them, and then for every
+        channel and item at once """
+
+    def __init__(self, data, planet_date=PlanetDate):
+        self.data = data
+        self.names = set()
+        self.channels = self.items = None
+        self.output = {'Channels': [], 'Items': []}
+
+        # feed level information
+        fixed = self.fixed = {}
+        fixed['generator'] = config.generator_uri()
+        fixed['name'] = config.name()
+        fixed['link'] = config.link()
+        fixed['owner_name'] = config.owner_name()
+        fixed['owner_email'] = config.owner_email()
+        fixed['pubsubhubbub_hub'] = config.pubsubhubbub_hub()
+        if config.feed():
+            fixed['feed'] = config.feed()
+            fixed['feedtype'] = config.feed().find('rss')>=0 and 'rss' or 'atom'
+
+        # date/time information
+        date = time.gmtime()
+        fixed['date'] = planet_date(date)
+        fixed['date_iso'] = Rfc3399(date)
+        fixed['date_822'] = Rfc822(date)
+
+    def map(self, names=None):
+        """ map the named variables, or every variable, if not already
+            mapped; returns the htmltmpl input """
+        if self.names is None: return self.output
+        if names is not None:
+            names = set(names)
+            if 'guid_isPermaLink' in names: names.update(['id', 'link'])
+            if 'new_channel' in names: names.add('new_date')
+            names -= self.names
+            if not names: return self.output
+            self.names |= names
         else:
-            item['guid_isPermaLink']='false'
-
-    # feed level information
-    output['generator'] = config.generator_uri()
-    output['name'] = config.name()
-    output['link'] = config.link()
-    output['owner_name'] = config.owner_name()
-    output['owner_email'] = config.owner_email()
-    output['pubsubhubbub_hub'] = config.pubsubhubbub_hub()
-    if config.feed():
-        output['feed'] = config.feed()
-        output['feedtype'] = config.feed().find('rss')>=0 and 'rss' or 'atom'
-
-    # date/time information
-    date = time.gmtime()
-    output['date'] = PlanetDate(date)
-    output['date_iso'] = Rfc3399(date)
-    output['date_822'] = Rfc822(date)
-
-    # remove new_dates and new_channels that aren't "new"
-    date = channel = None
-    for item in output['Items']:
-        if item.has_key('new_date'):
-            if item['new_date'] == date:
-                del item['new_date']
-            else:
-                date = item['new_date']
+            self.names = None
+
+        # apply rules to convert feed parser output to htmltmpl input
+        data = self.data
+        output = self.output
+        output.update(tmpl_mapper(data.feed, Base, names))
+        output.update(self.fixed)
+
+        if self.channels is not None:
+            for feed, source in self.channels:
+                source.update(tmpl_mapper(feed, Base, names))
+        elif wanted(self.names, 'Channels'):
+            # channels are sorted by name, so it is always mapped
+            every = self.names and self.names.union(['name'])
+            sources = []
+            for feed in data.feed.get('sources',[]):
+                source = tmpl_mapper(feed, Base, every)
+                sources.append([source.get('name'), source, feed])
+            sources.sort()
+            self.channels = [(feed, source) for name,source,feed in sources]
+            output['Channels'] = [source for feed,source in self.channels]
+
+        if self.items is not None:
+            for entry, item in self.items:
+                item.update(tmpl_mapper(entry, Items, names))
+        elif wanted(self.names, 'Items'):
+            names = self.names
+            self.items = [(entry, tmpl_mapper(entry, Items, names))
+                for entry in data.entries]
+            output['Items'] = [item for entry,item in self.items]
+        else:
+            return output
 
-        if item.has_key('new_channel'):
-            if item['new_channel'] == channel and not item.has_key('new_date'):
-                del item['new_channel']
+        # synthesize isPermaLink attribute
+        if wanted(names, 'guid_isPermaLink'):
+            for item in output['Items']:
+                if item.get('id') == item.get('link'):
+                    item['guid_isPermaLink']='true'
+                else:
+                    item['guid_isPermaLink']='false'
+
+        # remove new_dates and new_channels that aren't "new"
+        if wanted(names, 'new_date'):
+            date = None
+            for item in output['Items']:
+                if item.has_key('new_date'):
+                    if item['new_date'] == date:
+                        del item['new_date']
+                    else:
+                        date = item['new_date']
+
+        if wanted(names, 'new_channel'):
+            channel = None
+            for item in output['Items']:
+                if item.has_key('new_channel'):
+                    if item['new_channel'] == channel and \
+                        not item.has_key('new_date'):
+                        del item['new_channel']
+                    else:
+                        channel = item['new_channel']
+
+        return output
+
+# compiled templates, by file name, retained for the life of the process
+compiled_templates = {}
+
+class TemplateManager(htmltmpl.TemplateManager):
+    """ a template manager which keeps precompiled templates in a cache
+        directory, rather than beside the template where it may not be
+        able to write them, and which also retains them in memory """
+
+    def __init__(self, directory):
+        htmltmpl.TemplateManager.__init__(self)
+        self.directory = directory
+
+    def prepare(self, file):
+        file = os.path.abspath(file)
+        compiled = compiled_templates.get(file)
+        compile_params = (self._include, self._max_include,
+                          self._comments, self._gettext)
+        if not compiled or not compiled.is_uptodate(compile_params):
+            compiled = htmltmpl.TemplateManager.prepare(self, file)
+            compiled_templates[file] = compiled
+        return compiled
+
+    def precompiled(self, file):
+        """ name of the file holding the precompiled form of a template """
+        from planet import memo
+        return os.path.join(self.directory, '%s.%s.tmplc' %
+            (os.path.basename(file), memo.digest(file)[:8]))
+
+    def is_precompiled(self, file):
+        return os.path.isfile(self.precompiled(file))
+
+    def load_precompiled(self, file):
+        filename = self.precompiled(file)
+        try:
+            handle = open(filename, 'rb')
+            try:
+                return cPickle.load(handle)
+            finally:
+                handle.close()
+        except Exception:
+            raise htmltmpl.PrecompiledError, filename
+
+    def save_precompiled(self, template):
+        from planet.manifest import replace
+        filename = self.precompiled(template.file())
+        temp = '%s.tmp%d' % (filename, os.getpid())
+        try:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+            handle = open(temp, 'wb')
+            try:
+                cPickle.dump(template, handle, 1)
+            finally:
+                handle.close()
+            replace(temp, filename)
+        except (IOError, OSError, cPickle.PicklingError), e:
+            import planet
+            planet.logger.warn("Unable to save precompiled template %s: %s",
+                filename, e)
+            if os.path.exists(temp): os.unlink(temp)
+
+class Unsupported(Exception):
+    """ a template, or template data, beyond the generated render functions;
+        such templates are processed by htmltmpl itself """
+
+# expressions computing the loop magic variables from the pass and total
+magic_vars = {
+    '__FIRST__': 'int(%(p)s == 0)',
+    '__LAST__': 'int(%(p)s == %(n)s - 1)',
+    '__INNER__': 'int(%(p)s != 0 and %(p)s != %(n)s - 1)',
+    '__PASS__': '%(p)s + 1',
+    '__PASSTOTAL__': '%(n)s',
+    '__ODD__': 'int(%(p)s %% 2 == 0)',
+}
+
+ordinary_types = (str, int, long, float)
+
+def text(value):
+    """ convert a template value to a string, as TMPL_VAR does """
+    if type(value) is list: return str(len(value))
+    return str(value)
+
+def find_global(name, default, scope, *outer):
+    """ look up a variable with GLOBAL="1", innermost scope first """
+    if name in scope: return scope[name]
+    for scope in outer:
+        if name in scope and type(scope[name]) in ordinary_types:
+            return scope[name]
+    return default
+
+def generate(tokens):
+    """ generate the source of a python function which renders the given
+        compiled template tokens in the same way that
+        htmltmpl.TemplateProcessor (with html_escape=0) would """
+
+    source = ['def render(s0):', ' out = []', ' append = out.append']
+    literal = []
+    blocks = []
+    depth = 0
+
+    def indent(line, offset=0):
+        # loops are nested two deep: an if, then a for
+        loops = len([block for block in blocks if block[0] == 'LOOP'])
+        source.append(' ' * (1 + len(blocks) + loops + offset) + line)
+
+    def emit(line):
+        if ''.join(literal):
+            indent('append(%r)' % ''.join(literal))
+        del literal[:]
+        if line: indent(line)
+
+    def lookup(name, globalp):
+        if not name: raise Unsupported('no identifier')
+        if depth and name.startswith('__'):
+            names = {'p': 'p%d' % depth, 'n': 'n%d' % depth}
+            if magic_vars.has_key(name):
+                return magic_vars[name] % names
+            elif name.startswith('__EVERY__'):
+                try:
+                    every = int(name[9:])
+                except ValueError:
+                    raise Unsupported(name)
+                if not every: raise Unsupported(name)
+                return ('int(%(p)s != 0 and %(p)s != %(n)s - 1 and ' +
+                    '(%(p)s + 1) %% ' + str(every) + ' == 0)') % names
+            else:
+                raise Unsupported(name)
+
+        default = name[0].isupper() and '0' or "''"
+        if globalp == '1' and depth:
+            return 'find_global(%r, %s, %s)' % (name, default,
+                ', '.join(['s%d' % level for level in range(depth,-1,-1)]))
+        return 's%d.get(%r, %s)' % (depth, name, default)
+
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if not token.startswith('<TMPL_') and not token.startswith('</TMPL_'):
+            literal.append(token)
+            i += 1
+            continue
+
+        if len(tokens) < i + 1 + htmltmpl.PARAMS_NUMBER:
+            raise Unsupported('truncated template')
+        name = tokens[i + htmltmpl.PARAM_NAME]
+        escape = tokens[i + htmltmpl.PARAM_ESCAPE]
+        globalp = tokens[i + htmltmpl.PARAM_GLOBAL]
+        i += 1 + htmltmpl.PARAMS_NUMBER
+
+        if token == '<TMPL_VAR':
+            emit('v = ' + lookup(name, globalp))
+            if escape in ('HTML', '1'):
+                emit('append(escape_html(text(v), 1))')
+            elif escape == 'URL':
+                emit('append(quote_plus(text(v)))')
             else:
-                channel = item['new_channel']
+                emit('append(v.__class__ is str and v or text(v))')
+
+        elif token in ('<TMPL_IF', '<TMPL_UNLESS'):
+            condition = lookup(name, globalp)
+            if token == '<TMPL_UNLESS': condition = 'not (%s)' % condition
+            emit('if %s:' % condition)
+            blocks.append([token[6:], False])
+            emit('pass')
+
+        elif token == '<TMPL_ELSE':
+            if not blocks or blocks[-1][0] == 'LOOP' or blocks[-1][1]:
+                raise Unsupported('unmatched <TMPL_ELSE>')
+            emit(None)
+            blocks[-1][1] = True
+            indent('else:', -1)
+            emit('pass')
+
+        elif token in ('</TMPL_IF', '</TMPL_UNLESS'):
+            if not blocks or blocks[-1][0] != token[7:]:
+                raise Unsupported('unmatched %s>' % token)
+            emit(None)
+            blocks.pop()
+
+        elif token == '<TMPL_LOOP':
+            if not name or (depth and name.startswith('__')):
+                raise Unsupported('unsupported loop %s' % name)
+            depth += 1
+            emit('l%d = s%d.get(%r)' % (depth, depth-1, name))
+            emit('if l%d:' % depth)
+            blocks.append(['LOOP', False])
+            indent('if type(l%d) is not list: raise Unsupported(%r)' %
+                (depth, name), -1)
+            indent('n%d = len(l%d)' % (depth, depth), -1)
+            indent('for p%d, s%d in enumerate(l%d):' % (depth, depth, depth),
+                -1)
+            emit('pass')
+
+        elif token == '</TMPL_LOOP':
+            if not blocks or blocks[-1][0] != 'LOOP':
+                raise Unsupported('unmatched </TMPL_LOOP>')
+            emit(None)
+            blocks.pop()
+            depth -= 1
+
+        elif token == '<TMPL_BOUNDARY':
+            pass
 
-    return output
+        else:
+            # includes which could not be resolved, and gettext
+            raise Unsupported('unsupported statement %s>' % token)
+
+    if blocks: raise Unsupported('missing </TMPL_%s>' % blocks[-1][0])
+    emit(None)
+    source.append(" return ''.join(out)")
+    return '\n'.join(source) + '\n'
+
+# generated render functions, by file name, along with the template from
+# which each was generated
+render_functions = {}
+
+def render_function(template):
+    """ the generated render function for a compiled template, or None if
+        the template can only be processed by htmltmpl """
+    entry = render_functions.get(template.file())
+    if entry and entry[0] is template: return entry[1]
+
+    import cgi, urllib
+    try:
+        namespace = {'text': text, 'find_global': find_global,
+            'escape_html': cgi.escape, 'quote_plus': urllib.quote_plus,
+            'Unsupported': Unsupported}
+        code = compile(generate(template.tokens()),
+            template.file() or '<template>', 'exec')
+        exec code in namespace
+        render = namespace['render']
+    except Unsupported:
+        render = None
+    render_functions[template.file()] = (template, render)
+    return render
+
+def process(tp, template):
+    """ process a compiled template with the variables set in an
+        htmltmpl.TemplateProcessor, using a generated render function
+        wherever possible """
+    render = render_function(template)
+    if render:
+        try:
+            return render(tp._vars)
+        except Unsupported:
+            pass
+    return tp.process(template)
 
 def run(script, doc, output_file=None, options={}):
     """ process an HTMLTMPL file """
-    manager = htmltmpl.TemplateManager()
+    manager = TemplateManager(config.template_cache_directory())
     template = manager.prepare(script)
     tp = htmltmpl.TemplateProcessor(html_escape=0)
-    for key,value in template_info(doc).items():
+    for key,value in template_info(doc, template_names(template)).items():
         tp.set(key, value)
 
     if output_file:
@@ -262,10 +615,10 @@ def run(script, doc, output_file=None, options={}):
         tp.set('fullurl', urlparse.urljoin(config.link(),basename))
 
         output = open(output_file, "w")
-        output.write(tp.process(template))
+        output.write(process(tp, template))
         output.close()
     else:
-        return tp.process(template)
+        return process(tp, template)
 
 if __name__ == '__main__':
     sys.path.insert(0, os.path.split(sys.path[0])[0])
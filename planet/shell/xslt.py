@@ -1,5 +1,8 @@
 import os
 
+# a shared planet.model.Model is parsed by libxml2 only once
+accepts_model = True
+
 def quote(string, apos):
     """ quote a string so that it can be passed as a parameter """
     if type(string) == unicode:
@@ -14,18 +17,46 @@ def quote(string, apos):
         # unclear how to quote strings with both types of quotes for libxslt
         return "'" + string.replace("'",apos) + "'"
 
+def parse(model):
+    """ parse a planet.model.Model with libxml2, freeing the result when
+        the model is closed """
+    import libxml2
+    dom = libxml2.parseDoc(str(model))
+    model.on_close(dom.freeDoc)
+    return dom
+
+def prepare(script, model):
+    """ parse a planet.model.Model with libxml2, if available, or otherwise
+        serialize it for xsltproc """
+    try:
+        import libxml2
+        import libxslt
+    except:
+        return str(model)
+    model.memoize('libxml2', parse, model)
+
 def run(script, doc, output_file=None, options={}):
-    """ process an XSLT stylesheet """
+    """ process an XSLT stylesheet
 
+    The document may be a planet.model.Model, in which case one libxml2
+    parse of it is shared by every stylesheet applied to that model.
+    """
+
+    from planet import model
+    shared = isinstance(doc, model.Model)
     try:
         # if available, use the python interface to libxslt
         import libxml2
         import libxslt
-        dom = libxml2.parseDoc(doc)
+        if shared:
+            dom = doc.memoize('libxml2', parse, doc)
+        else:
+            dom = libxml2.parseDoc(doc)
         docfile = None
     except:
         # otherwise, use the command line interface
         dom = None
+        doc = str(doc)
 
     # do it
     result = None
@@ -73,6 +104,6 @@ def run(script, doc, output_file=None, options={}):
             import planet
             planet.logger.error(stderr)
 
-    if dom: dom.freeDoc()
+    if dom and not shared: dom.freeDoc()
 
     return result
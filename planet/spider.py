@@ -6,6 +6,7 @@ and write each as a set of entries in a cache directory.
 # Standard library modules
 import time, calendar, re, os, urlparse
 from xml.dom import minidom
+from xml.parsers import expat
 # Planet modules
 import planet, config, feedparser, reconstitute, shell, socket, scrub
 from StringIO import StringIO 
@@ -187,8 +188,13 @@ def writeCache(feed_uri, feed_info, data):
         if updated >= ids.get(entry.id,('',))[0]:
             ids[entry.id] = (updated, entry)
 
+    feedid = data.feed.get('id', data.feed.get('link',None))
+    if type(feedid) == unicode: feedid = feedid.encode('utf-8')
+
     # write each entry to the cache
     cache = config.cache_directory()
+    track = index != None and feedid and config.subscription_templates()
+    touched = False
     for updated, entry in ids.values():
 
         # compute blacklist file name based on the id
@@ -224,27 +230,41 @@ def writeCache(feed_uri, feed_info, data):
 
         # apply any filters
         xdoc = reconstitute.reconstitute(data, entry)
-        output = xdoc.toxml().encode('utf-8')
+        output = shell.run_filters(config.filters(feed_uri), xdoc)
         xdoc.unlink()
-        for filter in config.filters(feed_uri):
-            output = shell.run(filter, output, mode="filter")
-            if not output: break
         if not output:
-          if os.path.exists(cache_file): os.remove(cache_file)
+          if os.path.exists(cache_file):
+              os.remove(cache_file)
+              touched = True
           continue
 
+        # splice copies cached entries verbatim, so only cache well formed
+        # entries
+        try:
+            expat.ParserCreate().Parse(output, True)
+        except expat.ExpatError, e:
+            log.error("Malformed output from filters for %s: %s", entry.id, e)
+            continue
+
+        # note whether the content of the entry has changed
+        if track and not touched:
+            try:
+                touched = open(cache_file).read() != output
+            except IOError:
+                touched = True
+
         # write out and timestamp the results
         write(output, cache_file, mtime) 
     
         # optionally index
-        if index != None: 
-            feedid = data.feed.get('id', data.feed.get('link',None))
-            if feedid:
-                if type(feedid) == unicode: feedid = feedid.encode('utf-8')
-                index[filename('', entry.id)] = feedid
+        if index != None and feedid:
+            index[filename('', entry.id)] = feedid
 
     if index: index.close()
 
+    # record the feed for the subscription pages, see planet.subscriptions
+    if track and touched: idindex.touch([feedid])
+
     # identify inactive feeds
     if config.activity_threshold(feed_uri):
         updated = [entry.updated_parsed for entry in data.entries
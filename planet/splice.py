@@ -1,29 +1,22 @@
 """ Splice together a planet from a cache of feed entries """
-import glob, os, time, shutil, pickle, traceback,sys
+import glob, os, re, time, shutil, pickle, traceback,sys, logging, tempfile
 from xml.dom import minidom
+from xml.parsers import expat
+from xml.sax.saxutils import unescape
 import planet, config, feedparser, reconstitute, shell
 from reconstitute import createTextElement, date
 from spider import filename
-from planet import idindex
+from planet import idindex, manifest, archive, subscriptions, search
 import traceback
 
 posted_urls_file = 'posted_urls.pickle'
 
-def splice():
-    """ Splice together a planet from a cache of entries """
+def header():
+    """ the spliced document, without any entries, along with the ids of
+        the subscriptions """
     import planet
     log = planet.logger
 
-    log.info("Loading cached data")
-    cache = config.cache_directory()
-    dir=[(os.stat(file).st_mtime,file) for file in glob.glob(cache+"/*")
-        if not os.path.isdir(file)]
-    dir.sort()
-    dir.reverse()
-
-    max_items=max([config.items_per_page(templ)
-        for templ in config.template_files() or ['Planet']])
-
     doc = minidom.parseString('<feed xmlns="http://www.w3.org/2005/Atom"/>')
     feed = doc.documentElement
 
@@ -92,12 +85,34 @@ def splice():
         reconstitute.source(xdoc.documentElement, data.feed, None, None)
         feed.appendChild(xdoc.documentElement)
 
+    return doc, sub_ids
+
+def entries(sub_ids):
+    """ the cached entries selected for the planet, newest first, each as
+        the name of the file and its content
+
+    Entries are checked to be well formed, which expat does quickly, but
+    are selected without being parsed into a tree, as the spider caches
+    entries with a predictable source element.
+    """
+    import planet
+    log = planet.logger
+
+    log.info("Loading cached data")
+    cache = config.cache_directory()
+    dir=[(os.stat(file).st_mtime,file) for file in glob.glob(cache+"/*")
+        if not os.path.isdir(file)]
+    dir.sort()
+    dir.reverse()
+
+    max_items=max([config.items_per_page(templ)
+        for templ in config.template_files() or ['Planet']])
+
     index = idindex.open()
 
     # insert entry information
     items = 0
     count = {}
-    atomNS='http://www.w3.org/2005/Atom'
     new_feed_items = config.new_feed_items()
 
     posted_urls = set()
@@ -117,33 +132,40 @@ def splice():
 		continue
 
         try:
-            entry=minidom.parse(file)
+            cached = open(file)
+            try:
+                data = cached.read()
+            finally:
+                cached.close()
+
+            # the spider only caches well formed entries, but the cache may
+            # predate that check, or have been damaged since; one malformed
+            # entry would spoil the whole of a streamed document
+            try:
+                expat.ParserCreate(None, ' ').Parse(data, True)
+            except expat.ExpatError, e:
+                log.error("Skipping malformed entry %s: %s", file, e)
+                continue
 
             # verify that this entry is currently subscribed to and that the
             # number of entries contributed by this feed does not exceed
             # config.new_feed_items
-            entry.normalize()
-            sources = entry.getElementsByTagNameNS(atomNS, 'source')
-            if sources:
-                ids = sources[0].getElementsByTagName('id')
-                if ids:
-                    id = ids[0].childNodes[0].nodeValue
-                    count[id] = count.get(id,0) + 1
-                    if new_feed_items and count[id] > new_feed_items:
-			continue
-
-                    if id not in sub_ids:
-                        ids = sources[0].getElementsByTagName('planet:id')
-                        if not ids:
-			    continue
-                        id = ids[0].childNodes[0].nodeValue
-                        if id not in sub_ids:
-                          log.warn('Skipping: ' + id)
-                        if id not in sub_ids:
-			    continue
+            id, planet_id = source_ids(data)
+            if id:
+                count[id] = count.get(id,0) + 1
+                if new_feed_items and count[id] > new_feed_items:
+                    continue
+
+                if id not in sub_ids:
+                    if not planet_id:
+                        continue
+                    if planet_id not in sub_ids:
+                        log.warn('Skipping: ' + planet_id)
+                        continue
 
 	    # Twitter integration
 	    if config.post_to_twitter():
+		entry = minidom.parseString(data)
 		url = None
 		twitter = None
 		title = "Untitled post..."
@@ -181,7 +203,7 @@ def splice():
 			log.error(u"Error posting to Twitter: %s", ex)
 	    
             # add entry to feed
-            feed.appendChild(entry.documentElement)
+            yield file, data
             items = items + 1
             if items >= max_items:
 		break
@@ -198,65 +220,319 @@ def splice():
     if index:
 	index.close()
 
+def source_ids(data):
+    """ the atom:id and planet:id of the source of a cached entry, either of
+        which may be None
+
+    The serialized entry is searched for the last (and therefore not
+    content) source element, falling back to parsing the entry if that
+    element is written in some other way.
+    """
+    start = data.rfind('<source>')
+    end = data.find('</source>', start)
+    if start >= 0 and end >= 0 or not source_re.search(data):
+        source = data[max(start, 0):max(end, 0)]
+        ids = []
+        for id_re in source_id_re:
+            match = id_re.search(source)
+            if match and '&#' in match.group(1): break
+            ids.append(match and unescape(match.group(1),
+                {'&quot;': '"', '&apos;': "'"}).decode('utf-8') or None)
+        else:
+            return ids
+
+    atomNS='http://www.w3.org/2005/Atom'
+    entry = minidom.parseString(data)
+    entry.normalize()
+    ids = [None, None]
+    sources = entry.getElementsByTagNameNS(atomNS, 'source')
+    if sources:
+        for i, tag in enumerate(['id', 'planet:id']):
+            nodes = sources[0].getElementsByTagName(tag)
+            if nodes: ids[i] = nodes[0].childNodes[0].nodeValue
+    entry.unlink()
+    return ids
+
+source_re = re.compile(r'<(\w+:)?source[\s/>]')
+source_id_re = [re.compile(r'<id>([^<]*)</id>'),
+    re.compile(r'<planet:id>([^<]*)</planet:id>')]
+
+def splice():
+    """ Splice together a planet from a cache of entries """
+    doc, sub_ids = header()
+    for file, data in entries(sub_ids):
+        entry = minidom.parseString(data)
+        entry.normalize()
+        doc.documentElement.appendChild(entry.documentElement)
     return doc
 
+xml_declaration = re.compile(r'^<\?xml[^>]*\?>\s*')
+
+def stream():
+    """ Splice together a planet from a cache of entries, as a stream
+
+    Returns the serialized document as an iterator over its pieces: the
+    feed and subscription information, and then the cached bytes of each
+    entry in turn, so that the spliced document is never held in memory as
+    a whole.  The result may be passed to apply, or written to a file.
+
+    The entries are selected before this returns, so that everything done
+    along the way, such as posting them to Twitter, happens whether or not
+    the stream is ever read, just as it does for splice.
+    """
+    doc, sub_ids = header()
+    files = [file for file, data in entries(sub_ids)]
+    return pieces(doc, files)
+
+def pieces(doc, files):
+    """ the pieces of a spliced document: the feed, with each of the cached
+        entries named by files inserted before its end tag """
+    log = planet.logger
+    feed = doc.toxml('utf-8')
+    end = feed.rindex('</feed>')
+    yield feed[:end]
+    for file in files:
+        try:
+            cached = open(file)
+            try:
+                data = cached.read()
+            finally:
+                cached.close()
+        except IOError, e:
+            log.error("Error reading %s: %s", file, e)
+            continue
+        yield xml_declaration.sub('', data)
+    yield feed[end:]
+
 def apply(doc):
+    """ apply each configured template to a spliced document
+
+    The document may be the minidom document returned by splice, its
+    serialization, or the stream returned by stream.  Either way it is
+    wrapped in a single planet.model.Model, so that the work of parsing or
+    serializing it is shared by every template.  Returns the names, relative
+    to the output directory, of the files whose content changed.
+    """
+    from planet.model import Model
+    if isinstance(doc, Model): return apply_templates(doc)
+
+    doc = Model(doc)
+    try:
+        return apply_templates(doc)
+    finally:
+        doc.close()
+
+def render(template_file, doc, output, directory=''):
+    """ render one template, and run any template specific filters
+
+    The template is rendered into a private staging directory, and the
+    result is then passed to output, a planet.manifest.Manifest, which only
+    writes it into the output directory (or the given subdirectory of it)
+    if it has changed.  Any further files which the engine writes alongside
+    its output, such as additional pages, are passed on as they are, and
+    those it wrote last time, but not this, are removed.
+    """
+    planet_filters = config.filters('Planet')
+    staging = tempfile.mkdtemp(dir=config.cache_output_directory())
+    try:
+        output_file = shell.run(template_file, doc, output_dir=staging)
+        if not output_file or not os.path.exists(output_file): return
+        name = os.path.join(directory, os.path.basename(output_file))
+        files = {}
+        for file in os.listdir(staging):
+            rendered = open(os.path.join(staging, file), 'rb')
+            try:
+                files[os.path.join(directory, file)] = rendered.read()
+            finally:
+                rendered.close()
+        data = files.pop(name)
+    finally:
+        shutil.rmtree(staging)
+
+    for file, content in files.items():
+        output.write(file, content)
+    prune(output, name, files.keys())
+
+    # run any template specific filters
+    if config.filters(template_file) != planet_filters:
+        for filter in config.filters(template_file):
+            if filter in planet_filters: continue
+            if filter.find('>')>0:
+                # tee'd output
+                filter,dest = filter.split('>',1)
+                tee = shell.run(filter.strip(), data, mode="filter")
+                if tee: output.write(os.path.join(directory, dest.strip()), tee)
+            else:
+                # pipe'd output
+                data = shell.run(filter, data, mode="filter")
+                if not data:
+                    output.remove(name)
+                    return
+
+    output.write(name, data)
+
+def prune(output, name, files):
+    """ remove the files which the previous run wrote alongside the named
+        output file, such as additional pages, and which this one did not;
+        and record the files this run wrote, for use by the next """
+    path = os.path.join(config.cache_output_directory(), 'companions',
+        filename('', name))
+    try:
+        previous = open(path).read().splitlines()
+    except IOError:
+        previous = []
+    for companion in previous:
+        if companion not in files: output.remove(companion)
+
+    if files:
+        dir = os.path.dirname(path)
+        if not os.path.exists(dir): os.makedirs(dir)
+        temp = '%s.tmp%d' % (path, os.getpid())
+        file = open(temp, 'w')
+        try:
+            file.write(''.join([companion + '\n'
+                for companion in sorted(files)]))
+        finally:
+            file.close()
+        manifest.replace(temp, path)
+    elif previous:
+        os.unlink(path)
+
+class LogRecorder(logging.Handler):
+    """ collect the level and text of each message logged """
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.levelno, self.format(record)))
+
+# the document and manifest used by render_parallel, inherited by each child
+rendering = None
+
+def render_logged(template_file):
+    """ render a template in a child process, returning the messages it
+        logged, the traceback of any error, and the files it wrote, for
+        replay by the parent """
+    doc, output = rendering
+    output.updates = {}
+    log = planet.logger
+    recorder = LogRecorder()
+    recorder.setFormatter(logging.Formatter('%(message)s'))
+    propagate = log.propagate
+    log.propagate = False
+    log.addHandler(recorder)
+    try:
+        try:
+            render(template_file, doc, output)
+            error = None
+        except:
+            error = ''.join(traceback.format_exception(*sys.exc_info()))
+    finally:
+        log.removeHandler(recorder)
+        log.propagate = propagate
+    return recorder.records, error, output.updates
+
+def render_parallel(template_files, doc, output, processes):
+    """ render templates concurrently, in a pool of forked processes
+
+    Views of the document which the engines will need are computed before
+    forking, so that each is still only computed once.  The messages
+    logged while rendering each template are replayed in the order in
+    which the templates are listed, followed by any errors.
+    """
+    global rendering
+    from multiprocessing import Pool
+    log = planet.logger
+
+    for template_file in template_files:
+        shell.prepare(template_file, doc)
+
+    rendering = (doc, output)
+    try:
+        pool = Pool(min(processes, len(template_files)))
+        try:
+            results = pool.map(render_logged, template_files, 1)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        rendering = None
+
+    errors = []
+    for template_file, (records, error, updates) in \
+        zip(template_files, results):
+        output.update(updates)
+        for level, message in records:
+            log.log(level, message)
+        if error:
+            log.error("Error rendering %s: %s", template_file, error)
+            errors.append(template_file)
+
+    if errors:
+        log.error("%d of %d templates failed: %s", len(errors),
+            len(template_files), ' '.join(errors))
+
+def apply_templates(doc):
+    """ apply each configured template to a planet.model.Model, and copy
+        the bill of materials, returning the names of the output files
+        which changed """
+
     output_dir = config.output_dir()
     if not os.path.exists(output_dir):
 	os.makedirs(output_dir)
     log = planet.logger
 
-    planet_filters = config.filters('Planet')
-
     # Go-go-gadget-template
-    for template_file in config.template_files():
-        output_file = shell.run(template_file, doc)
-
-        # run any template specific filters
-        if config.filters(template_file) != planet_filters:
-            output = open(output_file).read()
-            for filter in config.filters(template_file):
-                if filter in planet_filters: continue
-                if filter.find('>')>0:
-                    # tee'd output
-                    filter,dest = filter.split('>',1)
-                    tee = shell.run(filter.strip(), output, mode="filter")
-                    if tee:
-                        output_dir = planet.config.output_dir()
-                        dest_file = os.path.join(output_dir, dest.strip())
-                        dest_file = open(dest_file,'w')
-                        dest_file.write(tee)
-                        dest_file.close()
-                else:
-                    # pipe'd output
-                    output = shell.run(filter, output, mode="filter")
-                    if not output:
-                        os.unlink(output_file)
-                        break
-            else:
-                handle = open(output_file,'w')
-                handle.write(output)
-                handle.close()
-
-    # Process bill of materials
-    for copy_file in config.bill_of_materials():
-        dest = os.path.join(output_dir, copy_file)
-        for template_dir in config.template_directories():
-            source = os.path.join(template_dir, copy_file)
-            if os.path.exists(source): break
+    cache_output_dir = config.cache_output_directory()
+    if not os.path.exists(cache_output_dir): os.makedirs(cache_output_dir)
+    output = manifest.Manifest(output_dir,
+        os.path.join(cache_output_dir, 'manifest'), config.precompress())
+    template_files = config.template_files()
+    processes = config.template_processes()
+    try:
+        if processes > 1 and len(template_files) > 1 and hasattr(os, 'fork'):
+            render_parallel(template_files, doc, output, processes)
         else:
-            log.error('Unable to locate %s', copy_file)
-            log.info("Template search path:")
-            for template_dir in config.template_directories():
-                log.info("    %s", os.path.realpath(template_dir))
-            continue
+            for template_file in template_files:
+                render(template_file, doc, output)
+
+        if config.archive():
+            archive.update(doc, output)
 
-        mtime = os.stat(source).st_mtime
-        if not os.path.exists(dest) or os.stat(dest).st_mtime < mtime:
-            dest_dir = os.path.split(dest)[0]
-            if not os.path.exists(dest_dir): os.makedirs(dest_dir)
+        if config.subscription_templates():
+            subscriptions.update(doc, output)
 
-            log.info("Copying %s to %s", source, dest)
-            if os.path.exists(dest): os.chmod(dest, 0644)
-            shutil.copyfile(source, dest)
-            shutil.copystat(source, dest)
+        if config.search_index():
+            search.update(output)
+
+        # Process bill of materials
+        for copy_file in config.bill_of_materials():
+            dest = os.path.join(output_dir, copy_file)
+            for template_dir in config.template_directories():
+                source = os.path.join(template_dir, copy_file)
+                if os.path.exists(source): break
+            else:
+                log.error('Unable to locate %s', copy_file)
+                log.info("Template search path:")
+                for template_dir in config.template_directories():
+                    log.info("    %s", os.path.realpath(template_dir))
+                continue
+
+            mtime = os.stat(source).st_mtime
+            if not os.path.exists(dest) or os.stat(dest).st_mtime < mtime:
+                dest_dir = os.path.split(dest)[0]
+                if not os.path.exists(dest_dir): os.makedirs(dest_dir)
+
+                log.info("Copying %s to %s", source, dest)
+                if os.path.exists(dest): os.chmod(dest, 0644)
+                shutil.copyfile(source, dest)
+                shutil.copystat(source, dest)
+            output.track(copy_file)
+
+        if config.etag_manifest():
+            output.write_etags(config.etag_manifest())
+    finally:
+        output.save()
+
+    return output.changed()
@@ -0,0 +1,154 @@
+"""
+Subscription pages, rendered from the newest entries of each subscription.
+
+When subscription_templates are configured, they are also applied to a page
+for each subscribed feed, containing only the entries from that feed, within
+a subdirectory of the output directory such as
+subscriptions/example.com,feed/index.html.
+
+The spider records which feeds it has written new or changed entries for,
+and the id index maps each cached entry to its feed (see planet.idindex),
+so only the pages of those feeds are rendered again, and only their entries
+are read.  Without an index, every page is rendered again from a scan of the
+cache.  Either way, pages are only written if their content has changed, and
+the pages of feeds which are no longer subscribed to are removed.
+
+Usage:
+  from planet import subscriptions
+  subscriptions.update(doc, output)
+"""
+
+import os
+from xml.dom import minidom
+import planet
+from planet import config, idindex
+from planet.archive import Archive, header, remove, templates
+from planet.spider import filename
+
+def load(path):
+    """ the template digest last used for each page, by feed id """
+    pages = {}
+    try:
+        file = open(path)
+    except IOError:
+        return pages
+    try:
+        for line in file:
+            try:
+                digest, id = line.rstrip('\n').split(' ', 1)
+                pages[id] = digest
+            except ValueError:
+                pass
+    finally:
+        file.close()
+    return pages
+
+def save(path, pages):
+    """ record the pages for use by the next run """
+    from planet.manifest import replace
+    lines = ['%s %s\n' % (digest, id) for id, digest in pages.items()]
+    lines.sort()
+    temp = '%s.tmp%d' % (path, os.getpid())
+    file = open(temp, 'w')
+    try:
+        file.writelines(lines)
+    finally:
+        file.close()
+    replace(temp, path)
+
+def indexed(ids):
+    """ the names of the cached entries from each of the feeds in ids,
+        according to the id index, or None if there is no index """
+    index = idindex.open()
+    if index == None: return None
+    entries = {}
+    try:
+        for name in index.keys():
+            id = index[name]
+            if id in ids: entries.setdefault(id, []).append(name)
+    finally:
+        index.close()
+    return entries
+
+def scanned(ids):
+    """ the names of the cached entries from each of the feeds in ids,
+        found by scanning the cache """
+    archive = Archive(config.cache_output_directory())
+    archive.scan(config.cache_directory())
+    archive.save()
+    entries = {}
+    for name, (mtime, size, updated, sources) in archive.entries.items():
+        for id in sources:
+            if id in ids:
+                entries.setdefault(id, []).append(name)
+                break
+    return entries
+
+def newest(cache, names, count):
+    """ the newest count of the named entries, newest first """
+    entries = []
+    for name in names:
+        try:
+            entries.append((os.stat(os.path.join(cache, name)).st_mtime, name))
+        except OSError:
+            pass
+    entries.sort()
+    entries.reverse()
+    return [name for mtime, name in entries[:count]]
+
+def update(doc, output):
+    """ render the pages, for the spliced planet.model.Model doc, of the
+        subscriptions whose entries have changed, and remove the pages of
+        feeds no longer subscribed to; output is a planet.manifest.Manifest """
+    from planet.model import Model
+    from planet.splice import render
+    log = planet.logger
+    cache = config.cache_directory()
+    directory = config.subscription_directory()
+    template_files = config.subscription_templates()
+    stamp = templates(template_files)
+    max_items = max([config.items_per_page(template_file)
+        for template_file in template_files])
+
+    path = os.path.join(config.cache_output_directory(), 'subscription_pages')
+    pages = load(path)
+    page, sub_ids = header(doc)
+
+    # determine which pages to render, and the entries of each
+    touched = idindex.touched()
+    ids = []
+    for id in sub_ids:
+        if id in ids: continue
+        if touched == None or id in touched or pages.get(id) != stamp:
+            ids.append(id)
+    entries = None
+    if touched != None and ids: entries = indexed(ids)
+    if entries == None and ids: entries = scanned(ids)
+
+    for id in ids:
+        log.info("Rendering subscription page %s", id)
+        copy = page.cloneNode(True)
+        for name in newest(cache, entries.get(id, []), max_items):
+            entry = minidom.parse(os.path.join(cache, name))
+            copy.documentElement.appendChild(entry.documentElement)
+
+        model = Model(copy)
+        try:
+            for template_file in template_files:
+                render(template_file, model, output,
+                    os.path.join(directory, filename('', id)))
+            pages[id] = stamp
+        except Exception, e:
+            log.error("Error rendering subscription page %s: %s", id, e)
+            if pages.has_key(id): del pages[id]
+        model.close()
+
+    # remove the pages of feeds no longer subscribed to
+    for id in pages.keys():
+        if id in sub_ids: continue
+        log.info("Removing subscription page %s", id)
+        remove(output, directory, filename('', id))
+        del pages[id]
+
+    save(path, pages)
+    idindex.reset()
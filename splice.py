@@ -11,8 +11,7 @@ if __name__ == '__main__':
 
     if len(sys.argv) == 2 and os.path.isfile(sys.argv[1]):
         config.load(sys.argv[1])
-        doc = splice.splice()
-        splice.apply(doc.toxml('utf-8'))
+        splice.apply(splice.stream())
     else:
         print "Usage:"
         print "  python %s config.ini" % sys.argv[0]
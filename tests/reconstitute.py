@@ -75,7 +75,7 @@ if __name__ == "__main__":
         for source in doc.getElementsByTagNameNS(atomNS, 'source'):
             source.parentNode.removeChild(source)
 
-    splice.apply(doc.toxml('utf-8'))
+    splice.apply(doc)
 
     if hide_planet_ns:
         atom = open(os.path.join(output,'atom.xml')).read()
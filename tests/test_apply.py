@@ -103,6 +103,54 @@ class ApplyTest(unittest.TestCase):
         html = open(os.path.join(workdir, 'index.html')).read()
         self.assertTrue(html.find(' href="http://example.com/default.css"')>=0)
 
+class ParallelApplyTest(unittest.TestCase):
+    def setUp(self):
+        self.feeddata = open(testfeed).read()
+        os.makedirs(workdir)
+
+    def tearDown(self):
+        shutil.rmtree(os.path.split(workdir)[0])
+
+    def test_apply_parallel(self):
+        import logging, planet
+        config.load(configfile % 'fancy')
+        config.parser.set('Planet', 'template_processes', '3')
+
+        # add a template which fails to render
+        broken = os.path.join(os.path.split(workdir)[0], 'broken.html.tmpl')
+        open(broken, 'w').write('<TMPL_LOOP Items>')
+        config.parser.set('Planet', 'template_directories',
+            config.parser.get('Planet', 'template_directories') + ' ' +
+            os.path.dirname(broken))
+        templates = config.parser.get('Planet','template_files').split()
+        templates.insert(1, 'broken.html.tmpl')
+        config.parser.set('Planet','template_files',' '.join(templates))
+
+        class Recorder(logging.Handler):
+            def emit(self, record): messages.append(record.getMessage())
+        messages = []
+        recorder = Recorder()
+        planet.logger.addHandler(recorder)
+        try:
+            splice.apply(self.feeddata)
+        finally:
+            planet.logger.removeHandler(recorder)
+
+        for file in ['index.html', 'rss10.xml', 'rss20.xml']:
+            path = os.path.join(workdir, file)
+            self.assertTrue(os.stat(path).st_size > 0, file)
+        html = open(os.path.join(workdir, 'index.html')).read()
+        self.assertTrue(html.find('<h1>test planet</h1>')>=0)
+
+        # errors are reported in order, and then summarized
+        errors = [message for message in messages
+            if message.startswith('Error rendering')]
+        self.assertEqual(1, len(errors))
+        self.assertTrue(errors[0].startswith('Error rendering broken'))
+        self.assertTrue(errors[0].find('Missing </TMPL_LOOP>')>0)
+        summary = '1 of %d templates failed: broken.html.tmpl' % len(templates)
+        self.assertTrue(messages.index(summary) > messages.index(errors[0]))
+
 import test_filter_genshi
 for method in dir(test_filter_genshi.GenshiFilterTests):
     if method.startswith('test_'): break
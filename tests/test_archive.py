@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+import unittest, os, shutil
+from planet import config, splice
+
+workdir = 'tests/work/archive'
+
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        try:
+            os.makedirs(workdir)
+        except:
+            self.tearDown()
+            os.makedirs(workdir)
+
+        shutil.copytree('tests/data/splice/cache', workdir + '/cache')
+        if os.path.exists(workdir + '/cache/index'):
+            shutil.rmtree(workdir + '/cache/index')
+        open(workdir + '/ids.html.tmpl', 'w').write(
+            '<TMPL_LOOP Items>[<TMPL_VAR id>]</TMPL_LOOP>')
+
+        config.load('tests/data/splice/config.ini')
+        config.parser.set('Planet', 'cache_directory', workdir + '/cache')
+        config.parser.set('Planet', 'output_dir', workdir + '/output')
+        config.parser.set('Planet', 'template_directories', workdir)
+        config.parser.set('Planet', 'template_files', 'ids.html.tmpl')
+        config.parser.set('Planet', 'archive', 'month feed')
+
+    def tearDown(self):
+        shutil.rmtree(os.path.split(workdir)[0])
+
+    def page(self, path):
+        return open(os.path.join(workdir, 'output', 'archive', path,
+            'ids.html')).read().count('[')
+
+    def test_archive(self):
+        changed = splice.apply(splice.splice())
+
+        # every subscribed entry, not just the newest, is archived
+        pages = [name for name in changed if name.startswith('archive/')]
+        months = [name for name in pages if not name.startswith('archive/f')]
+        self.assertEqual(3, len(months))
+        self.assertEqual(12, sum([self.page(os.path.dirname(name)[8:])
+            for name in months]))
+        feed = 'feeds/planet.intertwingly.net,2006,testfeed2'
+        self.assertEqual(4, self.page(feed))
+
+        # unchanged pages are not rendered again
+        self.assertEqual([], splice.apply(splice.splice()))
+
+        # pages with changed entries are, and empty pages are removed
+        feed1 = 'feeds/planet.intertwingly.net,2006,testfeed1'
+        for name in os.listdir(workdir + '/cache'):
+            if name.find('testfeed1,') > 0:
+                os.unlink(os.path.join(workdir, 'cache', name))
+        changed = splice.apply(splice.splice())
+        self.assertTrue('archive/%s/ids.html' % feed1 not in changed)
+        self.assertFalse(os.path.exists(os.path.join(workdir, 'output',
+            'archive', feed1)))
+        self.assertEqual(4, self.page(feed))
+        self.assertEqual(6, self.page('2006/01'))
+
+    def test_unsubscribed(self):
+        config.parser.remove_section('tests/data/spider/testfeed2.atom')
+        splice.apply(splice.splice())
+        feed = 'feeds/planet.intertwingly.net,2006,testfeed2'
+        self.assertFalse(os.path.exists(os.path.join(workdir, 'output',
+            'archive', feed)))
+
+    def test_stream(self):
+        from planet.model import Model
+        doc = Model(splice.stream())
+        try:
+            changed = splice.apply(doc)
+            self.assertEqual(4, self.page(
+                'feeds/planet.intertwingly.net,2006,testfeed2'))
+
+            # the header is taken from the stream, not a parse of it all
+            self.assertFalse(doc.memo.has_key('dom'))
+        finally:
+            doc.close()
+
+    def test_same_mtime(self):
+        open(workdir + '/ids.html.tmpl', 'w').write(
+            '<TMPL_LOOP Items>[<TMPL_VAR id>]<TMPL_VAR content></TMPL_LOOP>')
+        splice.apply(splice.splice())
+
+        # an entry rewritten without changing its modification time
+        feed = 'feeds/planet.intertwingly.net,2006,testfeed2'
+        for name in os.listdir(workdir + '/cache'):
+            if name.find('testfeed2,') > 0: break
+        path = os.path.join(workdir, 'cache', name)
+        mtime = os.stat(path).st_mtime
+        data = open(path).read().replace('</content>', ' (changed)</content>')
+        open(path, 'w').write(data)
+        os.utime(path, (mtime, mtime))
+
+        changed = splice.apply(splice.splice())
+        self.assertTrue('archive/%s/ids.html' % feed in changed)
+        self.assertTrue(open(os.path.join(workdir, 'output', 'archive', feed,
+            'ids.html')).read().find('(changed)') > 0)
@@ -10,14 +10,43 @@ class DjangoFilterTests(unittest.TestCase):
 
     def test_django_filter(self):
         config.load('tests/data/filter/django/test.ini')
-        results = dj.tmpl.template_info("<feed/>")
+        results = dj.template_info("<feed/>")
         self.assertEqual(results['name'], 'Django on Venus')
 
     def test_django_date_type(self):
         config.load('tests/data/filter/django/test.ini')
-        results = dj.tmpl.template_info("<feed/>")
+        results = dj.template_info("<feed/>")
         self.assertEqual(type(results['date']), datetime.datetime)
 
+    def test_django_shared_model(self):
+        import shutil
+        from planet import model
+        config.load('tests/data/filter/django/test.ini')
+        input = open('tests/data/filter/django/test.xml').read()
+        title = os.path.realpath('tests/data/filter/django/title.html.dj')
+        try:
+            os.makedirs('tests/work/django')
+            config.parser.set('Planet', 'cache_directory',
+                'tests/work/django/cache')
+            script = os.path.realpath('tests/work/django/date.html.tmpl')
+            open(script, 'w').write('<TMPL_VAR date>')
+            output = 'tests/work/django/date.html'
+
+            # each engine converts the date its own way, whichever renders
+            # the model first
+            for django_first in [True, False]:
+                doc = model.Model(input)
+                if django_first: dj.run(title, doc)
+                dj.tmpl.run(script, doc, output)
+                self.assertEqual(u"\xa1Atom-Powered Robots Run Amok!\n",
+                    dj.run(title, doc))
+                self.assertEqual(dj.tmpl.template_info(doc)['date'],
+                    open(output).read().strip())
+                self.assertEqual(datetime.datetime,
+                    type(dj.template_info(doc)['date']))
+        finally:
+            shutil.rmtree('tests/work')
+
     def test_django_entry_title(self):
         config.load('tests/data/filter/django/test.ini')
         feed = open('tests/data/filter/django/test.xml')
@@ -33,7 +62,27 @@ class DjangoFilterTests(unittest.TestCase):
         results = dj.run(
             os.path.realpath('tests/data/filter/django/config.html.dj'), input)
         self.assertEqual(results, "Django on Venus\n")
-        
+
+    def test_django_template_cache(self):
+        import shutil
+        config.load('tests/data/filter/django/test.ini')
+        try:
+            os.makedirs('tests/work/django')
+            script = os.path.realpath('tests/work/django/name.html.dj')
+            open(script, 'w').write('{{ name }}')
+            self.assertEqual('Django on Venus', dj.run(script, '<feed/>'))
+            if dj.engines:
+                # Django 1.8 and later retain the compiled template
+                self.assertTrue(
+                    dj.get_template(script) is dj.get_template(script))
+
+            # modified templates are reloaded
+            open(script, 'w').write('[{{ name }}]')
+            os.utime(script, (0, 0))
+            self.assertEqual('[Django on Venus]', dj.run(script, '<feed/>'))
+        finally:
+            shutil.rmtree('tests/work')
+
 
 try:
     from django.conf import settings
@@ -14,6 +14,42 @@ class GenshiFilterTests(unittest.TestCase):
         self.assertTrue(output.find(' href="http://planet.intertwingly.net/opensearchdescription.xml"')>=0)
         self.assertTrue(output.find('</script>')>=0)
 
+    def test_template_loader(self):
+        from planet.shell import _genshi
+        filter = 'filters/addsearch.genshi'
+        self.assertTrue(_genshi.load(filter) is _genshi.load(filter))
+
+    def test_lazy_streams(self):
+        from planet.shell import _genshi
+        from planet import feedparser
+        text = feedparser.FeedParserDict(type='text/plain', value='a<b')
+        _genshi.streamify(text, 'false')
+        self.assertEqual(list(text.stream), list(text.stream))
+        self.assertEqual('a<b', ''.join([data for kind, data, pos
+            in text.stream if kind == 'TEXT']))
+
+    def test_shared_model(self):
+        import os, shutil
+        from planet import model
+        from planet.shell import tmpl
+        config.load('tests/data/apply/config-genshi.ini')
+        data = open('tests/data/apply/feed.xml').read()
+        script = 'themes/classic_fancy/index.html.tmpl'
+        try:
+            os.makedirs('tests/work/genshi')
+            tmpl.run(script, model.Model(data), 'tests/work/genshi/fresh')
+            expected = open('tests/work/genshi/fresh').read()
+
+            # templates rendered after genshi see the parse as it was
+            doc = model.Model(data)
+            shell.run('index.html.genshi', doc, output_dir='tests/work/genshi')
+            self.assertEqual(model.Model(data).parse().entries,
+                doc.parse().entries)
+            tmpl.run(script, doc, 'tests/work/genshi/shared')
+            self.assertEqual(expected, open('tests/work/genshi/shared').read())
+        finally:
+            shutil.rmtree('tests/work')
+
 try:
     import genshi
 except:
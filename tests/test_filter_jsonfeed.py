@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+import unittest, os, shutil, json
+from planet import config, model, splice, shell
+from planet.shell import jsonfeed
+
+workdir = 'tests/work/jsonfeed'
+
+class JsonFeedTest(unittest.TestCase):
+    def setUp(self):
+        try:
+            os.makedirs(workdir)
+        except:
+            self.tearDown()
+            os.makedirs(workdir)
+
+        config.load('tests/data/splice/config.ini')
+        config.parser.set('Planet', 'link', 'http://example.com/planet/')
+        config.parser.set('Planet', 'cache_directory', workdir + '/cache')
+        config.parser.set('Planet', 'output_dir', workdir + '/output')
+        config.parser.set('Planet', 'template_directories', workdir)
+        config.parser.set('Planet', 'template_files', 'feed.json.jsonfeed')
+        self.script = os.path.join(workdir, 'feed.json.jsonfeed')
+        open(self.script, 'w').write('')
+        self.data = open('tests/data/apply/feed.xml').read()
+
+    def tearDown(self):
+        shutil.rmtree(os.path.split(workdir)[0])
+
+    def test_jsonfeed(self):
+        feed = json.loads(jsonfeed.run(self.script, self.data))
+        self.assertEqual(jsonfeed.version, feed['version'])
+        self.assertEqual('test planet', feed['title'])
+        self.assertEqual('http://example.com/planet/', feed['home_page_url'])
+        self.assertEqual(12, len(feed['items']))
+
+        item = feed['items'][2]
+        self.assertEqual('tag:planet.intertwingly.net,2006:testfeed1/2',
+            item['id'])
+        self.assertEqual('http://example.com/2', item['url'])
+        self.assertEqual('Venus', item['title'])
+        self.assertEqual('the Jewel of the Sky', item['content_text'])
+        self.assertEqual('2006-01-02T00:00:00Z', item['date_published'])
+        self.assertEqual('2006-02-02T00:00:00Z', item['date_modified'])
+        self.assertEqual([{'name': 'Sam Ruby',
+            'url': 'http://www.intertwingly.net/blog/'}], item['authors'])
+        self.assertEqual('one', item['_planet']['name'])
+
+    def test_template(self):
+        open(self.script, 'w').write('{"description": "a test", "icon": "x"}')
+        doc = model.Model(self.data)
+        feed = json.loads(jsonfeed.run(self.script, doc))
+        self.assertEqual('a test', feed['description'])
+        self.assertEqual('x', feed['icon'])
+
+        # items are encoded once per model
+        self.assertTrue(jsonfeed.items(doc) is jsonfeed.items(doc))
+
+    def test_pages(self):
+        config.parser.add_section('feed.json.jsonfeed')
+        config.parser.set('feed.json.jsonfeed', 'page_size', '5')
+        changed = splice.apply(self.data)
+        self.assertEqual(['feed-2.json', 'feed-3.json', 'feed.json'], changed)
+
+        output = workdir + '/output/'
+        feed = json.load(open(output + 'feed.json'))
+        self.assertEqual(5, len(feed['items']))
+        self.assertEqual('http://example.com/planet/feed.json',
+            feed['feed_url'])
+        self.assertEqual('http://example.com/planet/feed-2.json',
+            feed['next_url'])
+        feed = json.load(open(output + 'feed-3.json'))
+        self.assertEqual(2, len(feed['items']))
+        self.assertFalse(feed.has_key('next_url'))
+
+        # pages no longer needed are removed
+        config.parser.set('feed.json.jsonfeed', 'page_size', '10')
+        shell.reset()
+        changed = splice.apply(self.data)
+        self.assertEqual(['feed-2.json', 'feed.json'], changed)
+        self.assertFalse(os.path.exists(output + 'feed-3.json'))
+        self.assertEqual(['feed-2.json', 'feed.json'],
+            sorted(os.listdir(output)))
+
+    def test_indent(self):
+        output = jsonfeed.run(self.script, self.data, options={'indent': '2'})
+        feed = json.loads(output)
+        self.assertEqual(12, len(feed['items']))
+
+        # items are indented to their depth within the feed
+        lines = output.split('\n')
+        lines = lines[lines.index('  "items": ['):]
+        self.assertEqual(12, lines.count('    {'))
+        self.assertEqual(12, len([line for line in lines
+            if line.startswith('      "id": ')]))
+        self.assertEqual(['  ]', '}'], lines[-2:])
+
+        # as is an empty list of items
+        output = jsonfeed.run(self.script, '<feed xmlns="http://www.w3.org/'
+            '2005/Atom"/>', options={'indent': '2'})
+        self.assertEqual([], json.loads(output)['items'])
+        self.assertEqual('  "items": []', output.split('\n')[-2])
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
 import unittest, os, sys, glob, new, re, StringIO, time
-from planet import config
+from planet import config, model
 from planet.shell import tmpl
 
 testfiles = 'tests/data/filter/tmpl/%s.%s'
@@ -52,6 +52,131 @@ class FilterTmplTest(unittest.TestCase):
             lhs, rhs = self.simple_re.match(expect).groups()
             self.assertEqual(eval(rhs), eval(lhs, results))
 
+    def test_shared_model(self):
+        config.load('tests/data/apply/config-fancy.ini')
+        data = open('tests/data/apply/feed.xml').read()
+        doc = model.Model(data)
+
+        # the document is parsed, and mapped, once per model
+        results = tmpl.template_info(doc)
+        self.assertTrue(results is tmpl.template_info(doc))
+        self.assertTrue(doc.parse() is doc.parse())
+        self.assertEqual(tmpl.template_info(data)['Items'], results['Items'])
+        self.assertEqual(12, len(results['Items']))
+        self.assertEqual(data, str(doc))
+
+        # the parse shared with other engines is left as it was
+        self.assertEqual(model.Model(data).parse().entries,
+            doc.parse().entries)
+        self.assertEqual('text/plain', doc.parse().entries[2].content[0].type)
+
+    def test_lazy_mapping(self):
+        config.load('tests/data/apply/config-fancy.ini')
+        data = open('tests/data/apply/feed.xml').read()
+        full = tmpl.template_info(data)
+
+        # only the variables asked for are mapped
+        doc = model.Model(data)
+        results = tmpl.template_info(doc, ['Items', 'title'])
+        self.assertEqual(12, len(results['Items']))
+        self.assertEqual([], results['Channels'])
+        for item in results['Items']:
+            self.assertFalse(item.has_key('title_plain'))
+            self.assertFalse(item.has_key('date_iso'))
+
+        # further variables are added to the same, shared, results
+        self.assertTrue(results is tmpl.template_info(doc, ['new_channel',
+            'Channels', 'title_plain']))
+        for key in ['title', 'title_plain', 'new_date', 'new_channel']:
+            self.assertEqual([item.get(key) for item in full['Items']],
+                [item.get(key) for item in results['Items']])
+        self.assertEqual([source.get('name') for source in full['Channels']],
+            [source.get('name') for source in results['Channels']])
+
+        # templates ask for what they use
+        import htmltmpl
+        template = htmltmpl.TemplateCompiler().compile_string(
+            '<TMPL_LOOP Items><TMPL_VAR title ESCAPE="HTML"></TMPL_LOOP>')
+        self.assertEqual(set(['Items', 'title']), tmpl.template_names(template))
+
+    def test_date_formats(self):
+        import planet
+        date = time.gmtime(0)
+        self.assertEqual('1970-01-01T00:00:00+00:00', tmpl.Rfc3399(date))
+        self.assertTrue(planet.formatted_dates.has_key(
+            ('%Y-%m-%dT%H:%M:%S+00:00', tuple(date))))
+
+        # each path is followed once, however many rules share it
+        paths, rules = tmpl.index_rules(tmpl.Items)
+        self.assertEqual(1, paths.count(['published_parsed']))
+        self.assertTrue(len(paths) < len(rules))
+
+    def test_template_cache(self):
+        import shutil, htmltmpl
+        config.load('tests/data/apply/config-fancy.ini')
+        config.parser.set('Planet', 'cache_directory', 'tests/work/cache')
+        def process(template):
+            tp = htmltmpl.TemplateProcessor(html_escape=0)
+            tp.set('name', 'test planet')
+            return tp.process(template)
+
+        try:
+            os.makedirs('tests/work/tmpl')
+            script = os.path.abspath('tests/work/tmpl/name.tmpl')
+            open(script, 'w').write('<TMPL_VAR name>')
+            manager = tmpl.TemplateManager(config.template_cache_directory())
+            template = manager.prepare(script)
+            self.assertEqual('test planet', process(template))
+
+            # precompiled into the cache directory, and retained in memory
+            self.assertFalse(os.path.exists(script + 'c'))
+            cached = glob.glob('tests/work/cache/templates/name.tmpl.*')
+            self.assertEqual(1, len(cached))
+            self.assertTrue(template is tmpl.compiled_templates[script])
+            self.assertTrue(template is manager.prepare(script))
+
+            # a new process loads the precompiled form
+            del tmpl.compiled_templates[script]
+            self.assertEqual(template.tokens(),
+                manager.prepare(script).tokens())
+
+            # modified templates are recompiled
+            open(script, 'w').write('[<TMPL_VAR name>]')
+            os.utime(script, (0, 0))
+            self.assertEqual('[test planet]', process(manager.prepare(script)))
+        finally:
+            shutil.rmtree('tests/work')
+
+    def test_render_function(self):
+        import htmltmpl
+        def process(source, **vars):
+            template = htmltmpl.TemplateCompiler().compile_string(source)
+            tp = htmltmpl.TemplateProcessor(html_escape=0)
+            for key, value in vars.items(): tp.set(key, value)
+            return tmpl.render_function(template), tp, template
+
+        # generated functions produce exactly what htmltmpl would
+        render, tp, template = process('<TMPL_VAR name ESCAPE="HTML">' +
+            '<TMPL_LOOP Items><TMPL_UNLESS __FIRST__>,</TMPL_UNLESS>' +
+            '<TMPL_VAR __PASS__>/<TMPL_VAR __PASSTOTAL__>' +
+            '<TMPL_IF __ODD__>o<TMPL_ELSE>e</TMPL_IF>' +
+            '<TMPL_IF __EVERY__2>*</TMPL_IF><TMPL_IF __LAST__>.</TMPL_IF>' +
+            '<TMPL_VAR name GLOBAL="1"> <TMPL_VAR name> <TMPL_VAR Tags>' +
+            '<TMPL_LOOP Tags>[<TMPL_VAR tag ESCAPE="URL">]</TMPL_LOOP>' +
+            '<TMPL_LOOP Missing>x</TMPL_LOOP><TMPL_VAR Missing></TMPL_LOOP>',
+            name='<a&b>', Items=[{'Tags': [{'tag': 'a b'}, {'tag': '&'}]},
+            {'name': 2}, {}, {'name': 'c', 'Tags': []}])
+        self.assertTrue(render)
+        self.assertEqual(tp.process(template), render(tp._vars))
+
+        # anything else is left to htmltmpl
+        render, tp, template = process('<TMPL_LOOP Items>')
+        self.assertEqual(None, render)
+        render, tp, template = process('<TMPL_LOOP name>x</TMPL_LOOP>',
+            name='scalar')
+        self.assertRaises(tmpl.Unsupported, render, tp._vars)
+        self.assertRaises(TypeError, tmpl.process, tp, template)
+
 # build a test method for each xml test file
 for testcase in glob.glob(testfiles % ('*','xml')):
     root = os.path.splitext(os.path.basename(testcase))[0]
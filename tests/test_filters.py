@@ -69,6 +69,99 @@ class FilterTests(unittest.TestCase):
             u'adipiscing elit. Nullam velit. Vivamus tincidunt, erat ' +
             u'in \u2026', excerpt.firstChild.firstChild.nodeValue)
 
+    def test_tree_filter_chain(self):
+        config.load('tests/data/filter/excerpt-images.ini')
+        config.parser.set('Planet', 'filters',
+            'coral_cdn_filter.py excerpt.py')
+
+        testfile = 'tests/data/filter/coral_cdn.xml'
+        doc = xml.dom.minidom.parse(testfile)
+        output = shell.run_filters(config.filters(), doc)
+
+        dom = xml.dom.minidom.parseString(output)
+        excerpt = dom.getElementsByTagName('planet:excerpt')[0]
+        hrefs = [a.getAttribute('href') for a in excerpt.getElementsByTagName('a')]
+        self.assertEqual('http://example.com.nyud.net:8080/foo.png', hrefs[0])
+        self.assertEqual(4, len(hrefs))
+
+    def test_tree_filter_chain_boundary(self):
+        config.load('tests/data/filter/stripAd-yahoo.ini')
+        config.parser.set('Planet', 'filters',
+            'coral_cdn_filter.py stripAd/yahoo.sed excerpt.py')
+
+        testfile = 'tests/data/filter/stripAd-yahoo.xml'
+        output = shell.run_filters(config.filters(),
+            xml.dom.minidom.parse(testfile))
+
+        dom = xml.dom.minidom.parseString(output)
+        excerpt = dom.getElementsByTagName('planet:excerpt')[0]
+        self.assertEqual(u'before--after',
+            excerpt.firstChild.firstChild.nodeValue)
+
+    def test_resolve_cache(self):
+        config.load('tests/data/filter/excerpt-images.ini')
+        resolved = shell.resolve('excerpt.py', mode="filter")
+        self.assertTrue(resolved[0].endswith('excerpt.py'))
+        self.assertEqual('img', resolved[2]['omit'])
+
+        # callers receive their own copy of the options
+        resolved[2]['omit'] = 'a'
+        self.assertEqual('img', shell.resolve('excerpt.py', mode="filter")[2]['omit'])
+
+        # reloading the configuration starts afresh
+        self.assertTrue(shell.resolved_cache)
+        config.load('tests/data/filter/excerpt-images2.ini')
+        self.assertFalse(shell.resolved_cache)
+
+    def test_filter_cache(self):
+        import os, shutil
+        config.load('tests/data/filter/excerpt-images.ini')
+        config.parser.set('Planet', 'cache_directory', 'tests/work/filter')
+        config.parser.set('Planet', 'filter_cache', 'true')
+        config.parser.set('Planet', 'filters', 'coral_cdn_filter.py')
+
+        try:
+            testfile = open('tests/data/filter/coral_cdn.xml').read()
+            output = shell.run_filters(config.filters(), testfile)
+            self.assertTrue(output.find('.nyud.net:8080') > 0)
+
+            # a second run with the same input is served from the cache
+            store = shell.filter_cache()
+            files = store.files()
+            self.assertEqual(1, len(files))
+            open(files[0][2], 'w').write('<cached/>')
+            self.assertEqual('<cached/>',
+                shell.run_filters(config.filters(), testfile))
+
+            # changing the options invalidates the result
+            config.parser.set('Planet', 'filters', 'coral_cdn_filter.py?x=1')
+            self.assertEqual(output,
+                shell.run_filters(config.filters(), testfile))
+        finally:
+            shutil.rmtree('tests/work')
+
+    def test_plugin_threads(self):
+        import sys, os
+        from threading import Thread
+        from planet.shell import plugin
+        script = os.path.realpath('tests/data/filter/echo.plugin')
+        stdout = sys.stdout
+        results = {}
+
+        def echo(i):
+            results[i] = plugin.run(script, 'doc%d' % i,
+                options={'prefix': 'p%d' % i})
+
+        threads = [Thread(target=echo, args=(i,)) for i in range(8)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+
+        for i in range(8):
+            self.assertEqual('p%d doc%d\n' % (i,i), results[i])
+        self.assertTrue(sys.stdout is stdout)
+        self.assertEqual(1, len([name for name in plugin.compiled
+            if name.endswith('echo.plugin')]))
+
     def test_stripAd_yahoo(self):
         testfile = 'tests/data/filter/stripAd-yahoo.xml'
         config.load('tests/data/filter/stripAd-yahoo.ini')
@@ -82,6 +175,34 @@ class FilterTests(unittest.TestCase):
         self.assertEqual(u'before--after',
             excerpt.firstChild.firstChild.nodeValue)
 
+    def test_sed_builtin(self):
+        import os, glob
+        from planet.shell import sed
+        for script in glob.glob('filters/stripAd/*.sed'):
+            self.assertTrue(sed.load(os.path.realpath(script)) is not None)
+
+        script = os.path.realpath('filters/stripAd/feedburner.sed')
+        ad = '<p><a href="http://feeds.example.com/~a/abc?a=X1">' + \
+            '<img border="0" src="http://feeds.example.com/~a/abc?i=X1"/>' + \
+            '</a></p>'
+        self.assertEqual('before--after\n',
+            sed.run(script, 'before-' + ad + '-after\n'))
+
+        commands = sed.compile_script('2,/c/d\n$!s/\\(.\\)x*/&\\1/g\n')
+        self.assertEqual('aa\ndd\ne', sed.execute(commands, 'a\nb\nc\nd\ne'))
+
+    def test_sed_fallback(self):
+        import os, shutil
+        from planet.shell import sed
+        os.makedirs('tests/work')
+        try:
+            script = os.path.realpath('tests/work/double.sed')
+            open(script, 'w').write('p\n')
+            self.assertEqual(None, sed.load(script))
+            self.assertEqual('a\na\n', sed.run(script, 'a\n'))
+        finally:
+            shutil.rmtree('tests/work')
+
     def test_xpath_filter1(self):
         config.load('tests/data/filter/xpath-sifter.ini')
         self.verify_xpath()
@@ -173,8 +294,8 @@ try:
             pass
 
     if _no_sed:
-        logger.warn("sed is not available => can't test stripAd_yahoo")
-        del FilterTests.test_stripAd_yahoo      
+        logger.warn("sed is not available => can't test sed fallback")
+        del FilterTests.test_sed_fallback
 
     try:
         import libxml2
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+import unittest, os, shutil, time
+from planet import manifest, config, splice
+
+workdir = 'tests/work/manifest'
+
+class ManifestTest(unittest.TestCase):
+    def setUp(self):
+        try:
+            os.makedirs(workdir)
+        except:
+            self.tearDown()
+            os.makedirs(workdir)
+
+    def tearDown(self):
+        shutil.rmtree(os.path.split(workdir)[0])
+
+    def manifest(self):
+        return manifest.Manifest(os.path.join(workdir, 'output'),
+            os.path.join(workdir, 'cache', 'manifest'))
+
+    def test_write_if_changed(self):
+        output = self.manifest()
+        self.assertTrue(output.write('index.html', 'one'))
+        self.assertTrue(output.write('sub/feed.xml', 'two'))
+        self.assertFalse(output.write('index.html', 'one'))
+        self.assertEqual(['index.html', 'sub/feed.xml'], output.changed())
+        output.save()
+
+        # a new run leaves unchanged content, and its mtime, alone
+        path = os.path.join(workdir, 'output', 'index.html')
+        os.utime(path, (0, 0))
+        output = self.manifest()
+        output.entries['index.html'] = output.entries['index.html'][:2] + (0,)
+        self.assertFalse(output.write('index.html', 'one'))
+        self.assertEqual(0, os.stat(path).st_mtime)
+        self.assertTrue(output.write('sub/feed.xml', 'three'))
+        self.assertEqual(['sub/feed.xml'], output.changed())
+        self.assertEqual('three',
+            open(os.path.join(workdir, 'output', 'sub/feed.xml')).read())
+
+    def test_modified_output(self):
+        output = self.manifest()
+        output.write('index.html', 'one')
+        output.save()
+
+        # files changed or removed by others are rewritten
+        path = os.path.join(workdir, 'output', 'index.html')
+        open(path, 'w').write('edited')
+        self.assertTrue(self.manifest().write('index.html', 'one'))
+        os.unlink(path)
+        self.assertTrue(self.manifest().write('index.html', 'one'))
+        self.assertEqual('one', open(path).read())
+        self.assertEqual([], [file for file in os.listdir(os.path.dirname(path))
+            if file.find('.tmp') >= 0])
+
+    def test_remove(self):
+        output = self.manifest()
+        output.write('index.html', 'one')
+        output.save()
+
+        output = self.manifest()
+        output.remove('index.html')
+        output.save()
+        self.assertFalse(os.path.exists(os.path.join(workdir, 'output',
+            'index.html')))
+        self.assertEqual({}, self.manifest().entries)
+
+    def test_apply_unchanged(self):
+        config.load('tests/data/apply/config-fancy.ini')
+        config.parser.set('Planet', 'output_dir', workdir + '/output')
+        config.parser.set('Planet', 'cache_directory', workdir + '/cache')
+        config.parser.set('Planet', 'template_files', 'rss20.xml.tmpl')
+        feed = open('tests/data/apply/feed.xml').read()
+
+        self.assertTrue('rss20.xml' in splice.apply(feed))
+        path = os.path.join(workdir, 'output', 'rss20.xml')
+        mtime = os.stat(path).st_mtime
+        self.assertEqual([], splice.apply(feed))
+        self.assertEqual(mtime, os.stat(path).st_mtime)
+        self.assertEqual([], [file for file in
+            os.listdir(os.path.join(workdir, 'cache', 'output'))
+            if file != 'manifest'])
+
+    def test_precompress(self):
+        import gzip
+        output = manifest.Manifest(os.path.join(workdir, 'output'),
+            os.path.join(workdir, 'cache', 'manifest'), True)
+        output.write('index.html', 'one' * 100)
+        path = os.path.join(workdir, 'output', 'index.html.gz')
+        self.assertEqual('one' * 100, gzip.open(path).read())
+        output.save()
+
+        # compressed copies are only regenerated if the content changes
+        os.utime(path, (0, 0))
+        output = manifest.Manifest(os.path.join(workdir, 'output'),
+            os.path.join(workdir, 'cache', 'manifest'), True)
+        output.entries['index.html.gz'] = \
+            output.entries['index.html.gz'][:2] + (0,)
+        output.write('index.html', 'one' * 100)
+        self.assertEqual(0, os.stat(path).st_mtime)
+        output.write('index.html', 'two')
+        self.assertEqual('two', gzip.open(path).read())
+
+        output.remove('index.html')
+        self.assertFalse(os.path.exists(path))
+
+    def test_precompress_disabled(self):
+        output = manifest.Manifest(os.path.join(workdir, 'output'),
+            os.path.join(workdir, 'cache', 'manifest'), True)
+        output.write('index.html', 'one')
+        output.save()
+        other = os.path.join(workdir, 'output', 'other.html.gz')
+        open(other, 'w').write('not ours')
+
+        # compressed copies are removed once precompression is turned off,
+        # even if the content has not changed
+        output = self.manifest()
+        self.assertFalse(output.write('index.html', 'one'))
+        output.write('other.html', 'two')
+        self.assertFalse(os.path.exists(os.path.join(workdir, 'output',
+            'index.html.gz')))
+        self.assertFalse(output.entries.has_key('index.html.gz'))
+        self.assertTrue(os.path.exists(other))
+
+    def test_apply_etags(self):
+        import json
+        config.load('tests/data/apply/config-fancy.ini')
+        config.parser.set('Planet', 'output_dir', workdir + '/output')
+        config.parser.set('Planet', 'cache_directory', workdir + '/cache')
+        config.parser.set('Planet', 'template_files', 'rss20.xml.tmpl')
+        config.parser.set('Planet', 'precompress', 'true')
+        config.parser.set('Planet', 'etag_manifest', 'etags.json')
+        feed = open('tests/data/apply/feed.xml').read()
+
+        changed = splice.apply(feed)
+        for name in ['rss20.xml', 'rss20.xml.gz', 'images/jdub.png.gz']:
+            self.assertTrue(name in changed, name)
+        path = os.path.join(workdir, 'output', 'etags.json')
+        etags = json.load(open(path))
+        self.assertTrue(etags['rss20.xml.gz'].startswith('"'))
+        self.assertFalse(etags.has_key('etags.json'))
+
+        mtime = os.stat(path).st_mtime
+        self.assertEqual([], splice.apply(feed))
+        self.assertEqual(mtime, os.stat(path).st_mtime)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+import unittest, os, shutil, time
+from planet import memo
+
+workdir = 'tests/work/memo'
+
+class MemoTest(unittest.TestCase):
+    def setUp(self):
+        try:
+            os.makedirs(workdir)
+        except:
+            self.tearDown()
+            os.makedirs(workdir)
+
+    def tearDown(self):
+        shutil.rmtree(os.path.split(workdir)[0])
+
+    def test_digest(self):
+        self.assertEqual(memo.digest('ab', 'c'), memo.digest('ab', 'c'))
+        self.assertEqual(memo.digest(u'\xe9'), memo.digest('\xc3\xa9'))
+        self.assertNotEqual(memo.digest('ab', 'c'), memo.digest('a', 'bc'))
+
+    def test_get_put(self):
+        store = memo.Memo(workdir, 1024)
+        key = memo.digest('input')
+        self.assertEqual(None, store.get(key))
+        store.put(key, 'output')
+        self.assertEqual('output', store.get(key))
+
+        # empty results are remembered too
+        key = memo.digest('dropped')
+        store.put(key, '')
+        self.assertEqual('', store.get(key))
+
+        # results are shared with other instances
+        self.assertEqual('', memo.Memo(workdir, 1024).get(key))
+
+    def test_prune(self):
+        store = memo.Memo(workdir, 1000)
+        keys = [memo.digest(str(i)) for i in range(5)]
+        for i, key in enumerate(keys):
+            store.put(key, 'x' * 200)
+            os.utime(store.path(key), (i, i))
+
+        # use the oldest, then overflow
+        store.get(keys[0])
+        store.put(memo.digest('new'), 'x' * 200)
+
+        self.assertTrue(store.size <= 750)
+        self.assertEqual('x' * 200, store.get(keys[0]))
+        self.assertEqual('x' * 200, store.get(memo.digest('new')))
+        self.assertEqual(None, store.get(keys[1]))
+        self.assertEqual(None, store.get(keys[2]))
+
+    def test_size(self):
+        store = memo.Memo(workdir, 1000)
+        key = memo.digest('input')
+        os.makedirs(os.path.dirname(store.path(key)))
+        open(store.path(key) + '.tmp0', 'w').write('x' * 2000)
+
+        # results still being written are not counted
+        store.put(key, 'x' * 200)
+        self.assertEqual(200, store.size)
+
+        # nor are replaced results
+        for i in range(10): store.put(key, 'y' * 300)
+        self.assertEqual(300, store.size)
+        self.assertEqual('y' * 300, store.get(key))
@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 
 import unittest, os, sys, glob, new, re, StringIO, time
-from planet import feedparser
+from planet import feedparser, logger
+from planet import reconstitute as builders
 from planet.reconstitute import reconstitute
 from planet.scrub import scrub
 
@@ -10,6 +11,22 @@ testfiles = 'tests/data/reconstitute/%s.xml'
 class ReconstituteTest(unittest.TestCase):
     desc_re = re.compile("Description:\s*(.*?)\s*Expect:\s*(.*)\s*-->")
     simple_re = re.compile("^(\S+) == (u?'[^']*'|\([0-9, ]+\))$")
+    builder = 'minidom'
+
+    def setUp(self):
+        self.original_builder = builders.builder
+        builders.builder = self.builder
+
+    def tearDown(self):
+        builders.builder = self.original_builder
+
+    def reconstitute(self, name, data):
+        """ parse and reconstitute a test case to a string """
+        work = StringIO.StringIO()
+        results = feedparser.parse(data)
+        scrub(testfiles%name, results)
+        reconstitute(results, results.entries[0]).writexml(work)
+        return work.getvalue().encode('utf-8')
 
     def eval(self, name):
         # read the test case
@@ -21,14 +38,8 @@ class ReconstituteTest(unittest.TestCase):
         except:
             raise RuntimeError, "can't parse %s" % name
 
-        # parse and reconstitute to a string
-        work = StringIO.StringIO()
-        results = feedparser.parse(data)
-        scrub(testfiles%name, results)
-        reconstitute(results, results.entries[0]).writexml(work)
-
         # verify the results
-        results = feedparser.parse(work.getvalue().encode('utf-8'))
+        results = feedparser.parse(self.reconstitute(name, data))
         if 'illegal' not in name:
             self.assertFalse(results.bozo, 'xml is well formed')
         if not self.simple_re.match(expect):
@@ -37,9 +48,50 @@ class ReconstituteTest(unittest.TestCase):
             lhs, rhs = self.simple_re.match(expect).groups()
             self.assertEqual(eval(rhs), eval(lhs, results.entries[0]))
 
+    def test_date_format(self):
+        from xml.dom import minidom
+        from planet import config
+        config.load('tests/data/splice/config.ini')
+        doc = minidom.parseString('<entry/>')
+
+        # the configured format is used, even once it has been changed
+        for format, expected in [('%Y', '1970'), ('%d %b', '01 Jan')]:
+            config.parser.set('Planet', 'date_format', format)
+            builders.date(doc.documentElement, 'updated', time.gmtime(0))
+            self.assertEqual(expected, doc.documentElement.lastChild.
+                getAttribute('planet:format'))
+
 # build a test method for each test file
 for testcase in glob.glob(testfiles % '*'):
     root = os.path.splitext(os.path.basename(testcase))[0]
     func = lambda self, name=root: self.eval(name)
     method = new.instancemethod(func, None, ReconstituteTest)
     setattr(ReconstituteTest, "test_" + root, method)
+
+class LxmlReconstituteTest(ReconstituteTest):
+    """ the same tests, with entries built by lxml """
+    builder = 'lxml'
+
+    def reconstitute(self, name, data):
+        # entries without dates are given the current time, which is held
+        # still while the output of the two builders is compared
+        gmtime, now = time.gmtime, time.gmtime()
+        time.gmtime = lambda *args: args and gmtime(*args) or now
+        try:
+            output = ReconstituteTest.reconstitute(self, name, data)
+
+            # minidom writes characters which are not allowed in XML as they
+            # are, where lxml can not; otherwise the output is the same
+            if 'illegal' not in name:
+                builders.builder = 'minidom'
+                self.assertEqual(output,
+                    ReconstituteTest.reconstitute(self, name, data))
+        finally:
+            time.gmtime = gmtime
+            builders.builder = self.builder
+
+        return output
+
+if not builders.lxmldom:
+    logger.warn("lxml is not available => can't test the lxml builder")
+    del LxmlReconstituteTest
@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 
-import unittest, StringIO, time
+import unittest, StringIO, time, os, shutil
 from copy import deepcopy
+from planet import scrub as scrubber
 from planet.scrub import scrub
 from planet import feedparser, config
 
@@ -122,3 +123,62 @@ class ScrubTest(unittest.TestCase):
         scrub('testfeed', data)
         self.assertEqual('http://example.org/data/',
              data.entries[0].title_detail.base)
+
+    def test_scrub_fragment(self):
+        base = feedparser.parse(feed.replace('<content>F&amp;ouml;o',
+            '<content type="html">&lt;a href="x"&gt;F&amp;ouml;o&lt;/a&gt;'))
+
+        config.parser.readfp(StringIO.StringIO(configData))
+        config.parser.set('testfeed', 'xml_base', 'http://example.org/data/')
+        data = deepcopy(base)
+        scrub('testfeed', data)
+
+        # content is parsed, resolved and sanitized once, and kept as a tree
+        content = data.entries[0].content[0]
+        self.assertEqual('<a href="http://example.org/data/x">F\xc3\xb6o</a>',
+            content.value)
+        self.assertEqual('<div xmlns="http://www.w3.org/1999/xhtml">' +
+            content.value + '</div>', content.fragment.toxml('utf-8'))
+
+    def test_scrub_sanitize_cache(self):
+        base = feedparser.parse(feed.replace('<content>F&amp;ouml;o',
+            '<content type="html">&lt;a href="x"&gt;F&amp;ouml;o&lt;/a&gt;'))
+
+        config.parser.readfp(StringIO.StringIO(configData))
+        config.parser.set('testfeed', 'xml_base', 'http://example.org/data/')
+        if not config.parser.has_section('Planet'):
+            config.parser.add_section('Planet')
+        config.parser.set('Planet', 'cache_directory', 'tests/work/sanitize')
+        config.parser.set('Planet', 'sanitize_cache', 'true')
+        try:
+            data = deepcopy(base)
+            scrub('testfeed', data)
+            fresh = data.entries[0].content[0]
+            self.assertTrue(os.listdir('tests/work/sanitize/sanitized'))
+
+            # the same markup is restored from the cache, not sanitized
+            original = scrubber.sanitize_cache().get
+            scrubber.sanitize_cache().get = lambda key: \
+                original(key).replace('F\xc3\xb6o', 'cached')
+            data = deepcopy(base)
+            scrub('testfeed', data)
+            cached = data.entries[0].content[0]
+            self.assertEqual(fresh.type, cached.type)
+            self.assertEqual('<a href="http://example.org/data/x">cached</a>',
+                cached.value)
+            self.assertEqual('<div xmlns="http://www.w3.org/1999/xhtml">' +
+                cached.value + '</div>', cached.fragment.toxml('utf-8'))
+
+            del scrubber.sanitize_cache().get
+
+            # but not when the base differs
+            config.parser.set('testfeed', 'xml_base', 'http://example.org/')
+            data = deepcopy(base)
+            scrub('testfeed', data)
+            self.assertEqual('<a href="http://example.org/x">F\xc3\xb6o</a>',
+                data.entries[0].content[0].value)
+        finally:
+            config.parser.remove_option('Planet', 'sanitize_cache')
+            config.parser.remove_option('Planet', 'cache_directory')
+            scrubber.sanitize_caches.clear()
+            shutil.rmtree('tests/work')
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+import unittest, os, shutil, json
+from subprocess import Popen, PIPE
+from planet import config, search, splice, logger
+
+workdir = 'tests/work/search'
+
+class SearchTest(unittest.TestCase):
+    def setUp(self):
+        try:
+            os.makedirs(workdir)
+        except:
+            self.tearDown()
+            os.makedirs(workdir)
+
+        shutil.copytree('tests/data/splice/cache', workdir + '/cache')
+        if os.path.exists(workdir + '/cache/index'):
+            shutil.rmtree(workdir + '/cache/index')
+
+        config.load('tests/data/splice/config.ini')
+        config.parser.set('Planet', 'cache_directory', workdir + '/cache')
+        config.parser.set('Planet', 'output_dir', workdir + '/output')
+        config.parser.set('Planet', 'template_files', '')
+        config.parser.set('Planet', 'search_index', 'true')
+
+    def tearDown(self):
+        shutil.rmtree(os.path.split(workdir)[0])
+
+    def query(self, word):
+        """ the titles of the documents containing a word """
+        path = os.path.join(workdir, 'output', 'search')
+        documents = json.load(open(os.path.join(path, 'documents.json')))
+        try:
+            shard = json.load(open(os.path.join(path,
+                search.shard(word) + '.json')))
+        except IOError:
+            return []
+        if not shard.has_key(word): return []
+        return sorted([documents[number][0]
+            for number in search.decode(shard[word])])
+
+    def test_postings(self):
+        numbers = [0, 1, 35, 36, 1300]
+        self.assertEqual('0,1,y,1,z4', search.encode(numbers))
+        self.assertEqual(numbers, search.decode(search.encode(numbers)))
+        self.assertEqual('re', search.shard('red'))
+        self.assertEqual('_', search.shard(u'\xe9t\xe9'))
+        self.assertEqual(set(['the', 'red', 'planet']),
+            search.words(u'The Red_Planet, the 1'))
+
+    def test_search_js(self):
+        # queries are split into words exactly as entries are
+        text = u'Don\u2019t foo\u2014bar, a_b c-d x\xa0yy \u0101\u0101 x1'
+        self.assertEqual(set([u'don\u2019t', u'foo\u2014bar', u'yy',
+            u'\u0101\u0101', u'x1']), search.words(text))
+
+        script = open('themes/common/search.js').read() + '''
+            var text = require('fs').readFileSync(0, 'utf8');
+            process.stdout.write(JSON.stringify(planetSearchWords(text)));'''
+        node = Popen(['node', '-e', script], stdin=PIPE, stdout=PIPE)
+        output = node.communicate(text.encode('utf-8'))[0]
+        self.assertEqual(search.words(text), set(json.loads(output)))
+
+    def test_search(self):
+        changed = splice.apply(splice.splice())
+        self.assertTrue('search/documents.json' in changed)
+        self.assertEqual(['Mars', 'Mars', 'Mars'], self.query('red'))
+        self.assertEqual(['Venus'], self.query('jewel'))
+        self.assertEqual(2, len(self.query('morning')))
+
+        # unchanged entries are not indexed again
+        self.assertEqual([], splice.apply(splice.splice()))
+
+        # only the shards of changed and expunged entries are rewritten
+        for name in os.listdir(workdir + '/cache'):
+            if name.startswith('planet.intertwingly.net,2006,testfeed1,'):
+                os.unlink(os.path.join(workdir, 'cache', name))
+        entry = workdir + '/cache/planet.intertwingly.net,2006,testfeed2,4'
+        data = open(entry).read().replace('the Red Planet', 'the Fourth')
+        open(entry, 'w').write(data)
+
+        changed = splice.apply(splice.splice())
+        self.assertTrue('search/fo.json' in changed)
+        self.assertTrue('search/re.json' in changed)
+        self.assertFalse('search/mo.json' in changed)
+        self.assertEqual(['Mars'], self.query('red'))
+        self.assertEqual(['Mars'], self.query('fourth'))
+        self.assertEqual([], self.query('jewel'))
+        self.assertEqual(2, len(self.query('morning')))
+
+        # expunged entries are no longer listed
+        documents = json.load(open(workdir + '/output/search/documents.json'))
+        self.assertEqual(8, len([doc for doc in documents if doc]))
+
+        # an index recorded by an earlier version is rebuilt
+        index = workdir + '/cache/output/search/'
+        open(index + 'version', 'w').write('1')
+        open(index + 'zq.json', 'w').write('{"zqx":"0"}')
+        open(workdir + '/output/search/zq.json', 'w').write('{"zqx":"0"}')
+        splice.apply(splice.splice())
+        self.assertFalse(os.path.exists(workdir + '/output/search/zq.json'))
+        self.assertEqual(['Mars'], self.query('red'))
+        self.assertEqual(2, len(self.query('morning')))
+
+try:
+    Popen(['node', '--version'], stdout=PIPE).communicate()
+except OSError:
+    logger.warn("node is not available => can't test search.js")
+    del SearchTest.test_search_js
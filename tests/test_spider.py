@@ -82,6 +82,17 @@ class SpiderTest(unittest.TestCase):
         self.spiderFeed(testfeed % '1b')
         self.assertEqual(1, len(glob.glob(workdir+"/*")))
 
+    def test_spiderFeed_malformed_filter(self):
+        config.load(configfile)
+        open(workdir + '/truncate.py', 'w').write(
+            'import sys\nsys.stdout.write(sys.stdin.read()[:-20])\n')
+        config.parser.set('Planet', 'filter_directories', workdir)
+        config.parser.set('Planet', 'filters', 'truncate.py')
+
+        # entries which are not well formed are not cached
+        self.spiderFeed(testfeed % '1b')
+        self.assertEqual(0, len(glob.glob(workdir+"/planet*")))
+
     def test_spiderFeed_blacklist(self):
         config.load(configfile)
         self.spiderFeed(testfeed % '1b')
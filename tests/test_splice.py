@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
 import unittest
-from planet.splice import splice, config
+from planet.splice import splice, stream, config
 
 configfile = 'tests/data/splice/config.ini'
 
@@ -32,3 +32,134 @@ class SpliceTest(unittest.TestCase):
         self.assertEqual(9,len(doc.getElementsByTagName('entry')))
         self.assertEqual(4,len(doc.getElementsByTagName('planet:source')))
         self.assertEqual(13,len(doc.getElementsByTagName('planet:name')))
+
+    def test_splice_model(self):
+        from planet.model import Model
+        from planet.shell import tmpl
+        config.load(configfile)
+        doc = splice()
+        model = Model(doc)
+
+        # the spliced document is used directly, and serialized on demand
+        self.assertTrue(model.dom() is doc)
+        self.assertFalse(model.memo)
+        self.assertEqual(doc.toxml('utf-8'), str(model))
+        self.assertTrue(str(model) is str(model))
+
+        items = tmpl.template_info(model)['Items']
+        self.assertEqual(12, len(items))
+        self.assertEqual(tmpl.template_info(doc.toxml('utf-8'))['Items'], items)
+
+        model.close()
+        self.assertFalse(model.memo)
+
+    def test_splice_stream(self):
+        from planet.model import Model
+        from xml.dom import minidom
+        config.load(configfile)
+        expected = splice().toxml('utf-8')
+
+        # the cached entries are streamed as they are
+        pieces = list(stream())
+        self.assertEqual(14, len(pieces))
+        self.assertFalse(pieces[1].startswith('<?xml'))
+        self.assertEqual(expected,
+            minidom.parseString(''.join(pieces)).toxml('utf-8'))
+
+        # a model reads its stream once, and spools it for later use
+        model = Model(stream())
+        streamed = ''.join(model.stream())
+        self.assertEqual(''.join(pieces), streamed)
+        self.assertEqual(streamed, ''.join(model.stream()))
+        self.assertFalse(model.memo.has_key('xml'))
+        self.assertTrue(str(model) is str(model))
+        self.assertEqual([streamed], model.stream())
+        self.assertEqual(12, len(model.dom().getElementsByTagName('entry')))
+        model.close()
+
+    def test_splice_stream_template(self):
+        import os, shutil
+        from planet import shell
+        from planet.model import Model
+        config.load(configfile)
+        try:
+            os.makedirs('tests/work/splice')
+            open('tests/work/splice/copy.xml.py', 'w').write(
+                'import sys\nsys.stdout.write(sys.stdin.read())\n')
+            config.parser.set('Planet', 'template_directories',
+                'tests/work/splice')
+
+            # templates which read stdin are fed the stream as it is read
+            model = Model(stream())
+            output = shell.run('copy.xml.py', model,
+                output_dir='tests/work/splice')
+            self.assertEqual(str(model), open(output).read())
+        finally:
+            shutil.rmtree('tests/work')
+
+    def test_splice_stream_malformed(self):
+        import os, shutil, planet
+        from xml.dom import minidom
+        config.load(configfile)
+        try:
+            shutil.copytree('tests/data/splice/cache', 'tests/work/cache')
+            config.parser.set('Planet', 'cache_directory', 'tests/work/cache')
+            entry = 'tests/work/cache/planet.intertwingly.net,2006,testfeed1,1'
+            data = open(entry).read()
+            open(entry, 'w').write(data[:data.rindex('</entry>')])
+
+            # a damaged entry is skipped, rather than spoiling the document
+            logger = planet.logger
+            planet.getLogger('CRITICAL', None)
+            try:
+                doc = minidom.parseString(''.join(stream()))
+            finally:
+                planet.logger = logger
+            self.assertEqual(11, len(doc.getElementsByTagName('entry')))
+        finally:
+            shutil.rmtree('tests/work')
+
+    def test_splice_stream_unread(self):
+        import os, shutil, pickle
+        from planet import splice as splicer
+        config.load(configfile)
+        posted = []
+        class Api:
+            def update_status(self, text): posted.append(text)
+        posted_urls_file = splicer.posted_urls_file
+        try:
+            os.makedirs('tests/work')
+            splicer.posted_urls_file = 'tests/work/posted_urls.pickle'
+            config.twitter_api = Api()
+            config.parser.set('Planet', 'post_to_twitter', 'true')
+            config.parser.set('Planet', 'template_files', '')
+            config.parser.set('Planet', 'output_dir', 'tests/work/output')
+            config.parser.set('Planet', 'cache_output_directory',
+                os.path.abspath('tests/work/cache'))
+
+            # entries are posted even when no template reads the stream
+            self.assertEqual([], splicer.apply(stream()))
+            self.assertEqual(4, len(posted))
+            self.assertEqual(set(['http://example.com/%d' % i
+                for i in range(1, 5)]),
+                pickle.load(open(splicer.posted_urls_file, 'rb')))
+        finally:
+            splicer.posted_urls_file = posted_urls_file
+            del config.twitter_api
+            shutil.rmtree('tests/work')
+
+    def test_source_ids(self):
+        from planet.splice import source_ids
+        entry = open('tests/data/splice/cache/' +
+            'planet.intertwingly.net,2006,testfeed1,1').read()
+        self.assertEqual([u'tag:planet.intertwingly.net,2006:testfeed1', None],
+            source_ids(entry))
+
+        # entries are only parsed when their source is written differently
+        self.assertEqual([u'tag:a&b', u'x'], source_ids('<entry><source>' +
+            '<id>tag:a&amp;b</id><planet:id>x</planet:id></source></entry>'))
+        self.assertEqual([u'tag:\xe9', None], source_ids('<entry ' +
+            'xmlns:atom="http://www.w3.org/2005/Atom"><atom:source ' +
+            'xmlns="http://www.w3.org/2005/Atom"><id>tag:&#233;</id>' +
+            '</atom:source></entry>'))
+        self.assertEqual([None, None], source_ids('<entry/>'))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+import unittest, os, shutil
+import planet
+from planet import config, idindex, splice
+from planet.spider import spiderPlanet
+
+workdir = 'tests/work/subscriptions'
+
+class SubscriptionsTest(unittest.TestCase):
+    def setUp(self):
+        # silence errors
+        self.original_logger = planet.logger
+        planet.getLogger('CRITICAL',None)
+
+        try:
+            os.makedirs(workdir)
+        except:
+            self.tearDown()
+            os.makedirs(workdir)
+
+        open(workdir + '/ids.html.tmpl', 'w').write(
+            '<TMPL_LOOP Items>[<TMPL_VAR id>]</TMPL_LOOP>')
+
+        config.load('tests/data/spider/config.ini')
+        config.parser.set('Planet', 'cache_directory', workdir + '/cache')
+        config.parser.set('Planet', 'output_dir', workdir + '/output')
+        config.parser.set('Planet', 'template_directories', workdir)
+        config.parser.set('Planet', 'subscription_templates', 'ids.html.tmpl')
+
+    def tearDown(self):
+        shutil.rmtree(os.path.split(workdir)[0])
+        planet.logger = self.original_logger
+
+    def page(self, id):
+        return open(os.path.join(workdir, 'output', 'subscriptions',
+            'planet.intertwingly.net,2006,' + id, 'ids.html')).read().count('[')
+
+    def test_indexed(self):
+        idindex.create().close()
+        spiderPlanet()
+        self.assertEqual(3, len(idindex.touched()))
+
+        changed = splice.apply(splice.splice())
+        self.assertEqual(3, len(changed))
+        self.assertEqual(4, self.page('testfeed1'))
+        self.assertEqual(4, self.page('testfeed2'))
+        self.assertEqual(set(), idindex.touched())
+
+        # feeds whose entries are unchanged are not touched, or rendered
+        spiderPlanet()
+        for id in idindex.touched():
+            self.assertFalse(id.startswith('tag:planet.intertwingly.net'))
+        idindex.reset()
+        self.assertEqual([], splice.apply(splice.splice()))
+
+        # only the pages of touched feeds are rendered again
+        for name in os.listdir(workdir + '/cache'):
+            if name.startswith('planet.intertwingly.net,2006,testfeed'):
+                os.unlink(os.path.join(workdir, 'cache', name))
+        idindex.touch(['tag:planet.intertwingly.net,2006:testfeed2'])
+        changed = splice.apply(splice.splice())
+        self.assertEqual(
+            ['subscriptions/planet.intertwingly.net,2006,testfeed2/ids.html'],
+            changed)
+        self.assertEqual(0, self.page('testfeed2'))
+        self.assertEqual(4, self.page('testfeed1'))
+
+    def test_expunged(self):
+        from planet.expunge import expungeCache
+        idindex.create().close()
+        spiderPlanet()
+        splice.apply(splice.splice())
+        self.assertEqual(4, self.page('testfeed1'))
+
+        # feeds whose entries are expunged are rendered again
+        config.parser.set('Planet', 'cache_keep_entries', '1')
+        expungeCache()
+        self.assertTrue('tag:planet.intertwingly.net,2006:testfeed1'
+            in idindex.touched())
+        splice.apply(splice.splice())
+        self.assertEqual(1, self.page('testfeed1'))
+        self.assertEqual(1, self.page('testfeed2'))
+
+    def test_scanned(self):
+        spiderPlanet()
+        self.assertEqual(None, idindex.touched())
+        self.assertEqual(3, len(splice.apply(splice.splice())))
+        self.assertEqual(4, self.page('testfeed2'))
+
+        # pages of feeds no longer subscribed to are removed
+        config.parser.remove_section('tests/data/spider/testfeed2.atom')
+        self.assertEqual([], splice.apply(splice.splice()))
+        self.assertFalse(os.path.exists(os.path.join(workdir, 'output',
+            'subscriptions', 'planet.intertwingly.net,2006,testfeed2')))
+        self.assertEqual(4, self.page('testfeed1'))
@@ -0,0 +1,90 @@
+/*
+ * Query the static search index written when search_index is set.
+ *
+ *   planetSearch('search/', 'red planet', function(results) {
+ *     // results is a list of [title, link, updated], newest first, of the
+ *     // entries containing every word in the query
+ *   });
+ *
+ * Only documents.json, and the shards containing the words of the query,
+ * are fetched; each is fetched once per page.
+ */
+
+var planetSearchCache = {};
+
+function planetSearchFetch(url, callback) {
+  if (url in planetSearchCache) return callback(planetSearchCache[url]);
+  var request = new XMLHttpRequest();
+  request.onreadystatechange = function() {
+    if (request.readyState != 4) return;
+    var value = null;
+    if (request.status == 200) value = JSON.parse(request.responseText);
+    planetSearchCache[url] = value;
+    callback(value);
+  };
+  request.open('GET', url, true);
+  request.send(null);
+}
+
+function planetSearchDecode(postings) {
+  var numbers = {}, last = 0, values = postings.split(',');
+  for (var i = 0; i < values.length; i++) {
+    last += parseInt(values[i], 36);
+    numbers[last] = true;
+  }
+  return numbers;
+}
+
+/* the distinct words of a query, separated as planet/search.py does */
+function planetSearchWords(query) {
+  var words = [], seen = {};
+  var found = query.toLowerCase().match(/[^\t\n\v\f\r !-\/:-@\[-`{-~\u00a0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000\ufeff]+/g) || [];
+  for (var i = 0; i < found.length; i++) {
+    if (found[i].length < 2 || found[i].length > 32 || seen[found[i]]) continue;
+    seen[found[i]] = true;
+    words.push(found[i]);
+  }
+  return words;
+}
+
+function planetSearch(base, query, callback) {
+  var words = planetSearchWords(query);
+  if (!words.length) return callback([]);
+
+  var pending = words.length + 1, shards = {}, documents = null;
+  function done() {
+    if (--pending) return;
+
+    var matches = null;
+    for (var i = 0; i < words.length; i++) {
+      var shard = shards[words[i]] || {};
+      var numbers = shard[words[i]] ? planetSearchDecode(shard[words[i]]) : {};
+      if (matches) {
+        for (var number in matches) if (!numbers[number]) delete matches[number];
+      } else {
+        matches = numbers;
+      }
+    }
+
+    var results = [];
+    for (var number in matches) {
+      if (documents && documents[number]) results.push(documents[number]);
+    }
+    results.sort(function(a, b) { return a[2] < b[2] ? 1 : a[2] > b[2] ? -1 : 0; });
+    callback(results);
+  }
+
+  planetSearchFetch(base + 'documents.json', function(value) {
+    documents = value;
+    done();
+  });
+  for (var i = 0; i < words.length; i++) {
+    (function(word) {
+      var name = /^[a-z0-9]{2}/.test(word) ? word.substring(0, 2) : '_';
+      planetSearchFetch(base + name + '.json', function(value) {
+        shards[word] = value;
+        done();
+      });
+    })(words[i]);
+  }
+}